@@ -0,0 +1,205 @@
+"""
+Кэш аватарок для графика топа пользователей
+Аватарка хранится готовой плиткой: 60×60 RGBA с круглой маской. Плитка привязана
+к file_unique_id фотографии профиля, поэтому при повторной проверке скачивание
+нужно только если пользователь сменил фото.
+Два уровня: LRU в памяти (сырые байты RGBA, передаются в пул рендеринга как есть)
+и файлы в AVATAR_CACHE_DIR: <user_id>.png с file_unique_id в текстовом блоке PNG,
+<user_id>.none - у пользователя нет фото. Время последней проверки - mtime файла.
+В пределах AVATAR_CACHE_TTL (для отсутствующих фото - AVATAR_NEGATIVE_TTL) запросов
+к Telegram нет совсем. Используется только из цикла событий asyncio.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageDraw
+from PIL.PngImagePlugin import PngInfo
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import AVATAR_CACHE_DIR, AVATAR_CACHE_TTL, AVATAR_NEGATIVE_TTL, AVATAR_CACHE_SIZE
+except ImportError:
+    AVATAR_CACHE_DIR = os.path.join('data', 'avatars')
+    AVATAR_CACHE_TTL = 6 * 3600
+    AVATAR_NEGATIVE_TTL = 3600
+    AVATAR_CACHE_SIZE = 1000
+
+# Сторона плитки в пикселях (размер аватарки на графике)
+TILE_SIZE = 60
+
+_UNIQUE_ID_KEY = 'file_unique_id'
+
+# Запись кэша: (время проверки по time.time(), file_unique_id, байты RGBA); без фото - (время, None, None)
+_Entry = Tuple[float, Optional[str], Optional[bytes]]
+
+
+def make_tile(image_bytes: bytes) -> bytes:
+    """Плитка из файла изображения: уменьшение до TILE_SIZE и круглая маска (байты RGBA)"""
+    with Image.open(BytesIO(image_bytes)) as source:
+        tile = source.convert('RGB').resize((TILE_SIZE, TILE_SIZE), Image.Resampling.LANCZOS)
+    mask = Image.new('L', (TILE_SIZE, TILE_SIZE), 0)
+    ImageDraw.Draw(mask).ellipse([0, 0, TILE_SIZE, TILE_SIZE], fill=255)
+    tile.putalpha(mask)
+    return tile.tobytes()
+
+
+def tile_image(tile: bytes) -> Image.Image:
+    """Изображение RGBA из байтов плитки"""
+    return Image.frombytes('RGBA', (TILE_SIZE, TILE_SIZE), tile)
+
+
+class AvatarCache:
+    """Двухуровневый кэш плиток аватарок: user_id -> плитка текущего фото профиля"""
+
+    def __init__(self, directory: str = AVATAR_CACHE_DIR, ttl: float = AVATAR_CACHE_TTL,
+                 negative_ttl: float = AVATAR_NEGATIVE_TTL, max_entries: int = AVATAR_CACHE_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, user_id: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{user_id}{suffix}")
+
+    def _remember(self, user_id: int, entry: _Entry):
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _is_fresh(self, entry: _Entry) -> bool:
+        ttl = self.ttl if entry[1] is not None else self.negative_ttl
+        return time.time() - entry[0] < ttl
+
+    # Дисковый уровень (выполняется в пуле потоков)
+
+    def _load_sync(self, user_id: int) -> Optional[_Entry]:
+        """Запись с диска (None, если файла нет или он поврежден)"""
+        try:
+            path = self._path(user_id, '.png')
+            if os.path.exists(path):
+                with Image.open(path) as tile:
+                    unique_id = tile.text.get(_UNIQUE_ID_KEY)
+                    if unique_id and tile.size == (TILE_SIZE, TILE_SIZE):
+                        return os.path.getmtime(path), unique_id, tile.convert('RGBA').tobytes()
+            path = self._path(user_id, '.none')
+            if os.path.exists(path):
+                return os.path.getmtime(path), None, None
+        except Exception as e:
+            logger.debug(f"Не удалось прочитать аватар {user_id} из кэша: {e}")
+        return None
+
+    def _save_sync(self, user_id: int, entry: _Entry):
+        """Записать плитку или отметку «нет фото» (заменяет прежний файл пользователя)"""
+        _, unique_id, tile = entry
+        try:
+            if unique_id is None:
+                open(self._path(user_id, '.none'), 'wb').close()
+                stale = self._path(user_id, '.png')
+            else:
+                info = PngInfo()
+                info.add_text(_UNIQUE_ID_KEY, unique_id)
+                path = self._path(user_id, '.png')
+                tile_image(tile).save(path + '.tmp', format='PNG', pnginfo=info)
+                os.replace(path + '.tmp', path)
+                stale = self._path(user_id, '.none')
+            if os.path.exists(stale):
+                os.remove(stale)
+        except Exception as e:
+            logger.debug(f"Не удалось сохранить аватар {user_id} в кэш: {e}")
+
+    def _touch_sync(self, user_id: int, entry: _Entry):
+        """Отметить повторную проверку: фото не изменилось"""
+        suffix = '.png' if entry[1] is not None else '.none'
+        try:
+            os.utime(self._path(user_id, suffix), (entry[0], entry[0]))
+        except OSError:
+            self._save_sync(user_id, entry)
+
+    # Проверка в Telegram
+
+    async def _revalidate(self, bot, user_id: int, cached: Optional[_Entry]) -> Optional[_Entry]:
+        """
+        Проверить текущее фото профиля; скачать его, только если file_unique_id изменился.
+        При ошибке API возвращается прежняя запись (или None) без записи в кэш.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            photos = await bot.get_user_profile_photos(user_id, limit=1)
+            if not photos or photos.total_count == 0 or not photos.photos:
+                entry = (time.time(), None, None)
+                if cached is not None and cached[1] is None:
+                    await loop.run_in_executor(None, self._touch_sync, user_id, entry)
+                else:
+                    await loop.run_in_executor(None, self._save_sync, user_id, entry)
+                return entry
+
+            # Размеры фото идут по возрастанию: берем наименьший не меньше плитки
+            sizes = photos.photos[0]
+            photo = next((size for size in sizes if min(size.width, size.height) >= TILE_SIZE), sizes[-1])
+            if cached is not None and cached[1] == photo.file_unique_id:
+                entry = (time.time(), cached[1], cached[2])
+                await loop.run_in_executor(None, self._touch_sync, user_id, entry)
+                return entry
+
+            file = await bot.get_file(photo.file_id)
+            data = await bot.download_file(file.file_path)
+            tile = await loop.run_in_executor(None, make_tile, data.getvalue())
+            entry = (time.time(), photo.file_unique_id, tile)
+            await loop.run_in_executor(None, self._save_sync, user_id, entry)
+            return entry
+        except Exception as e:
+            logger.debug(f"Не удалось загрузить аватар для пользователя {user_id}: {e}")
+            return cached
+
+    async def get_tiles(self, user_ids: Iterable[int], bot) -> Dict[int, bytes]:
+        """
+        Плитки аватарок пользователей: user_id -> байты RGBA (пользователи без фото пропускаются).
+        Свежие записи берутся из памяти или с диска, устаревшие проверяются параллельно.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        entries: Dict[int, Optional[_Entry]] = {}
+        missing = []
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                missing.append(user_id)
+            else:
+                self._entries.move_to_end(user_id)
+                entries[user_id] = entry
+
+        if missing:
+            loaded = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: [self._load_sync(user_id) for user_id in missing]
+            )
+            entries.update(zip(missing, loaded))
+
+        stale = [user_id for user_id in user_ids
+                 if entries[user_id] is None or not self._is_fresh(entries[user_id])]
+        if stale:
+            results = await asyncio.gather(
+                *(self._revalidate(bot, user_id, entries[user_id]) for user_id in stale)
+            )
+            entries.update(zip(stale, results))
+
+        tiles = {}
+        for user_id in user_ids:
+            entry = entries[user_id]
+            if entry is None:
+                continue
+            self._remember(user_id, entry)
+            if entry[2] is not None:
+                tiles[user_id] = entry[2]
+        return tiles
+
+
+# Глобальный кэш аватарок
+avatar_cache = AvatarCache()
@@ -18,7 +18,6 @@ Required attribution:
 """
 import argparse
 import asyncio
-import json
 import logging
 import os
 import random
@@ -39,18 +38,28 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from config import BOT_TOKEN, BOT_NAME, BOT_DESCRIPTION, DEBUG, TIMEZONE_DB_PATH, TOP_CHATS_DEFAULTS
+from config import BOT_TOKEN, BOT_NAME, BOT_DESCRIPTION, DEBUG, TOP_CHATS_DEFAULTS, TOP_CHATS_DAYS, TOP_CHATS_PAGE_SIZE
 from database import db
 from moderation_db import moderation_db
 from reputation_db import reputation_db
-from timezone_db import TimezoneDatabase
+from timezone_db import timezone_db
 from scheduler import TaskScheduler
 from command_aliases import get_command_alias, is_command_alias
-from image_generator import generate_modern_profile_card, generate_top_chart, generate_activity_chart
+from image_generator import (
+    generate_modern_profile_card, generate_top_chart, generate_activity_chart, preload_fonts, preload_templates,
+    output_filename, CHART_OUTPUT_PROFILE
+)
+from render_service import render_service, RenderUnavailable
+from render_cache import render_cache, RenderedImage
 from network_db import network_db
 from votemute_db import votemute_db
 from friends_db import friends_db
 from raid_protection_db import raid_protection_db
+from media_registry import media_registry
+from member_cache import chat_member_cache
+from chat_options_store import chat_options_store
+from top_chats_leaderboard import top_chats_leaderboard
+from db_pool import get_connection, close_all_pools
 from raid_protection import raid_protection
 from datetime import datetime, timedelta
 from io import BytesIO
@@ -177,7 +186,7 @@ async def get_effective_rank(chat_id: int, user_id: int) -> int:
     try:
         # Проверяем, является ли пользователь владельцем чата
         try:
-            member = await bot.get_chat_member(chat_id, user_id)
+            member = await chat_member_cache.get(chat_id, user_id)
             if member.status == 'creator':
                 return RANK_OWNER  # Владелец чата всегда имеет ранг владельца
         except Exception:
@@ -258,37 +267,13 @@ def get_user_mention_html(user, enable_link: bool = True) -> str:
         return f"<a href='tg://user?id={user_id}'>ID{user_id}</a>"
 
 
-# Путь к файлу настроек гифок
+# Путь к старому файлу настроек гифок (импортируется в chat_options_store при запуске)
 GIFS_SETTINGS_PATH = Path("data/gifs_settings.json")
 
-# Путь к файлу настроек топа чатов
+# Путь к старому файлу настроек топа чатов (импортируется в chat_options_store при запуске)
 TOP_CHATS_SETTINGS_PATH = Path("data/top_chats_settings.json")
 
 
-def init_json_files():
-    """
-    Инициализация JSON-файлов настроек (создание пустых файлов если их нет)
-    """
-    try:
-        # Создаем папку data если её нет
-        GIFS_SETTINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Создаем пустой JSON-файл для настроек гифок, если его нет
-        if not GIFS_SETTINGS_PATH.exists():
-            with open(GIFS_SETTINGS_PATH, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
-            logger.info("Создан файл gifs_settings.json")
-        
-        # Создаем пустой JSON-файл для настроек топа чатов, если его нет
-        if not TOP_CHATS_SETTINGS_PATH.exists():
-            with open(TOP_CHATS_SETTINGS_PATH, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
-            logger.info("Создан файл top_chats_settings.json")
-            
-    except Exception as e:
-        logger.error(f"Ошибка при инициализации JSON-файлов: {e}")
-
-
 def get_gifs_enabled(chat_id: int) -> bool:
     """
     Получает настройку включения гифок для чата
@@ -299,23 +284,7 @@ def get_gifs_enabled(chat_id: int) -> bool:
     Returns:
         True если гифки включены, False если выключены (по умолчанию False)
     """
-    try:
-        if not GIFS_SETTINGS_PATH.exists():
-            return False  # По умолчанию выключены
-        
-        with open(GIFS_SETTINGS_PATH, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        
-        # Проверяем настройку для конкретного чата
-        chat_id_str = str(chat_id)
-        if chat_id_str in settings:
-            return settings[chat_id_str].get('enabled', False)
-        
-        return False  # По умолчанию выключены
-        
-    except Exception as e:
-        logger.error(f"Ошибка при чтении настроек гифок для чата {chat_id}: {e}")
-        return False  # По умолчанию выключены при ошибке
+    return chat_options_store.get_gifs_enabled(chat_id)
 
 
 def set_gifs_enabled(chat_id: int, enabled: bool) -> bool:
@@ -330,28 +299,8 @@ def set_gifs_enabled(chat_id: int, enabled: bool) -> bool:
         True если успешно, False при ошибке
     """
     try:
-        # Создаем папку data если её нет
-        GIFS_SETTINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Загружаем существующие настройки
-        settings = {}
-        if GIFS_SETTINGS_PATH.exists():
-            with open(GIFS_SETTINGS_PATH, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-        
-        # Обновляем настройку для чата
-        chat_id_str = str(chat_id)
-        if chat_id_str not in settings:
-            settings[chat_id_str] = {}
-        
-        settings[chat_id_str]['enabled'] = enabled
-        
-        # Сохраняем обратно
-        with open(GIFS_SETTINGS_PATH, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        
+        chat_options_store.set_gifs_enabled(chat_id, enabled)
         return True
-        
     except Exception as e:
         logger.error(f"Ошибка при сохранении настроек гифок для чата {chat_id}: {e}")
         return False
@@ -370,32 +319,10 @@ def get_top_chat_settings(chat_id: int) -> dict:
         - show_private_label: bool (по умолчанию False)
         - min_activity_threshold: int (по умолчанию 0)
     """
-    try:
-        # Используем дефолтные значения из config
-        defaults = TOP_CHATS_DEFAULTS.copy()
-        
-        if not TOP_CHATS_SETTINGS_PATH.exists():
-            return defaults
-        
-        with open(TOP_CHATS_SETTINGS_PATH, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        
-        # Проверяем настройки для конкретного чата
-        chat_id_str = str(chat_id)
-        if chat_id_str in settings:
-            chat_settings = settings[chat_id_str]
-            return {
-                'show_in_top': chat_settings.get('show_in_top', defaults['show_in_top']),
-                'show_private_label': chat_settings.get('show_private_label', defaults['show_private_label']),
-                'min_activity_threshold': chat_settings.get('min_activity_threshold', defaults['min_activity_threshold'])
-            }
-        
-        # Возвращаем значения по умолчанию
-        return defaults
-        
-    except Exception as e:
-        logger.error(f"Ошибка при чтении настроек топа чатов для чата {chat_id}: {e}")
-        return TOP_CHATS_DEFAULTS.copy()
+    # Используем дефолтные значения из config
+    settings = TOP_CHATS_DEFAULTS.copy()
+    settings.update(chat_options_store.get_top_chat_settings(chat_id))
+    return settings
 
 
 def set_top_chat_setting(chat_id: int, setting_name: str, value) -> bool:
@@ -411,42 +338,24 @@ def set_top_chat_setting(chat_id: int, setting_name: str, value) -> bool:
         True если успешно, False при ошибке
     """
     try:
-        # Создаем папку data если её нет
-        TOP_CHATS_SETTINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Загружаем существующие настройки
-        settings = {}
-        if TOP_CHATS_SETTINGS_PATH.exists():
-            with open(TOP_CHATS_SETTINGS_PATH, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-        
-        # Обновляем настройку для чата
-        chat_id_str = str(chat_id)
-        if chat_id_str not in settings:
-            settings[chat_id_str] = {}
-        
-        settings[chat_id_str][setting_name] = value
-        
-        # Сохраняем обратно
-        with open(TOP_CHATS_SETTINGS_PATH, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        
+        chat_options_store.set_top_chat_setting(chat_id, setting_name, value)
+        # Снимок топа чатов сразу учитывает новые настройки показа
+        top_chats_leaderboard.reapply_settings()
         return True
-        
     except Exception as e:
         logger.error(f"Ошибка при сохранении настроек топа чатов для чата {chat_id}: {e}")
         return False
 
 
-def get_random_gif(command_name: str) -> Optional[Tuple[BufferedInputFile, str]]:
+def get_random_gif(command_name: str) -> Optional[Tuple[Path, str]]:
     """
-    Получает случайную гифку из папки для команды модерации
+    Выбирает случайную гифку из папки для команды модерации
     
     Args:
         command_name: Название команды (ban, unban, mute, unmute, warn, kick, welcome)
     
     Returns:
-        Кортеж (BufferedInputFile, file_type) где file_type: 'animation' или 'video', 
+        Кортеж (путь к файлу, file_type) где file_type: 'animation' или 'video', 
         или None если папка пустая/не найдена
     """
     try:
@@ -482,23 +391,84 @@ def get_random_gif(command_name: str) -> Optional[Tuple[BufferedInputFile, str]]
         else:
             file_type = 'video'  # По умолчанию как видео
         
-        # Читаем файл
-        with open(selected_file, 'rb') as f:
-            file_data = f.read()
-        
-        # Создаем BufferedInputFile
-        file_obj = BufferedInputFile(
-            file_data,
-            filename=selected_file.name
-        )
-        
-        return (file_obj, file_type)
+        return (selected_file, file_type)
         
     except Exception as e:
         logger.error(f"Ошибка при получении гифки для команды {command_name}: {e}")
         return None
 
 
+async def _send_gif_file(message: Message, gif_path: Path, file_type: str, text: str, parse_mode=None):
+    """
+    Отправляет гифку/видео: по сохраненному file_id, если файл уже загружался и не менялся,
+    иначе загружает файл и запоминает полученный file_id
+    """
+    async def send(media):
+        if file_type == 'animation':
+            # Для .gif и .webm используем answer_animation
+            return await message.answer_animation(
+                animation=media,
+                caption=text,
+                parse_mode=parse_mode
+            )
+        # Для .mp4 и .MOV используем answer_video
+        return await message.answer_video(
+            video=media,
+            caption=text,
+            parse_mode=parse_mode
+        )
+    
+    file_id = media_registry.get_file_id(gif_path, file_type)
+    if file_id:
+        try:
+            await send(file_id)
+            return
+        except Exception as e:
+            # Ошибки, не связанные с файлом (закрытый топик и т.п.), обрабатывает вызывающий код
+            if "file" not in str(e).lower():
+                raise
+            # file_id больше не действителен - загружаем файл заново
+            logger.warning(f"Не удалось отправить {gif_path} по file_id, загружаем заново: {e}")
+            await media_registry.forget(gif_path)
+    
+    # Читаем файл
+    with open(gif_path, 'rb') as f:
+        file_data = f.read()
+    
+    sent = await send(BufferedInputFile(file_data, filename=gif_path.name))
+    
+    # Telegram может вернуть .gif как animation или document, а видео - как video
+    sent_media = sent.animation or sent.video or sent.document
+    if sent_media:
+        await media_registry.remember(gif_path, file_type, sent_media.file_id)
+
+
+async def _send_chart(message: Message, image: RenderedImage, filename: str, **params):
+    """
+    Отправляет график: по file_id, если такое же изображение уже отправлялось,
+    иначе загружает файл и запоминает полученный file_id
+    """
+    if image.file_id:
+        try:
+            return await message.answer_photo(photo=image.file_id, **params)
+        except Exception as e:
+            # Ошибки, не связанные с файлом (закрытый топик и т.п.), обрабатывает вызывающий код
+            if "file" not in str(e).lower():
+                raise
+            # file_id больше не действителен - загружаем изображение заново
+            logger.warning(f"Не удалось отправить {filename} по file_id, загружаем заново: {e}")
+            await render_cache.forget_file_id(image.key)
+    
+    data = image.data if image.data is not None else await render_cache.load(image.key)
+    if data is None:
+        raise RenderUnavailable(f"изображение {filename} отсутствует в кэше")
+    
+    sent = await message.answer_photo(photo=BufferedInputFile(data, filename=filename), **params)
+    if sent.photo:
+        await render_cache.remember_file_id(image.key, sent.photo[-1].file_id)
+    return sent
+
+
 async def send_message_with_gif(message: Message, text: str, command_name: str, parse_mode=None):
     """
     Отправляет сообщение с гифкой/видео, если оно найдено, иначе отправляет только текст
@@ -524,23 +494,8 @@ async def send_message_with_gif(message: Message, text: str, command_name: str,
         result = get_random_gif(command_name)
         
         if result:
-            gif_file, file_type = result
-            
-            # Отправляем в зависимости от типа файла
-            if file_type == 'animation':
-                # Для .gif и .webm используем answer_animation
-                await message.answer_animation(
-                    animation=gif_file,
-                    caption=text,
-                    parse_mode=parse_mode
-                )
-            else:
-                # Для .mp4 и .MOV используем answer_video
-                await message.answer_video(
-                    video=gif_file,
-                    caption=text,
-                    parse_mode=parse_mode
-                )
+            gif_path, file_type = result
+            await _send_gif_file(message, gif_path, file_type, text, parse_mode)
         else:
             # Файл не найден - отправляем только текст
             await message.answer(text, parse_mode=parse_mode)
@@ -614,7 +569,7 @@ async def parse_user_from_args(message: Message, args: list, arg_index: int) ->
             user_id = int(arg)
             # Получаем информацию о пользователе из чата
             try:
-                chat_member = await bot.get_chat_member(chat_id, user_id)
+                chat_member = await chat_member_cache.get(chat_id, user_id)
                 return chat_member.user
             except Exception:
                 # Пользователь не найден в чате или ошибка
@@ -634,7 +589,7 @@ async def parse_user_from_args(message: Message, args: list, arg_index: int) ->
             
             # Проверяем, что пользователь действительно в чате через Telegram API
             try:
-                chat_member = await bot.get_chat_member(chat_id, found_user_id)
+                chat_member = await chat_member_cache.get(chat_id, found_user_id)
                 return chat_member.user
             except Exception as e:
                 # Пользователь не найден в чате, пробуем следующего если есть
@@ -644,7 +599,7 @@ async def parse_user_from_args(message: Message, args: list, arg_index: int) ->
                     for user_data in found_users[1:]:
                         try:
                             found_user_id = user_data['user_id']
-                            chat_member = await bot.get_chat_member(chat_id, found_user_id)
+                            chat_member = await chat_member_cache.get(chat_id, found_user_id)
                             return chat_member.user
                         except Exception:
                             continue
@@ -941,6 +896,13 @@ async def handle_my_chat_member(update: ChatMemberUpdated):
     try:
         if update.new_chat_member and update.new_chat_member.user and update.new_chat_member.user.id == (await bot.get_me()).id:
             chat_id = update.chat.id
+            
+            # Статус бота изменился (добавлен, повышен, разжалован, удален)
+            if update.new_chat_member.status in ('left', 'kicked'):
+                chat_member_cache.invalidate(chat_id)
+            else:
+                chat_member_cache.update(chat_id, bot.id, update.new_chat_member)
+            
             # Если бот добавлен в черный список - покидаем чат
             if await db.is_chat_blacklisted(chat_id):
                 try:
@@ -950,6 +912,16 @@ async def handle_my_chat_member(update: ChatMemberUpdated):
     except Exception as e:
         logger.error(f"Ошибка в handle_my_chat_member: {e}")
 
+
+# Изменения статусов участников (повышение, понижение, выход) - обновляем кэш статусов
+@dp.chat_member()
+async def handle_chat_member(update: ChatMemberUpdated):
+    try:
+        if update.new_chat_member and update.new_chat_member.user:
+            chat_member_cache.update(update.chat.id, update.new_chat_member.user.id, update.new_chat_member)
+    except Exception as e:
+        logger.error(f"Ошибка в handle_chat_member: {e}")
+
 # Система кулдаунов для защиты от флуд-контроля
 user_cooldowns = {}  # {user_id: last_action_time}
 moderation_cooldowns = {}  # {user_id: last_moderation_action_time}
@@ -1020,9 +992,6 @@ def check_chatnet_update_cooldown(user_id: int) -> tuple[bool, int]:
     chatnet_update_cooldowns[user_id] = current_time
     return True, 0
 
-# Инициализация базы данных часовых поясов
-timezone_db = TimezoneDatabase(TIMEZONE_DB_PATH)
-
 # Система кулдаунов для панельки часовых поясов
 timezone_cooldowns = {}  # {user_id: last_action_time}
 TIMEZONE_COOLDOWN_DURATION = 4  # 4 секунды между действиями
@@ -1172,7 +1141,7 @@ async def update_chat_info_if_needed(chat_id: int) -> bool:
         if not is_public and chat_info.type in ['group', 'supergroup']:
             try:
                 # Проверяем права администратора
-                bot_member = await bot.get_chat_member(chat_id, bot.id)
+                bot_member = await chat_member_cache.get(chat_id, bot.id)
                 if bot_member.status in ['administrator', 'creator']:
                     # Проверяем, есть ли уже сохраненная ссылка
                     chat_db_info = await db.get_chat(chat_id)
@@ -1235,7 +1204,7 @@ async def update_chat_info_if_needed(chat_id: int) -> bool:
 async def check_admin_rights(bot: Bot, chat_id: int) -> bool:
     """Проверка прав администратора бота в чате"""
     try:
-        bot_member = await bot.get_chat_member(chat_id, bot.id)
+        bot_member = await chat_member_cache.get(chat_id, bot.id)
         has_admin = bot_member.status in ['administrator', 'creator']
         
         # Обновляем информацию в базе данных
@@ -1800,66 +1769,20 @@ async def back_to_menu_callback(callback: types.CallbackQuery):
             await callback.answer("❌ Ошибка при возврате в меню")
 
 
-async def get_top_chats_with_settings(days: int = 3, limit: int = 30) -> List[Dict[str, Any]]:
-    """
-    Получает топ чатов с учетом настроек показа в топе
-    
-    Args:
-        days: Количество дней для анализа
-        limit: Максимальное количество чатов в результате
-    
-    Returns:
-        Список чатов с учетом настроек
-    """
-    # Получаем больше чатов, чтобы после фильтрации осталось нужное количество
-    # Берем в 3 раза больше, чтобы учесть фильтрацию
-    all_chats = await db.get_top_chats_by_activity(
-        days=days, 
-        limit=limit * 3,
-        exclude_chat_ids=None,
-        include_private=True,  # Получаем и публичные, и частные
-        min_activity_threshold=0  # Фильтрацию по порогу сделаем вручную
-    )
-    
-    # Фильтруем чаты по настройкам
-    filtered_chats = []
-    
-    for chat in all_chats:
-        settings = get_top_chat_settings(chat['chat_id'])
-        show_in_top = settings.get('show_in_top', 'public_only')
-        min_threshold = settings.get('min_activity_threshold', 0)
-        show_private_label = settings.get('show_private_label', False)
-        
-        # Проверяем, не исключен ли чат
-        if show_in_top == 'never':
-            continue
-        
-        # Проверяем минимальный порог активности
-        if chat['total_messages'] < min_threshold:
-            continue
-        
-        # Проверяем видимость
-        if show_in_top == 'public_only' and not chat.get('is_public', False):
-            continue
-        
-        # Добавляем информацию о метке "Частный"
-        chat['show_private_label'] = show_private_label and not chat.get('is_public', False)
-        
-        filtered_chats.append(chat)
-        
-        # Останавливаемся, когда набрали нужное количество
-        if len(filtered_chats) >= limit:
-            break
-    
-    return filtered_chats
-
-
-@dp.callback_query(F.data == "top_chats")
+@dp.callback_query((F.data == "top_chats") | F.data.startswith("top_chats_page_"))
 async def top_chats_callback(callback: types.CallbackQuery):
-    """Обработчик кнопки 'Топ чатов'"""
+    """Обработчик кнопки 'Топ чатов' (страницы берутся из снимка топа)"""
     try:
-        # Получаем топ чатов за последние 3 дня (топ 15) с учетом настроек
-        top_chats = await get_top_chats_with_settings(days=3, limit=15)
+        page = 0
+        if callback.data.startswith("top_chats_page_"):
+            page = int(callback.data.rsplit("_", 1)[1])
+        
+        # Топ чатов за последние TOP_CHATS_DAYS дня с учетом настроек показа
+        top_chats, total_chats = await top_chats_leaderboard.get_page(page, TOP_CHATS_PAGE_SIZE)
+        if not top_chats and page > 0:
+            # Снимок обновился и страниц стало меньше - показываем первую
+            page = 0
+            top_chats, total_chats = await top_chats_leaderboard.get_page(page, TOP_CHATS_PAGE_SIZE)
         
         if not top_chats:
             await safe_answer_callback(callback, "😔 Пока нет активных чатов")
@@ -1874,9 +1797,15 @@ async def top_chats_callback(callback: types.CallbackQuery):
             )
             return
         
+        # Номер первого чата на странице
+        first_place = page * TOP_CHATS_PAGE_SIZE + 1
+        
         # Формируем текст с полным списком
-        top_text = "🏆 <b>Топ 15 чатов</b>\n"
-        top_text += f"📊 <i>За последние 3 дня</i>\n\n"
+        if page == 0:
+            top_text = f"🏆 <b>Топ {TOP_CHATS_PAGE_SIZE} чатов</b>\n"
+        else:
+            top_text = f"🏆 <b>Топ чатов: {first_place}–{first_place + len(top_chats) - 1}</b>\n"
+        top_text += f"📊 <i>За последние {TOP_CHATS_DAYS} дня</i>\n\n"
         
         # Показываем только краткую статистику
         total_messages = sum(chat['total_messages'] for chat in top_chats)
@@ -1884,7 +1813,7 @@ async def top_chats_callback(callback: types.CallbackQuery):
         
         # Добавляем список чатов в текст
         top_text += "📋 <b>Список чатов:</b>\n"
-        for i, chat in enumerate(top_chats, 1):
+        for i, chat in enumerate(top_chats, first_place):
             # Обрезаем длинные названия для текста
             title = chat['title'][:30] + "..." if len(chat['title']) > 30 else chat['title']
             messages_count = chat['total_messages']
@@ -1897,8 +1826,8 @@ async def top_chats_callback(callback: types.CallbackQuery):
         # Создаем клавиатуру с кнопками для каждого чата (в столбик)
         builder = InlineKeyboardBuilder()
         
-        # Добавляем кнопки для всех 15 чатов (в столбик)
-        for i, chat in enumerate(top_chats, 1):
+        # Добавляем кнопки для всех чатов страницы (в столбик)
+        for i, chat in enumerate(top_chats, first_place):
             # Обрезаем длинные названия
             title = chat['title'][:25] + "..." if len(chat['title']) > 25 else chat['title']
             # Добавляем метку "Частный" если нужно
@@ -1908,9 +1837,21 @@ async def top_chats_callback(callback: types.CallbackQuery):
                 callback_data=f"join_chat_{chat['chat_id']}"
             ))
         
+        # Кнопки перехода между страницами
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"top_chats_page_{page - 1}"))
+        if first_place + len(top_chats) - 1 < total_chats:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"top_chats_page_{page + 1}"))
+        if navigation:
+            builder.row(*navigation)
+        
         # Добавляем кнопки управления в одну строку
         builder.row(
-            InlineKeyboardButton(text="🔄 Обновить", callback_data="top_chats"),
+            InlineKeyboardButton(
+                text="🔄 Обновить",
+                callback_data=f"top_chats_page_{page}" if page else "top_chats"
+            ),
             InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_menu")
         )
         
@@ -2286,51 +2227,36 @@ async def message_handler(message: Message):
             return  # Прерываем обработку, не считаем сообщение
         
         # ВТОРОЕ: Если не рейд, считаем сообщение для статистики
-        # Проверяем настройки статистики для чата
-        stat_settings = await db.get_chat_stat_settings(chat_id)
-        
-        # Сообщения всегда записываются в базу для профиля пользователя
-        # Но если статистика отключена, не учитываем медиа если настройка выключена
-        # Если учет медиа выключен, пропускаем сообщения не-текстовых типов
-        if not stat_settings.get('count_media', True):
-            # Aiogram выставляет content_type: 'text' для обычных сообщений
-            if message.content_type != 'text':
-                return
-        
         # Получаем информацию о пользователе и чате для логирования
         user_name = message.from_user.first_name or f"@{message.from_user.username}" if message.from_user.username else f"ID{message.from_user.id}"
         chat_name = message.chat.title or "Без названия"
         
-        # Проверяем, было ли сообщение от этого пользователя недавно
-        last_message_time_str = await db.get_user_last_message_time(chat_id, message.from_user.id)
-        current_time = datetime.now()
+        # Вся бухгалтерия сообщения (настройки, антифлуд, пользователь, счетчики, first_seen)
+        # выполняется одной транзакцией. Если учет медиа выключен, не-текстовые сообщения
+        # пропускаются (aiogram выставляет content_type: 'text' для обычных сообщений)
+        result = await db.record_message(
+            chat_id=chat_id,
+            user_id=message.from_user.id,
+            username=message.from_user.username,
+            first_name=message.from_user.first_name,
+            last_name=message.from_user.last_name,
+            is_bot=message.from_user.is_bot,
+            is_text=message.content_type == 'text'
+        )
         
-        if last_message_time_str:
-            try:
-                last_message_time = datetime.fromisoformat(last_message_time_str)
-                time_diff = (current_time - last_message_time).total_seconds()
-                
-                # Если время в базе данных больше текущего (отрицательная разница), это ошибка
-                if time_diff < 0:
-                    logger.warning(
-                        f"⚠️ Некорректное время в БД для пользователя {user_name} ({message.from_user.id}) "
-                        f"в чате \"{chat_name}\": время в БД ({last_message_time_str}) больше текущего. "
-                        f"Обновляю время в БД."
-                    )
-                    # Обновляем время в базе данных текущим временем
-                    await db.update_user_last_message_time(chat_id, message.from_user.id, current_time.isoformat())
-                elif time_diff < 1:  # Меньше 1 секунды (для тестирования)
-                    logger.info(f"🚫 Сообщение пропущено от {user_name} ({message.from_user.id}) в чате \"{chat_name}\" (прошло {time_diff:.3f}с)")
-                    return
-            except ValueError:
-                logger.warning(f"Неверный формат времени: {last_message_time_str}")
+        if not result['recorded']:
+            if result['reason'] == 'too_fast':
+                logger.info(f"🚫 Сообщение пропущено от {user_name} ({message.from_user.id}) в чате \"{chat_name}\" (прошло {result['time_diff']:.3f}с)")
+            return
         
-        # Обновляем время последнего сообщения ТОЛЬКО если сообщение будет учтено
-        await db.update_user_last_message_time(chat_id, message.from_user.id, current_time.isoformat())
+        if result['time_diff'] is not None and result['time_diff'] < 0:
+            logger.warning(
+                f"⚠️ Некорректное время в БД для пользователя {user_name} ({message.from_user.id}) "
+                f"в чате \"{chat_name}\": время в БД больше текущего. Время в БД обновлено."
+            )
         
         # Проверяем, есть ли запись о чате в базе данных
-        chat_info = await db.get_chat(chat_id)
-        if not chat_info:
+        if not result['chat_known']:
             # Создаем запись о чате если её нет
             owner_id = None
             try:
@@ -2349,30 +2275,6 @@ async def message_handler(message: Message):
                 owner_id=owner_id  # Сохраняем только реального владельца
             )
         
-        # Автоматически сохраняем пользователя в базу данных при первом сообщении
-        await db.add_user(
-            user_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-            last_name=message.from_user.last_name,
-            is_bot=message.from_user.is_bot
-        )
-        
-        # Увеличиваем счетчик сообщений
-        await db.increment_message_count(chat_id)
-        
-        # Увеличиваем счетчик сообщений пользователя
-        await db.increment_user_message_count(
-            chat_id=chat_id,
-            user_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-            last_name=message.from_user.last_name
-        )
-
-        # Зафиксировать дату первого появления пользователя в этом чате
-        await db.ensure_user_first_seen(chat_id, message.from_user.id)
-        
         # Информативное логирование
         logger.info(f"✅ Обработано сообщение от {user_name} ({message.from_user.id}) в чате \"{chat_name}\"")
 
@@ -3608,7 +3510,7 @@ async def stats_command(message: Message):
     # Получаем информацию о владельце чата
     owner_mention = "Неизвестно"
     try:
-        owner_member = await bot.get_chat_member(chat.id, chat_info['owner_id'])
+        owner_member = await chat_member_cache.get(chat.id, chat_info['owner_id'])
         if owner_member.user.username:
             owner_mention = f"@{owner_member.user.username}"
         elif owner_member.user.first_name:
@@ -3754,7 +3656,14 @@ async def myprofile_command(message: Message):
 
     # Генерируем график
     try:
-        chart_buf = generate_modern_profile_card({}, monthly_stats, None)
+        try:
+            chart = await render_cache.render(
+                generate_modern_profile_card, {}, monthly_stats, None, CHART_OUTPUT_PROFILE
+            )
+        except RenderUnavailable as e:
+            # Рендеринг перегружен - отвечаем текстом без графика
+            logger.warning(f"График профиля не построен, отправляем текст: {e}")
+            chart = None
         
         # Полная подпись с информацией о пользователе
         user_name = get_user_mention_html(target_user)
@@ -3798,12 +3707,17 @@ async def myprofile_command(message: Message):
         caption = "\n".join(caption_lines)
 
         # Отправляем изображение с подписью
-        await message.answer_photo(
-            types.input_file.BufferedInputFile(chart_buf.read(), filename="profile.png"),
-            caption=caption, 
-            parse_mode=ParseMode.HTML, 
-            disable_web_page_preview=True
-        )
+        if chart is None:
+            await message.answer(caption, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        else:
+            await _send_chart(
+                message,
+                chart,
+                output_filename("profile"),
+                caption=caption, 
+                parse_mode=ParseMode.HTML, 
+                disable_web_page_preview=True
+            )
         
     except Exception as e:
         logger.error(f"Ошибка при генерации графика профиля: {e}")
@@ -3918,8 +3832,7 @@ async def addfriend_command(message: Message):
         # Получаем ID создателя кода
         creator_id = None
         def _get_creator_sync():
-            import sqlite3
-            with sqlite3.connect(friends_db.db_path) as db:
+            with get_connection(friends_db.db_path) as db:
                 cursor = db.execute("SELECT user_id FROM friend_codes WHERE code = ?", (code,))
                 row = cursor.fetchone()
                 return row[0] if row else None
@@ -4102,17 +4015,12 @@ async def top_users_command(message: Message):
     try:
         title = f"Топ активных участников - {today}"
         subtitle = f"За сутки{timezone_info}" if timezone_info else "За сутки"
-        chart_buf = await generate_top_chart(top_users, title=title, subtitle=subtitle, bot_instance=bot)
-        
-        # Читаем буфер один раз
-        chart_bytes = chart_buf.read()
-        chart_buf.seek(0)  # Возвращаем указатель в начало на случай повторного использования
+        chart = await generate_top_chart(top_users, title=title, subtitle=subtitle, bot_instance=bot)
         
         # Отправляем график с текстовым списком в caption
         try:
             # Формируем параметры для отправки
             photo_params = {
-                'photo': types.input_file.BufferedInputFile(chart_bytes, filename="top_users.png"),
                 'caption': top_text,
                 'parse_mode': ParseMode.HTML,
                 'disable_web_page_preview': True
@@ -4121,7 +4029,7 @@ async def top_users_command(message: Message):
             if message.chat.type == 'supergroup' and message.message_thread_id:
                 photo_params['message_thread_id'] = message.message_thread_id
             
-            await message.answer_photo(**photo_params)
+            await _send_chart(message, chart, output_filename("top_users"), **photo_params)
         except Exception as photo_error:
             # Обрабатываем ошибку TOPIC_CLOSED или другие ошибки отправки фото
             if "TOPIC_CLOSED" in str(photo_error):
@@ -4193,17 +4101,12 @@ async def top_users_all_chats_command(message: Message):
         try:
             title = f"Топ активных участников за {days} дней"
             subtitle = f"За последние {days} дней — этот чат"
-            chart_buf = await generate_top_chart(top_users, title=title, subtitle=subtitle, bot_instance=bot)
+            chart = await generate_top_chart(top_users, title=title, subtitle=subtitle, bot_instance=bot)
             
             # Отправляем график с текстовым списком в caption
             try:
-                # Читаем буфер один раз
-                chart_bytes = chart_buf.read()
-                chart_buf.seek(0)  # Возвращаем указатель в начало на случай повторного использования
-                
                 # Формируем параметры для отправки
                 photo_params = {
-                    'photo': types.input_file.BufferedInputFile(chart_bytes, filename="topall_users.png"),
                     'caption': text_message,
                     'parse_mode': ParseMode.HTML,
                     'disable_web_page_preview': True
@@ -4212,7 +4115,7 @@ async def top_users_all_chats_command(message: Message):
                 if message.chat.type == 'supergroup' and message.message_thread_id:
                     photo_params['message_thread_id'] = message.message_thread_id
                 
-                await message.answer_photo(**photo_params)
+                await _send_chart(message, chart, output_filename("topall_users"), **photo_params)
             except Exception as photo_error:
                 # Обрабатываем ошибку TOPIC_CLOSED или другие ошибки отправки фото
                 if "TOPIC_CLOSED" in str(photo_error):
@@ -5051,6 +4954,19 @@ async def settings_open_raid_callback(callback: types.CallbackQuery):
         builder.button(text=f"🔇 Авто-мут: {auto_mute} мин", callback_data="raid_mute_settings")
         mute_text = f"{auto_mute} минут"
     
+    # Сравнение стикеров/GIF и ссылок от разных пользователей (по умолчанию - только текст)
+    coord_media = settings.get('coordinated_media', False)
+    coord_links = settings.get('coordinated_links', False)
+    builder.button(text=f"🖼 Одинаковые стикеры/GIF: {'Вкл' if coord_media else 'Выкл'}",
+                   callback_data="raid_coord_media")
+    builder.button(text=f"🔗 Одинаковые ссылки: {'Вкл' if coord_links else 'Выкл'}",
+                   callback_data="raid_coord_links")
+    coord_content = [f"текст от {settings.get('coordinated_min_text_length', 20)} символов"]
+    if coord_media:
+        coord_content.append("стикеры и GIF")
+    if coord_links:
+        coord_content.append("ссылки")
+    
     # Определяем текущий пресет по настройкам
     current_preset = None
     current_gif = settings.get('gif_limit', 3)
@@ -5122,12 +5038,14 @@ async def settings_open_raid_callback(callback: types.CallbackQuery):
         f"• GIF-спам: {settings.get('gif_limit', 3)} за {settings.get('gif_time_window', 5)}с\n"
         f"• Стикеры: {settings.get('sticker_limit', 5)} за {settings.get('sticker_time_window', 10)}с\n"
         f"• Текст: {settings.get('duplicate_text_limit', 3)} за {settings.get('duplicate_text_window', 30)}с\n"
-        f"• Массовый вход: {settings.get('mass_join_limit', 10)} за {settings.get('mass_join_window', 60)}с\n\n"
+        f"• Массовый вход: {settings.get('mass_join_limit', 10)} за {settings.get('mass_join_window', 60)}с\n"
+        f"• Одинаковый контент ({', '.join(coord_content)}): {settings.get('coordinated_user_limit', 5)} "
+        f"пользователей за {settings.get('coordinated_window', 60)}с\n\n"
         "💡 <b>Быстрая настройка:</b>\n"
         "Выберите уровень защиты."
     )
     
-    builder.adjust(1, 1, 1, 3, 1)
+    builder.adjust(1, 1, 1, 1, 1, 3, 1)
     
     await callback.message.edit_text(settings_text, parse_mode=ParseMode.HTML)
     await callback.message.edit_reply_markup(reply_markup=builder.as_markup())
@@ -5158,6 +5076,31 @@ async def raid_toggle_callback(callback: types.CallbackQuery):
     await callback.answer(f"✅ Защита {'включена' if new_status else 'выключена'}")
 
 
+@dp.callback_query(F.data.in_({"raid_coord_media", "raid_coord_links"}))
+async def raid_coordinated_toggle_callback(callback: types.CallbackQuery):
+    """Включить/выключить сравнение стикеров/GIF или ссылок от разных пользователей"""
+    if not await _ensure_admin(callback):
+        return
+    
+    chat = callback.message.chat
+    user_id = callback.from_user.id
+    
+    effective_rank = await get_effective_rank(chat.id, user_id)
+    if effective_rank not in [RANK_OWNER, RANK_ADMIN]:
+        await callback.answer("❌ Только владелец или администратор могут изменить эту настройку!", show_alert=True)
+        return
+    
+    setting_name = 'coordinated_media' if callback.data == "raid_coord_media" else 'coordinated_links'
+    settings = await raid_protection_db.get_settings(chat.id)
+    new_status = not settings.get(setting_name, False)
+    
+    await raid_protection_db.update_setting(chat.id, setting_name, new_status)
+    
+    # Перенаправляем обратно в меню настроек рейдов
+    await settings_open_raid_callback(callback)
+    await callback.answer(f"✅ Сравнение {'включено' if new_status else 'выключено'}")
+
+
 @dp.callback_query(F.data.startswith("raid_notif_"))
 async def raid_notification_mode_callback(callback: types.CallbackQuery):
     """Изменить режим уведомлений защиты от рейдов"""
@@ -5384,7 +5327,7 @@ async def ap_command(message: Message):
     
     # Проверяем права - только владелец/администраторы Telegram могут назначать
     try:
-        member = await bot.get_chat_member(chat_id, user_id)
+        member = await chat_member_cache.get(chat_id, user_id)
         if member.status not in ['creator', 'administrator']:
             msg = await message.answer("😑 Куда мы лезем?")
             asyncio.create_task(delete_message_after_delay(msg, 10))
@@ -5508,7 +5451,7 @@ async def unap_command(message: Message):
     
     # Проверяем права - только администраторы Telegram могут снимать
     try:
-        member = await bot.get_chat_member(chat_id, user_id)
+        member = await chat_member_cache.get(chat_id, user_id)
         if member.status not in ['creator', 'administrator']:
             if await should_show_hint(chat_id, user_id):
                 await message.answer("❌ Недостаточно прав для снятия модераторов")
@@ -11276,7 +11219,7 @@ async def hints_mode_callback(callback: types.CallbackQuery):
         
         # Проверяем права администратора
         try:
-            member = await bot.get_chat_member(chat_id, user_id)
+            member = await chat_member_cache.get(chat_id, user_id)
             if member.status not in ['creator', 'administrator']:
                 if await should_show_hint(chat_id, user_id):
                     await callback.answer("❌ Недостаточно прав для изменения настроек", show_alert=True)
@@ -11483,8 +11426,29 @@ async def main(test_mode: bool = False):
     print_startup_banner()
     
     try:
-        # Инициализируем базы данных
-        await db.init_db()
+        # Шрифты и шаблоны фонов готовятся до запуска пула рендеринга:
+        # процессы пула наследуют их готовыми
+        preload_fonts()
+        preload_templates()
+        # Запускаем процессы рендеринга до того, как появятся потоки и соединения с БД
+        await render_service.start()
+        
+        # Применяем миграции схем всех баз одновременно (каждая база - отдельный файл)
+        # и загружаем настройки гифок и топа чатов (старые JSON-файлы импортируются один раз)
+        started = time.perf_counter()
+        await asyncio.gather(
+            db.init_db(),
+            moderation_db.init_db(),
+            reputation_db.init_db(),
+            network_db.init_db(),
+            votemute_db.init_db(),
+            raid_protection_db.init_db(),
+            timezone_db.init_db(),
+            media_registry.init_db(),
+            render_cache.init(),
+            chat_options_store.init_db(GIFS_SETTINGS_PATH, TOP_CHATS_SETTINGS_PATH),
+        )
+        logger.info(f"Базы данных инициализированы за {(time.perf_counter() - started) * 1000:.0f} мс")
         
         # Проверяем целостность основной базы данных
         logger.info("Проверка целостности базы данных...")
@@ -11501,16 +11465,8 @@ async def main(test_mode: bool = False):
         else:
             logger.info("Целостность базы данных проверена: OK")
         
-        await moderation_db.init_db()
-        await reputation_db.init_db()
-        await network_db.init_db()
-        await votemute_db.init_db()
-        await friends_db.init_db()
-        await raid_protection_db.init_db()
-        logger.info("Базы данных инициализированы")
-        
-        # Инициализируем JSON-файлы настроек
-        init_json_files()
+        # Кэш статусов участников использует бота для запросов к API
+        chat_member_cache.set_bot(bot)
         
         # Инициализируем систему защиты от рейдов
         raid_protection.set_bot(bot)
@@ -11588,6 +11544,14 @@ async def main(test_mode: bool = False):
             for task in scheduler.tasks:
                 task.cancel()
             
+            # Записываем буфер счетчиков и закрываем соединения с базами данных
+            await db.flush_counters()
+            await chat_options_store.flush()
+            close_all_pools()
+            
+            # Останавливаем процессы рендеринга изображений
+            render_service.shutdown()
+            
             # Закрываем HTTP-сессию
             await bot.session.close()
             
@@ -0,0 +1,51 @@
+"""
+Пакетное удаление неактивных пользователей и чатов
+ID для удаления ставятся в очередь purge_queue основной базы одним запросом,
+затем удаляются порциями по INACTIVE_PURGE_CHUNK_SIZE: порция копируется во временную
+таблицу соединения каждой базы и удаляется там одной транзакцией по всем таблицам.
+Порция убирается из очереди только после того, как ее удалили все базы, поэтому
+прерванная очистка продолжается со следующего запуска (удаление идемпотентно).
+"""
+from typing import Iterable, List
+
+# Значения столбца kind в очереди
+USER = 'user'
+CHAT = 'chat'
+
+# Названия видов для журнала
+KIND_TITLES = {USER: 'пользователей', CHAT: 'чатов'}
+
+CREATE_QUEUE_SQL = """
+    CREATE TABLE IF NOT EXISTS purge_queue (
+        kind TEXT,
+        entity_id INTEGER,
+        PRIMARY KEY (kind, entity_id)
+    ) WITHOUT ROWID
+"""
+
+# Подзапрос для условий удаления: ID текущей порции во временной таблице соединения
+STAGED_IDS = "(SELECT id FROM temp.purge_ids)"
+
+
+def stage_ids(db, ids: Iterable[int]):
+    """Записать ID порции во временную таблицу temp.purge_ids соединения"""
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS purge_ids (id INTEGER PRIMARY KEY)")
+    db.execute("DELETE FROM temp.purge_ids")
+    db.executemany("INSERT OR IGNORE INTO temp.purge_ids (id) VALUES (?)", ((i,) for i in ids))
+
+
+def next_chunk_sync(db, kind: str, limit: int) -> List[int]:
+    """Следующая порция ID из очереди"""
+    cursor = db.execute(
+        "SELECT entity_id FROM purge_queue WHERE kind = ? ORDER BY entity_id LIMIT ?",
+        (kind, limit)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def dequeue_sync(db, kind: str, ids: List[int]):
+    """Убрать из очереди порцию, удаленную во всех базах"""
+    db.executemany(
+        "DELETE FROM purge_queue WHERE kind = ? AND entity_id = ?",
+        [(kind, entity_id) for entity_id in ids]
+    )
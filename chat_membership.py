@@ -0,0 +1,114 @@
+"""
+Членство пользователей в чатах: в каких чатах писал пользователь
+Строка (user_id, chat_id) хранит первый и последний день с сообщениями и общее число
+сообщений. Таблица обновляется в той же транзакции, что и дневные счетчики
+(StatsCounterBuffer.flush_sync), и, в отличие от user_daily_stats, не очищается по сроку.
+Чаты пользователя - диапазон первичного ключа по user_id, отсортированный по chat_id.
+"""
+from typing import Dict, List
+
+import stats_rollup
+
+CREATE_TABLE_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS user_chat_membership (
+        user_id INTEGER,
+        chat_id INTEGER,
+        first_seen TEXT,
+        last_seen TEXT,
+        total_messages INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, chat_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_user_chat_membership_chat ON user_chat_membership (chat_id)",
+)
+
+UPSERT_SQL = """
+    INSERT INTO user_chat_membership (user_id, chat_id, first_seen, last_seen, total_messages)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, chat_id) DO UPDATE SET
+        first_seen = MIN(first_seen, excluded.first_seen),
+        last_seen = MAX(last_seen, excluded.last_seen),
+        total_messages = total_messages + excluded.total_messages
+"""
+
+
+def membership_rows(user_rows: List[tuple]) -> List[tuple]:
+    """Строки для UPSERT_SQL из строк user_daily_stats (chat_id, user_id, date, count)"""
+    rows: Dict[tuple, list] = {}
+    for chat_id, user_id, day, count in user_rows:
+        entry = rows.get((user_id, chat_id))
+        if entry is None:
+            rows[(user_id, chat_id)] = [day, day, count]
+        else:
+            entry[0] = min(entry[0], day)
+            entry[1] = max(entry[1], day)
+            entry[2] += count
+    return [(*key, *entry) for key, entry in rows.items()]
+
+
+def chat_ids_sync(db, user_id: int) -> List[int]:
+    """Чаты пользователя по возрастанию chat_id"""
+    cursor = db.execute(
+        "SELECT chat_id FROM user_chat_membership WHERE user_id = ? ORDER BY chat_id", (user_id,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def intersect_sorted(a: List[int], b: List[int]) -> List[int]:
+    """Пересечение двух отсортированных списков слиянием"""
+    i = j = 0
+    common = []
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            common.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return common
+
+
+def move_chat_sync(db, old_chat_id: int, new_chat_id: int):
+    """Перенести членство на новый ID чата, объединяя с уже имеющимся"""
+    # WHERE у SELECT обязателен: без него SQLite принял бы ON CONFLICT за часть SELECT (JOIN ... ON)
+    db.execute("""
+        INSERT INTO user_chat_membership (user_id, chat_id, first_seen, last_seen, total_messages)
+        SELECT user_id, ?, first_seen, last_seen, total_messages
+        FROM user_chat_membership WHERE chat_id = ?
+        ON CONFLICT(user_id, chat_id) DO UPDATE SET
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen),
+            total_messages = total_messages + excluded.total_messages
+    """, (new_chat_id, old_chat_id))
+    db.execute("DELETE FROM user_chat_membership WHERE chat_id = ?", (old_chat_id,))
+
+
+def rebuild_sync(db):
+    """
+    Заполнить таблицу для существующих баз: сообщения - по месячным сводкам (вся хранимая история),
+    первый день - из user_chat_meta, последний - по дневным счетчикам или началу последней недели
+    """
+    db.execute("DELETE FROM user_chat_membership")
+    db.execute(f"""
+        INSERT INTO user_chat_membership (user_id, chat_id, first_seen, last_seen, total_messages)
+        SELECT r.user_id, r.chat_id,
+               COALESCE(
+                   (SELECT m.first_seen FROM user_chat_meta m
+                    WHERE m.chat_id = r.chat_id AND m.user_id = r.user_id),
+                   MIN(r.period_start)
+               ),
+               COALESCE(
+                   (SELECT MAX(s.date) FROM user_daily_stats s
+                    WHERE s.chat_id = r.chat_id AND s.user_id = r.user_id),
+                   (SELECT MAX(w.period_start) FROM user_stats_rollup w
+                    WHERE w.chat_id = r.chat_id AND w.user_id = r.user_id AND w.granularity = '{stats_rollup.WEEK}')
+               ),
+               SUM(r.message_count)
+        FROM user_stats_rollup r
+        WHERE r.granularity = '{stats_rollup.MONTH}'
+        GROUP BY r.chat_id, r.user_id
+        HAVING SUM(r.message_count) > 0
+    """)
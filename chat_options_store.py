@@ -0,0 +1,235 @@
+"""
+Хранилище настроек гифок и показа в топе чатов
+Раньше настройки лежали в data/gifs_settings.json и data/top_chats_settings.json
+и перечитывались с диска при каждом обращении. Теперь все настройки держатся в памяти,
+изменения пакетно записываются в SQLite одной транзакцией через
+CHAT_OPTIONS_FLUSH_DELAY секунд после первого изменения. Старые JSON-файлы
+импортируются один раз при запуске и переименовываются в *.imported.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from db_pool import get_connection
+from migrations import run_migrations_sync
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import BASE_PATH
+except ImportError:
+    BASE_PATH = Path(__file__).parent.absolute()
+
+try:
+    from config import CHAT_OPTIONS_FLUSH_DELAY
+except ImportError:
+    CHAT_OPTIONS_FLUSH_DELAY = 1.0
+
+# Настройки показа в топе, которые хранятся в отдельных столбцах
+TOP_CHAT_SETTING_NAMES = ('show_in_top', 'show_private_label', 'min_activity_threshold')
+
+
+def _schema_v1(db):
+    """Исходная схема: таблицы настроек гифок и показа в топе"""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS gifs_settings (
+            chat_id INTEGER PRIMARY KEY,
+            enabled INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS top_chat_settings (
+            chat_id INTEGER PRIMARY KEY,
+            show_in_top TEXT,
+            show_private_label INTEGER,
+            min_activity_threshold INTEGER
+        )
+    """)
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
+
+class ChatOptionsStore:
+    """Настройки чатов в памяти с отложенной пакетной записью в БД"""
+
+    def __init__(self, db_path: str = None, flush_delay: float = CHAT_OPTIONS_FLUSH_DELAY):
+        if db_path is None:
+            db_path = str(BASE_PATH / 'data' / 'chat_options.db')
+        self.db_path = db_path
+        self.flush_delay = flush_delay
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # chat_id -> включены ли гифки
+        self._gifs: Dict[int, bool] = {}
+        # chat_id -> явно заданные настройки топа (без значений по умолчанию)
+        self._top: Dict[int, Dict[str, Any]] = {}
+        # Защищает словари настроек и множества измененных чатов
+        self._lock = threading.Lock()
+        self._dirty_gifs: Set[int] = set()
+        self._dirty_top: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def init_db(self, gifs_json_path: Path = None, top_json_path: Path = None):
+        """Применить миграции схемы, импортировать старые JSON-файлы и загрузить настройки в память"""
+        def _init_sync():
+            run_migrations_sync(self.db_path, "настроек чатов", SCHEMA_MIGRATIONS)
+            with get_connection(self.db_path) as db:
+                try:
+                    imported = self._import_json_sync(db, gifs_json_path, top_json_path)
+                except Exception as e:
+                    logger.error(f"Ошибка при импорте настроек чатов из JSON: {e}")
+                    imported = []
+
+                gifs = {
+                    row[0]: bool(row[1])
+                    for row in db.execute("SELECT chat_id, enabled FROM gifs_settings")
+                }
+                top = {}
+                for row in db.execute("""
+                    SELECT chat_id, show_in_top, show_private_label, min_activity_threshold
+                    FROM top_chat_settings
+                """):
+                    settings = {}
+                    if row[1] is not None:
+                        settings['show_in_top'] = row[1]
+                    if row[2] is not None:
+                        settings['show_private_label'] = bool(row[2])
+                    if row[3] is not None:
+                        settings['min_activity_threshold'] = row[3]
+                    top[row[0]] = settings
+            # Переименовываем файлы только после фиксации транзакции импорта
+            for path in imported:
+                path.rename(path.with_name(path.name + '.imported'))
+                logger.info(f"Настройки из {path} перенесены в {self.db_path}")
+            return gifs, top
+
+        try:
+            gifs, top = await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации хранилища настроек чатов: {e}")
+            return
+        with self._lock:
+            self._gifs, self._top = gifs, top
+        logger.info(f"Настройки чатов загружены (гифки: {len(gifs)}, топ: {len(top)})")
+
+    @staticmethod
+    def _import_json_sync(db, gifs_json_path: Optional[Path], top_json_path: Optional[Path]) -> list:
+        """Перенести настройки из JSON-файлов в таблицы (записи в БД имеют приоритет)"""
+        imported = []
+        if gifs_json_path is not None and Path(gifs_json_path).exists():
+            with open(gifs_json_path, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+            db.executemany(
+                "INSERT OR IGNORE INTO gifs_settings (chat_id, enabled) VALUES (?, ?)",
+                [(int(chat_id), 1 if value.get('enabled', False) else 0)
+                 for chat_id, value in settings.items()]
+            )
+            imported.append(Path(gifs_json_path))
+
+        if top_json_path is not None and Path(top_json_path).exists():
+            with open(top_json_path, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+            rows = []
+            for chat_id, value in settings.items():
+                show_private_label = value.get('show_private_label')
+                rows.append((
+                    int(chat_id),
+                    value.get('show_in_top'),
+                    None if show_private_label is None else int(bool(show_private_label)),
+                    value.get('min_activity_threshold'),
+                ))
+            db.executemany("""
+                INSERT OR IGNORE INTO top_chat_settings
+                (chat_id, show_in_top, show_private_label, min_activity_threshold)
+                VALUES (?, ?, ?, ?)
+            """, rows)
+            imported.append(Path(top_json_path))
+        return imported
+
+    def get_gifs_enabled(self, chat_id: int) -> bool:
+        """Включены ли гифки в чате (по умолчанию выключены)"""
+        return self._gifs.get(chat_id, False)
+
+    def get_top_chat_settings(self, chat_id: int) -> Dict[str, Any]:
+        """Явно заданные настройки топа для чата (копия; пустой словарь, если не заданы)"""
+        settings = self._top.get(chat_id)
+        return dict(settings) if settings else {}
+
+    def set_gifs_enabled(self, chat_id: int, enabled: bool):
+        """Изменить настройку гифок (запись в БД откладывается)"""
+        with self._lock:
+            self._gifs[chat_id] = bool(enabled)
+            self._dirty_gifs.add(chat_id)
+        self._schedule_flush()
+
+    def set_top_chat_setting(self, chat_id: int, setting_name: str, value: Any):
+        """Изменить настройку топа (запись в БД откладывается)"""
+        if setting_name not in TOP_CHAT_SETTING_NAMES:
+            raise ValueError(f"Неизвестная настройка топа чатов: {setting_name}")
+        with self._lock:
+            self._top.setdefault(chat_id, {})[setting_name] = value
+            self._dirty_top.add(chat_id)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий записываем сразу
+            self._flush_sync()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения в БД"""
+        await asyncio.get_event_loop().run_in_executor(None, self._flush_sync)
+
+    def _flush_sync(self):
+        with self._lock:
+            gifs_rows = [(chat_id, int(self._gifs[chat_id])) for chat_id in self._dirty_gifs]
+            top_rows = []
+            for chat_id in self._dirty_top:
+                settings = self._top[chat_id]
+                show_private_label = settings.get('show_private_label')
+                top_rows.append((
+                    chat_id,
+                    settings.get('show_in_top'),
+                    None if show_private_label is None else int(bool(show_private_label)),
+                    settings.get('min_activity_threshold'),
+                ))
+            self._dirty_gifs.clear()
+            self._dirty_top.clear()
+        if not gifs_rows and not top_rows:
+            return
+
+        try:
+            with get_connection(self.db_path) as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO gifs_settings (chat_id, enabled) VALUES (?, ?)",
+                    gifs_rows
+                )
+                db.executemany("""
+                    INSERT OR REPLACE INTO top_chat_settings
+                    (chat_id, show_in_top, show_private_label, min_activity_threshold)
+                    VALUES (?, ?, ?, ?)
+                """, top_rows)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении настроек чатов: {e}")
+            # Возвращаем чаты в очередь записи, значения остались в памяти
+            with self._lock:
+                self._dirty_gifs.update(row[0] for row in gifs_rows)
+                self._dirty_top.update(row[0] for row in top_rows)
+
+
+# Глобальное хранилище настроек чатов
+chat_options_store = ChatOptionsStore()
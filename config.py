@@ -46,6 +46,51 @@ data_dir.mkdir(parents=True, exist_ok=True)
 DATABASE_PATH = str(data_dir / 'pixel_bot.db')
 TIMEZONE_DB_PATH = str(data_dir / 'timezones.db')
 
+# Пул соединений SQLite (общий для всех баз данных)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # максимум соединений на один файл БД
+DB_POOL_HEALTH_CHECK_INTERVAL = 60  # секунд простоя, после которых соединение проверяется
+
+# Буфер счетчиков сообщений (отложенная запись в daily_stats / user_daily_stats)
+# При аварийном завершении теряется не больше чем за интервал или лимит событий
+STATS_FLUSH_INTERVAL_MS = int(os.getenv("STATS_FLUSH_INTERVAL_MS", "2000"))
+STATS_FLUSH_MAX_EVENTS = int(os.getenv("STATS_FLUSH_MAX_EVENTS", "500"))  # учтенных сообщений
+
+# Сводные таблицы статистики по неделям и месяцам (топы за N дней): сколько месяцев хранить
+STATS_ROLLUP_RETENTION_MONTHS = 13
+
+# Рендеринг изображений в отдельных процессах (графики /top, /myprofile)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))  # процессов в пуле
+RENDER_QUEUE_LIMIT = int(os.getenv("RENDER_QUEUE_LIMIT", "8"))  # задач в работе и в очереди, сверх - текстовый ответ
+RENDER_TIMEOUT = 20  # секунд на одно изображение
+
+# Формат графиков: профиль из image_generator.ENCODING_PROFILES
+# ('png', 'png_fast', 'jpeg', 'jpeg_1920', 'webp', 'telegram' - JPEG до 2560 px и не больше 512 КБ)
+CHART_OUTPUT_PROFILE = os.getenv("CHART_OUTPUT_PROFILE", "png")
+
+# Кэш готовых изображений графиков: каталог и сколько байт PNG держать в памяти и на диске
+RENDER_CACHE_DIR = str(data_dir / 'render_cache')
+RENDER_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+# Кэш статусов участников чатов (get_chat_member), секунд
+CHAT_MEMBER_CACHE_TTL = 300
+
+# Кэш аватарок для графика топа: каталог плиток, через сколько секунд проверять фото профиля
+# заново (для пользователей без фото - отдельно) и сколько плиток держать в памяти
+AVATAR_CACHE_DIR = str(data_dir / 'avatars')
+AVATAR_CACHE_TTL = 6 * 3600
+AVATAR_NEGATIVE_TTL = 3600
+AVATAR_CACHE_SIZE = 1000
+
+# Кэш настроек чатов в памяти: сколько чатов хранить (холодные вытесняются)
+CHAT_SETTINGS_CACHE_SIZE = 10000
+
+# Задержка пакетной записи настроек гифок и топа чатов в БД (секунды)
+CHAT_OPTIONS_FLUSH_DELAY = 1.0
+
+# Очистка неактивных пользователей и чатов: сколько ID удаляется одной транзакцией в каждой базе
+INACTIVE_PURGE_CHUNK_SIZE = 500
+
 # Настройки бота
 BOT_NAME = "Pixel" 
 BOT_DESCRIPTION = "Чат-менеджер для управления группами в Telegram"
@@ -60,7 +105,12 @@ RAID_PROTECTION = {
     'duplicate_text_window': 30, # seconds
     'mass_join_limit': 10,    # new members in time window
     'mass_join_window': 60,   # seconds
-    'similarity_threshold': 0.7 # text similarity threshold (0-1)
+    'similarity_threshold': 0.7, # text similarity threshold (0-1)
+    'coordinated_user_limit': 5, # distinct users posting the same content in time window
+    'coordinated_window': 60,    # seconds
+    'coordinated_min_text_length': 20  # shorter texts are not tracked across users
+    # Per-chat overrides live in raid_protection_settings; stickers/GIFs and links are
+    # compared across users only when a chat enables coordinated_media / coordinated_links
 }
 
 # Top Chats Settings Defaults
@@ -69,3 +119,10 @@ TOP_CHATS_DEFAULTS = {
     'show_private_label': False,   # Show "🔒 Частный" label for private chats
     'min_activity_threshold': 0    # Minimum messages count to show in top
 }
+
+# Снимок топа чатов (кнопка «Топ чатов»): окно в днях, сколько чатов хранить,
+# как часто пересчитывать (секунды) и сколько показывать на странице
+TOP_CHATS_DAYS = 3
+TOP_CHATS_SNAPSHOT_SIZE = 90
+TOP_CHATS_REFRESH_INTERVAL = 180
+TOP_CHATS_PAGE_SIZE = 15
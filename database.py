@@ -6,22 +6,531 @@ import asyncio
 import logging
 import os
 import shutil
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, List, Dict, Any
-from config import DATABASE_PATH, DEBUG
+from config import DATABASE_PATH, DEBUG, STATS_ROLLUP_RETENTION_MONTHS, INACTIVE_PURGE_CHUNK_SIZE
+from db_pool import get_connection, close_pool
+from migrations import run_migrations
+from stats_buffer import StatsCounterBuffer
+from settings_cache import settings_cache
+import stats_rollup
+import hourly_histogram
+import friends_db
+import bulk_purge
+import name_index
+import chat_membership
 
 logger = logging.getLogger(__name__)
 
+# Дневные счетчики хранятся 7 дней (cleanup_old_stats), окна длиннее считаются по сводным таблицам
+DAILY_STATS_EXACT_DAYS = 7
 
-def _apply_pragma_settings(db):
-    """Применить настройки производительности SQLite к соединению"""
+
+def _schema_v1(db):
+    """Исходная схема: таблицы, колонки и индексы, которые раньше создавал init_db"""
+    # Таблица для хранения информации о чатах
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            chat_title TEXT,
+            owner_id INTEGER,
+            added_date TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            has_admin_rights BOOLEAN DEFAULT 0,
+            russian_commands_prefix BOOLEAN DEFAULT 0
+        )
+    """)
+
+    # Добавляем колонку has_admin_rights если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN has_admin_rights BOOLEAN DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку russian_commands_prefix если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN russian_commands_prefix BOOLEAN DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку chat_type если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN chat_type TEXT")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку member_count если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN member_count INTEGER")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку is_public если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN is_public BOOLEAN DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку username если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN username TEXT")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку invite_link если её нет
     try:
-        db.execute("PRAGMA journal_mode=WAL")
-        db.execute("PRAGMA synchronous=NORMAL")
-        db.execute("PRAGMA cache_size=-64000")  # 64MB cache
-    except Exception:
-        pass  # Игнорируем ошибки, если PRAGMA не поддерживается
+        db.execute("ALTER TABLE chats ADD COLUMN invite_link TEXT")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Таблица черного списка чатов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS blacklisted_chats (
+            chat_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            added_at TEXT
+        )
+    """)
+
+    # Добавляем колонку hints_mode если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN hints_mode INTEGER DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку авто-принятия заявок если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN auto_accept_join_requests BOOLEAN DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку уведомлений при авто-принятии, если её нет
+    try:
+        db.execute("ALTER TABLE chats ADD COLUMN auto_accept_notify BOOLEAN DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Таблица для хранения информации о пользователях
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            is_bot BOOLEAN DEFAULT 0,
+            last_seen TEXT,
+            mention_ping_enabled BOOLEAN DEFAULT 1
+        )
+    """)
+
+    # Таблица для статистики сообщений по дням
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            date TEXT,
+            message_count INTEGER DEFAULT 0,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    """)
+
+    # Таблица для статистики пользователей по дням
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            date TEXT,
+            message_count INTEGER DEFAULT 0,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Добавляем колонку last_name если её нет
+    try:
+        db.execute("ALTER TABLE user_daily_stats ADD COLUMN last_name TEXT")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Таблица метаданных пользователя в чате (дата первого появления)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_chat_meta (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            first_seen TEXT,
+            UNIQUE(chat_id, user_id)
+        )
+    """)
+
+    # Таблица для запросов на вступление в чаты
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_join_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            request_date TEXT,
+            status TEXT DEFAULT 'pending',
+            invite_link TEXT,
+            admin_message_id INTEGER,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Таблица для рангов модераторов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_moderators (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            rank INTEGER,
+            assigned_by INTEGER,
+            assigned_date TEXT,
+            UNIQUE(chat_id, user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (assigned_by) REFERENCES users (user_id)
+        )
+    """)
+
+    # Таблица для прав рангов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS rank_permissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            rank INTEGER,
+            permission_type TEXT,
+            permission_value BOOLEAN DEFAULT 1,
+            UNIQUE(chat_id, rank, permission_type),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    """)
+
+    # Таблица для настроек статистики
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_stat_settings (
+            chat_id INTEGER PRIMARY KEY,
+            stats_enabled BOOLEAN DEFAULT 1,
+            count_media BOOLEAN DEFAULT 1,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    """)
+
+    # Таблица для отслеживания времени последнего сообщения
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_last_message (
+            chat_id INTEGER,
+            user_id INTEGER,
+            last_message_time TEXT,
+            PRIMARY KEY (chat_id, user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+    """)
+
+
+    # Создаем индексы для быстрого поиска
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_daily_stats_chat_date 
+        ON daily_stats (chat_id, date)
+    """)
+
+    # Индексы для прав рангов
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rank_permissions_chat_rank 
+        ON rank_permissions (chat_id, rank)
+    """)
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rank_permissions_chat_type 
+        ON rank_permissions (chat_id, permission_type)
+    """)
+
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_chat_date 
+        ON user_daily_stats (chat_id, date)
+    """)
+
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_user_date 
+        ON user_daily_stats (user_id, date)
+    """)
+
+    # Композитный индекс для оптимизации GROUP BY запросов в top командах
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_chat_date_user_count 
+        ON user_daily_stats (chat_id, date, user_id, message_count)
+    """)
+
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_chat_meta_chat_user
+        ON user_chat_meta (chat_id, user_id)
+    """)
+
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_moderators_chat_user
+        ON chat_moderators (chat_id, user_id)
+    """)
+
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_moderators_chat_rank
+        ON chat_moderators (chat_id, rank)
+    """)
+
+
+    # Убедимся, что в таблице есть колонка count_media
+    cursor = db.execute("PRAGMA table_info(chat_stat_settings)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'count_media' not in columns:
+        try:
+            db.execute("ALTER TABLE chat_stat_settings ADD COLUMN count_media BOOLEAN DEFAULT 1")
+            db.commit()
+        except sqlite3.OperationalError:
+            pass
+
+    # Убедимся, что в таблице users есть колонка mention_ping_enabled
+    cursor = db.execute("PRAGMA table_info(users)")
+    user_columns = [column[1] for column in cursor.fetchall()]
+    if 'mention_ping_enabled' not in user_columns:
+        try:
+            db.execute("ALTER TABLE users ADD COLUMN mention_ping_enabled BOOLEAN DEFAULT 1")
+            db.commit()
+        except sqlite3.OperationalError:
+            pass
+
+    # Убедимся, что в таблице chat_stat_settings есть колонка profile_enabled
+    cursor = db.execute("PRAGMA table_info(chat_stat_settings)")
+    stat_columns = [column[1] for column in cursor.fetchall()]
+    if 'profile_enabled' not in stat_columns:
+        try:
+            db.execute("ALTER TABLE chat_stat_settings ADD COLUMN profile_enabled BOOLEAN DEFAULT 1")
+            db.commit()
+        except sqlite3.OperationalError:
+            pass
+
+    # Создаем настройки по умолчанию для всех чатов, у которых их еще нет
+    db.execute("""
+        INSERT OR IGNORE INTO chat_stat_settings (chat_id, stats_enabled, count_media, profile_enabled)
+        SELECT chat_id, 1, 1, 1 FROM chats
+    """)
+
+
+def _schema_v2(db):
+    """Уникальные индексы для UPSERT в счетчиках сообщений"""
+    # Уникальные индексы для UPSERT в счетчиках (record_message)
+    # Перед созданием сливаем возможные дубликаты, суммируя счетчики
+    cursor = db.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='index' AND name='idx_daily_stats_chat_date_unique'
+    """)
+    if not cursor.fetchone():
+        logger.info("Создаем уникальный индекс daily_stats (chat_id, date)...")
+        db.execute("""
+            UPDATE daily_stats SET message_count = (
+                SELECT SUM(d2.message_count) FROM daily_stats d2
+                WHERE d2.chat_id = daily_stats.chat_id AND d2.date = daily_stats.date
+            )
+            WHERE id IN (
+                SELECT MIN(id) FROM daily_stats
+                GROUP BY chat_id, date HAVING COUNT(*) > 1
+            )
+        """)
+        db.execute("""
+            DELETE FROM daily_stats WHERE id NOT IN (
+                SELECT MIN(id) FROM daily_stats GROUP BY chat_id, date
+            )
+        """)
+        db.execute("""
+            CREATE UNIQUE INDEX idx_daily_stats_chat_date_unique
+            ON daily_stats (chat_id, date)
+        """)
+
+    cursor = db.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='index' AND name='idx_user_daily_stats_unique'
+    """)
+    if not cursor.fetchone():
+        logger.info("Создаем уникальный индекс user_daily_stats (chat_id, user_id, date)...")
+        db.execute("""
+            UPDATE user_daily_stats SET message_count = (
+                SELECT SUM(u2.message_count) FROM user_daily_stats u2
+                WHERE u2.chat_id = user_daily_stats.chat_id
+                  AND u2.user_id = user_daily_stats.user_id
+                  AND u2.date = user_daily_stats.date
+            )
+            WHERE id IN (
+                SELECT MIN(id) FROM user_daily_stats
+                GROUP BY chat_id, user_id, date HAVING COUNT(*) > 1
+            )
+        """)
+        db.execute("""
+            DELETE FROM user_daily_stats WHERE id NOT IN (
+                SELECT MIN(id) FROM user_daily_stats GROUP BY chat_id, user_id, date
+            )
+        """)
+        db.execute("""
+            CREATE UNIQUE INDEX idx_user_daily_stats_unique
+            ON user_daily_stats (chat_id, user_id, date)
+        """)
+
+
+def _schema_v3(db):
+    """Сводные таблицы по неделям и месяцам"""
+    # Сводные таблицы по неделям и месяцам для топов за N дней
+    cursor = db.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name='user_stats_rollup'
+    """)
+    rollup_exists = cursor.fetchone() is not None
+    for statement in stats_rollup.CREATE_TABLES_SQL:
+        db.execute(statement)
+    if not rollup_exists:
+        logger.info("Заполняем сводные таблицы статистики из дневных счетчиков...")
+        stats_rollup.rebuild_sync(db)
+
+
+def _schema_v4(db):
+    """Почасовые гистограммы сообщений"""
+    # Почасовые гистограммы сообщений чатов (по UTC-дням)
+    db.execute(hourly_histogram.CREATE_TABLE_SQL)
+
+
+def _schema_v5(db):
+    """Таблицы друзей (раньше их создавал FriendsDatabase.init_db в этом же файле базы)"""
+    for statement in friends_db.CREATE_TABLES_SQL:
+        db.execute(statement)
+
+
+def _schema_v6(db):
+    """Очередь пакетного удаления неактивных пользователей и чатов"""
+    db.execute(bulk_purge.CREATE_QUEUE_SQL)
+
+
+def _schema_v7(db):
+    """
+    Имена пользователей хранятся только в users: из user_daily_stats и user_stats_rollup
+    убираются столбцы username, first_name и last_name, таблицы становятся WITHOUT ROWID
+    """
+    columns = [row[1] for row in db.execute("PRAGMA table_info(user_daily_stats)").fetchall()]
+    if 'username' in columns:
+        logger.info("Перестраиваем user_daily_stats без имен пользователей...")
+        # Пользователи, известные только по счетчикам, переносятся в users с именем за последний день
+        # (в SQLite столбцы без агрегата берутся из строки с MAX(date))
+        db.execute("""
+            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+            SELECT user_id, username, first_name, last_name
+            FROM (
+                SELECT user_id, username, first_name, last_name, MAX(date)
+                FROM user_daily_stats
+                WHERE user_id IS NOT NULL
+                GROUP BY user_id
+            )
+        """)
+        db.execute("""
+            CREATE TABLE user_daily_stats_new (
+                chat_id INTEGER,
+                user_id INTEGER,
+                date TEXT,
+                message_count INTEGER DEFAULT 0,
+                PRIMARY KEY (chat_id, user_id, date)
+            ) WITHOUT ROWID
+        """)
+        db.execute("""
+            INSERT INTO user_daily_stats_new (chat_id, user_id, date, message_count)
+            SELECT chat_id, user_id, date, SUM(message_count)
+            FROM user_daily_stats
+            WHERE chat_id IS NOT NULL AND user_id IS NOT NULL AND date IS NOT NULL
+            GROUP BY chat_id, user_id, date
+        """)
+        db.execute("DROP TABLE user_daily_stats")
+        db.execute("ALTER TABLE user_daily_stats_new RENAME TO user_daily_stats")
+    # Первичный ключ заменяет индексы (chat_id, date) и уникальный (chat_id, user_id, date)
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_chat_date_user_count
+        ON user_daily_stats (chat_id, date, user_id, message_count)
+    """)
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_user_date
+        ON user_daily_stats (user_id, date)
+    """)
+
+    columns = [row[1] for row in db.execute("PRAGMA table_info(user_stats_rollup)").fetchall()]
+    if 'username' in columns:
+        logger.info("Перестраиваем user_stats_rollup без имен пользователей...")
+        db.execute("ALTER TABLE user_stats_rollup RENAME TO user_stats_rollup_old")
+        db.execute("DROP INDEX IF EXISTS idx_user_stats_rollup_period")
+        for statement in stats_rollup.CREATE_TABLES_SQL:
+            db.execute(statement)
+        db.execute("""
+            INSERT INTO user_stats_rollup (chat_id, user_id, granularity, period_start, message_count)
+            SELECT chat_id, user_id, granularity, period_start, message_count FROM user_stats_rollup_old
+        """)
+        db.execute("DROP TABLE user_stats_rollup_old")
+
+
+def _schema_v8(db):
+    """Индекс нормализованных имен и членство пользователей в чатах для поиска по имени"""
+    for statement in name_index.CREATE_TABLE_SQL:
+        db.execute(statement)
+    name_index.rebuild_sync(db)
+    # Поиск @username без учета регистра (usernames в Telegram регистронезависимы)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+    # user_chat_meta - список участников чата; дополняем его пользователями из дневной статистики
+    db.execute("""
+        INSERT OR IGNORE INTO user_chat_meta (chat_id, user_id, first_seen)
+        SELECT chat_id, user_id, MIN(date) FROM user_daily_stats GROUP BY chat_id, user_id
+    """)
+
+
+def _schema_v9(db):
+    """Членство пользователей в чатах и покрывающий индекс дневных счетчиков по пользователю"""
+    for statement in chat_membership.CREATE_TABLE_SQL:
+        db.execute(statement)
+    chat_membership.rebuild_sync(db)
+    # В таблице WITHOUT ROWID вторичный индекс содержит и первичный ключ (chat_id),
+    # поэтому (user_id, date, message_count) покрывает запросы по пользователю
+    db.execute("DROP INDEX IF EXISTS idx_user_daily_stats_user_date")
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_user_date_count
+        ON user_daily_stats (user_id, date, message_count)
+    """)
+
+
+def _schema_v10(db):
+    """Пересборка индекса имен: ключи больше не сливают похожие кириллические и латинские буквы"""
+    name_index.rebuild_sync(db)
+
+
+# Шаги миграции основной базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1, _schema_v2, _schema_v3, _schema_v4, _schema_v5, _schema_v6, _schema_v7, _schema_v8, _schema_v9,
+                     _schema_v10)
 
 
 class Database:
@@ -31,373 +540,20 @@ class Database:
         self.db_path = db_path
         self._corruption_detected = False
         self._recovery_in_progress = False
+        # Буфер отложенной записи счетчиков сообщений
+        self.counters = StatsCounterBuffer(db_path)
     
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        def _init_sync():
-            # Проверяем, существует ли файл базы данных
-            import os
-            if not os.path.exists(self.db_path):
-                logger.info(f"Файл базы данных {self.db_path} не найден, создаем новую базу данных...")
-            
-            with sqlite3.connect(self.db_path) as db:
-                # Применяем настройки производительности SQLite
-                _apply_pragma_settings(db)
-                db.commit()
-                
-                # Таблица для хранения информации о чатах
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS chats (
-                        chat_id INTEGER PRIMARY KEY,
-                        chat_title TEXT,
-                        owner_id INTEGER,
-                        added_date TEXT,
-                        is_active BOOLEAN DEFAULT 1,
-                        has_admin_rights BOOLEAN DEFAULT 0,
-                        russian_commands_prefix BOOLEAN DEFAULT 0
-                    )
-                """)
-                
-                # Добавляем колонку has_admin_rights если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN has_admin_rights BOOLEAN DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку russian_commands_prefix если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN russian_commands_prefix BOOLEAN DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку chat_type если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN chat_type TEXT")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку member_count если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN member_count INTEGER")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку is_public если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN is_public BOOLEAN DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку username если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN username TEXT")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку invite_link если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN invite_link TEXT")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Таблица черного списка чатов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS blacklisted_chats (
-                        chat_id INTEGER PRIMARY KEY,
-                        reason TEXT,
-                        added_at TEXT
-                    )
-                """)
-                
-                # Добавляем колонку hints_mode если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN hints_mode INTEGER DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку авто-принятия заявок если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN auto_accept_join_requests BOOLEAN DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку уведомлений при авто-принятии, если её нет
-                try:
-                    db.execute("ALTER TABLE chats ADD COLUMN auto_accept_notify BOOLEAN DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Таблица для хранения информации о пользователях
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        is_bot BOOLEAN DEFAULT 0,
-                        last_seen TEXT,
-                        mention_ping_enabled BOOLEAN DEFAULT 1
-                    )
-                """)
-                
-                # Таблица для статистики сообщений по дням
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS daily_stats (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        date TEXT,
-                        message_count INTEGER DEFAULT 0,
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-                    )
-                """)
-                
-                # Таблица для статистики пользователей по дням
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS user_daily_stats (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        date TEXT,
-                        message_count INTEGER DEFAULT 0,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                """)
-                
-                # Добавляем колонку last_name если её нет
-                try:
-                    db.execute("ALTER TABLE user_daily_stats ADD COLUMN last_name TEXT")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-
-                # Таблица метаданных пользователя в чате (дата первого появления)
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS user_chat_meta (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        first_seen TEXT,
-                        UNIQUE(chat_id, user_id)
-                    )
-                """)
-                
-                # Таблица для запросов на вступление в чаты
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_join_requests (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        request_date TEXT,
-                        status TEXT DEFAULT 'pending',
-                        invite_link TEXT,
-                        admin_message_id INTEGER,
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                """)
-                
-                # Таблица для рангов модераторов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_moderators (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        rank INTEGER,
-                        assigned_by INTEGER,
-                        assigned_date TEXT,
-                        UNIQUE(chat_id, user_id),
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                        FOREIGN KEY (user_id) REFERENCES users (user_id),
-                        FOREIGN KEY (assigned_by) REFERENCES users (user_id)
-                    )
-                """)
-                
-                # Таблица для прав рангов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS rank_permissions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        rank INTEGER,
-                        permission_type TEXT,
-                        permission_value BOOLEAN DEFAULT 1,
-                        UNIQUE(chat_id, rank, permission_type),
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-                    )
-                """)
-                
-                # Таблица для настроек статистики
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_stat_settings (
-                        chat_id INTEGER PRIMARY KEY,
-                        stats_enabled BOOLEAN DEFAULT 1,
-                        count_media BOOLEAN DEFAULT 1,
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-                    )
-                """)
-                
-                # Таблица для отслеживания времени последнего сообщения
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS user_last_message (
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        last_message_time TEXT,
-                        PRIMARY KEY (chat_id, user_id),
-                        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-                    )
-                """)
-                
-                
-                # Создаем индексы для быстрого поиска
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_daily_stats_chat_date 
-                    ON daily_stats (chat_id, date)
-                """)
-                
-                # Индексы для прав рангов
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_rank_permissions_chat_rank 
-                    ON rank_permissions (chat_id, rank)
-                """)
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_rank_permissions_chat_type 
-                    ON rank_permissions (chat_id, permission_type)
-                """)
-                
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_user_daily_stats_chat_date 
-                    ON user_daily_stats (chat_id, date)
-                """)
-                
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_user_daily_stats_user_date 
-                    ON user_daily_stats (user_id, date)
-                """)
-                
-                # Композитный индекс для оптимизации GROUP BY запросов в top командах
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_user_daily_stats_chat_date_user_count 
-                    ON user_daily_stats (chat_id, date, user_id, message_count)
-                """)
-
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_user_chat_meta_chat_user
-                    ON user_chat_meta (chat_id, user_id)
-                """)
-                
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_moderators_chat_user
-                    ON chat_moderators (chat_id, user_id)
-                """)
-                
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_moderators_chat_rank
-                    ON chat_moderators (chat_id, rank)
-                """)
-                
-                
-                # Убедимся, что в таблице есть колонка count_media
-                cursor = db.execute("PRAGMA table_info(chat_stat_settings)")
-                columns = [column[1] for column in cursor.fetchall()]
-                if 'count_media' not in columns:
-                    try:
-                        db.execute("ALTER TABLE chat_stat_settings ADD COLUMN count_media BOOLEAN DEFAULT 1")
-                        db.commit()
-                    except sqlite3.OperationalError:
-                        pass
-                
-                # Убедимся, что в таблице users есть колонка mention_ping_enabled
-                cursor = db.execute("PRAGMA table_info(users)")
-                user_columns = [column[1] for column in cursor.fetchall()]
-                if 'mention_ping_enabled' not in user_columns:
-                    try:
-                        db.execute("ALTER TABLE users ADD COLUMN mention_ping_enabled BOOLEAN DEFAULT 1")
-                        db.commit()
-                    except sqlite3.OperationalError:
-                        pass
-                
-                # Убедимся, что в таблице chat_stat_settings есть колонка profile_enabled
-                cursor = db.execute("PRAGMA table_info(chat_stat_settings)")
-                stat_columns = [column[1] for column in cursor.fetchall()]
-                if 'profile_enabled' not in stat_columns:
-                    try:
-                        db.execute("ALTER TABLE chat_stat_settings ADD COLUMN profile_enabled BOOLEAN DEFAULT 1")
-                        db.commit()
-                    except sqlite3.OperationalError:
-                        pass
-                
-                # Создаем настройки по умолчанию для всех чатов, у которых их еще нет
-                db.execute("""
-                    INSERT OR IGNORE INTO chat_stat_settings (chat_id, stats_enabled, count_media, profile_enabled)
-                    SELECT chat_id, 1, 1, 1 FROM chats
-                """)
-                
-                # Проверяем, существует ли таблица user_last_message
-                cursor = db.execute("""
-                    SELECT name FROM sqlite_master 
-                    WHERE type='table' AND name='user_last_message'
-                """)
-                if not cursor.fetchone():
-                    # Таблица не существует, создаем её
-                    logger.info("Создаем таблицу user_last_message...")
-                    db.execute("""
-                        CREATE TABLE user_last_message (
-                            chat_id INTEGER,
-                            user_id INTEGER,
-                            last_message_time TEXT,
-                            PRIMARY KEY (chat_id, user_id),
-                            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-                        )
-                    """)
-                    logger.info("Таблица user_last_message создана")
-                
-                # Убедимся, что композитный индекс существует (для существующих баз данных)
-                cursor = db.execute("""
-                    SELECT name FROM sqlite_master 
-                    WHERE type='index' AND name='idx_user_daily_stats_chat_date_user_count'
-                """)
-                if not cursor.fetchone():
-                    logger.info("Создаем композитный индекс для оптимизации top запросов...")
-                    db.execute("""
-                        CREATE INDEX idx_user_daily_stats_chat_date_user_count 
-                        ON user_daily_stats (chat_id, date, user_id, message_count)
-                    """)
-                    logger.info("Композитный индекс создан")
-                
-                db.commit()
-                logger.info("База данных инициализирована")
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        if not os.path.exists(self.db_path):
+            logger.info(f"Файл базы данных {self.db_path} не найден, создаем новую базу данных...")
+        await run_migrations(self.db_path, "основной базы", SCHEMA_MIGRATIONS)
     
     async def check_integrity(self) -> bool:
         """Проверка целостности базы данных"""
         def _check_integrity_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("PRAGMA integrity_check")
                     result = cursor.fetchone()
                     # Если результат "ok", база цела
@@ -417,6 +573,9 @@ class Database:
                     logger.error(f"База данных не найдена: {self.db_path}")
                     return False
                 
+                # Закрываем соединения пула, чтобы файл не был занят во время замены
+                close_pool(self.db_path)
+                
                 # Создаем резервную копию перед восстановлением
                 backup_path = db_path.with_suffix(f".backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
                 logger.info(f"Создание резервной копии: {backup_path}")
@@ -465,7 +624,10 @@ class Database:
                 logger.error(f"Критическая ошибка при восстановлении базы данных: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _recover_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _recover_sync)
+        # После восстановления часть данных могла измениться
+        settings_cache.clear()
+        return result
     
     def _is_database_corrupted_error(self, error: Exception) -> bool:
         """Проверяет, является ли ошибка признаком повреждения базы данных"""
@@ -501,7 +663,7 @@ class Database:
         """Добавление чата в базу данных"""
         def _add_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO chats (chat_id, chat_title, owner_id, added_date, is_active)
                         VALUES (?, ?, ?, ?, 1)
@@ -513,13 +675,16 @@ class Database:
                 logger.error(f"Ошибка при добавлении чата {chat_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _add_chat_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _add_chat_sync)
+        # INSERT OR REPLACE сбрасывает настройки в таблице chats к значениям по умолчанию
+        settings_cache.invalidate(chat_id)
+        return result
     
     async def remove_chat(self, chat_id: int) -> bool:
         """Удаление чата из базы данных"""
         def _remove_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE chats SET is_active = 0 WHERE chat_id = ?
                     """, (chat_id,))
@@ -536,7 +701,7 @@ class Database:
         """Получение информации о чате"""
         def _get_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Проверяем, какие колонки есть
                     cursor_info = db.execute("PRAGMA table_info(chats)")
                     columns = [col[1] for col in cursor_info.fetchall()]
@@ -587,24 +752,24 @@ class Database:
     async def get_russian_commands_prefix_setting(self, chat_id: int) -> bool:
         """Получить настройку префикса для русских команд"""
         def _get_setting_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute("""
-                        SELECT russian_commands_prefix FROM chats WHERE chat_id = ?
-                    """, (chat_id,))
-                    result = cursor.fetchone()
-                    return bool(result[0]) if result else False
-            except Exception as e:
-                logger.error(f"Ошибка при получении настройки префикса русских команд: {e}")
-                return False
+            with get_connection(self.db_path) as db:
+                cursor = db.execute("""
+                    SELECT russian_commands_prefix FROM chats WHERE chat_id = ?
+                """, (chat_id,))
+                result = cursor.fetchone()
+                return bool(result[0]) if result else False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _get_setting_sync)
+        try:
+            return await settings_cache.get_or_load('russian_commands_prefix', chat_id, _get_setting_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении настройки префикса русских команд: {e}")
+            return False
     
     async def set_russian_commands_prefix_setting(self, chat_id: int, enabled: bool) -> bool:
         """Установить настройку префикса для русских команд"""
         def _set_setting_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE chats SET russian_commands_prefix = ? WHERE chat_id = ?
                     """, (enabled, chat_id))
@@ -614,29 +779,31 @@ class Database:
                 logger.error(f"Ошибка при установке настройки префикса русских команд: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _set_setting_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_setting_sync)
+        settings_cache.invalidate(chat_id, 'russian_commands_prefix')
+        return result
     
     async def get_hints_mode(self, chat_id: int) -> int:
         """Получить режим подсказок для чата"""
         def _get_hints_mode_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute("""
-                        SELECT hints_mode FROM chats WHERE chat_id = ?
-                    """, (chat_id,))
-                    result = cursor.fetchone()
-                    return int(result[0]) if result else 0
-            except Exception as e:
-                logger.error(f"Ошибка при получении режима подсказок: {e}")
-                return 0
+            with get_connection(self.db_path) as db:
+                cursor = db.execute("""
+                    SELECT hints_mode FROM chats WHERE chat_id = ?
+                """, (chat_id,))
+                result = cursor.fetchone()
+                return int(result[0]) if result else 0
         
-        return await asyncio.get_event_loop().run_in_executor(None, _get_hints_mode_sync)
+        try:
+            return await settings_cache.get_or_load('hints_mode', chat_id, _get_hints_mode_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении режима подсказок: {e}")
+            return 0
     
     async def set_hints_mode(self, chat_id: int, mode: int) -> bool:
         """Установить режим подсказок для чата"""
         def _set_hints_mode_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE chats SET hints_mode = ? WHERE chat_id = ?
                     """, (mode, chat_id))
@@ -646,7 +813,9 @@ class Database:
                 logger.error(f"Ошибка при установке режима подсказок: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _set_hints_mode_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_hints_mode_sync)
+        settings_cache.invalidate(chat_id, 'hints_mode')
+        return result
     
     async def add_user(self, user_id: int, username: str = None, 
                       first_name: str = None, last_name: str = None, 
@@ -654,12 +823,13 @@ class Database:
         """Добавление пользователя в базу данных"""
         def _add_user_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Сохраняем существующее значение mention_ping_enabled если пользователь уже существует
                     db.execute("""
                         INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, is_bot, last_seen, mention_ping_enabled)
                         VALUES (?, ?, ?, ?, ?, ?, COALESCE((SELECT mention_ping_enabled FROM users WHERE user_id = ?), 1))
                     """, (user_id, username, first_name, last_name, is_bot, datetime.now().isoformat(), user_id))
+                    name_index.refresh_keys_sync(db, user_id, username, first_name, last_name)
                     db.commit()
                     return True
             except Exception as e:
@@ -672,7 +842,7 @@ class Database:
         """Получение информации о пользователе"""
         def _get_user_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT user_id, username, first_name, last_name, is_bot, last_seen, mention_ping_enabled
                         FROM users WHERE user_id = ?
@@ -696,13 +866,15 @@ class Database:
         return await asyncio.get_event_loop().run_in_executor(None, _get_user_sync)
     
     async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
-        """Получение информации о пользователе по username"""
+        """Получение информации о пользователе по username (без учета регистра)"""
         def _get_user_by_username_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT user_id, username, first_name, last_name, is_bot, last_seen
-                        FROM users WHERE username = ?
+                        FROM users WHERE username = ? COLLATE NOCASE
+                        ORDER BY last_seen DESC
+                        LIMIT 1
                     """, (username,))
                     row = cursor.fetchone()
                     if row:
@@ -725,7 +897,7 @@ class Database:
         """Получение всех активных чатов"""
         def _get_all_chats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT chat_id, chat_title, owner_id, added_date
                         FROM chats WHERE is_active = 1
@@ -749,7 +921,7 @@ class Database:
 
     async def is_chat_blacklisted(self, chat_id: int) -> bool:
         def _get_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cur = db.execute("SELECT 1 FROM blacklisted_chats WHERE chat_id = ?", (chat_id,))
                 return cur.fetchone() is not None
         return await asyncio.get_event_loop().run_in_executor(None, _get_sync)
@@ -757,7 +929,7 @@ class Database:
     async def add_chat_to_blacklist(self, chat_id: int, reason: str | None = None) -> bool:
         def _set_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute(
                         "INSERT OR REPLACE INTO blacklisted_chats (chat_id, reason, added_at) VALUES (?, ?, ?)",
                         (chat_id, reason, datetime.now().isoformat())
@@ -772,7 +944,7 @@ class Database:
     async def remove_chat_from_blacklist(self, chat_id: int) -> bool:
         def _del_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("DELETE FROM blacklisted_chats WHERE chat_id = ?", (chat_id,))
                     db.commit()
                     return True
@@ -783,7 +955,7 @@ class Database:
 
     async def list_blacklisted_chats(self) -> list[dict]:
         def _list_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cur = db.execute("SELECT chat_id, reason, added_at FROM blacklisted_chats ORDER BY added_at DESC")
                 rows = cur.fetchall()
                 return [{"chat_id": r[0], "reason": r[1], "added_at": r[2]} for r in rows]
@@ -792,24 +964,24 @@ class Database:
     async def get_auto_accept_join_requests(self, chat_id: int) -> bool:
         """Получить настройку авто-принятия заявок в чат."""
         def _get_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cur = db.execute(
-                        "SELECT auto_accept_join_requests FROM chats WHERE chat_id = ?",
-                        (chat_id,)
-                    )
-                    row = cur.fetchone()
-                    return bool(row[0]) if row and row[0] is not None else False
-            except Exception as e:
-                logger.error(f"Ошибка при получении авто-принятия заявок для чата {chat_id}: {e}")
-                return False
-        return await asyncio.get_event_loop().run_in_executor(None, _get_sync)
+            with get_connection(self.db_path) as db:
+                cur = db.execute(
+                    "SELECT auto_accept_join_requests FROM chats WHERE chat_id = ?",
+                    (chat_id,)
+                )
+                row = cur.fetchone()
+                return bool(row[0]) if row and row[0] is not None else False
+        try:
+            return await settings_cache.get_or_load('auto_accept_join_requests', chat_id, _get_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении авто-принятия заявок для чата {chat_id}: {e}")
+            return False
 
     async def set_auto_accept_join_requests(self, chat_id: int, enabled: bool) -> bool:
         """Установить настройку авто-принятия заявок в чат."""
         def _set_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute(
                         "UPDATE chats SET auto_accept_join_requests = ? WHERE chat_id = ?",
                         (1 if enabled else 0, chat_id)
@@ -819,29 +991,31 @@ class Database:
             except Exception as e:
                 logger.error(f"Ошибка при установке авто-принятия заявок для чата {chat_id}: {e}")
                 return False
-        return await asyncio.get_event_loop().run_in_executor(None, _set_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_sync)
+        settings_cache.invalidate(chat_id, 'auto_accept_join_requests')
+        return result
 
     async def get_auto_accept_notify(self, chat_id: int) -> bool:
         """Получить настройку уведомлений при авто-принятии заявок."""
         def _get_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cur = db.execute(
-                        "SELECT auto_accept_notify FROM chats WHERE chat_id = ?",
-                        (chat_id,)
-                    )
-                    row = cur.fetchone()
-                    return bool(row[0]) if row and row[0] is not None else False
-            except Exception as e:
-                logger.error(f"Ошибка при получении настройки авто-уведомлений для чата {chat_id}: {e}")
-                return False
-        return await asyncio.get_event_loop().run_in_executor(None, _get_sync)
+            with get_connection(self.db_path) as db:
+                cur = db.execute(
+                    "SELECT auto_accept_notify FROM chats WHERE chat_id = ?",
+                    (chat_id,)
+                )
+                row = cur.fetchone()
+                return bool(row[0]) if row and row[0] is not None else False
+        try:
+            return await settings_cache.get_or_load('auto_accept_notify', chat_id, _get_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении настройки авто-уведомлений для чата {chat_id}: {e}")
+            return False
 
     async def set_auto_accept_notify(self, chat_id: int, enabled: bool) -> bool:
         """Установить настройку уведомлений при авто-принятии заявок."""
         def _set_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute(
                         "UPDATE chats SET auto_accept_notify = ? WHERE chat_id = ?",
                         (1 if enabled else 0, chat_id)
@@ -851,13 +1025,15 @@ class Database:
             except Exception as e:
                 logger.error(f"Ошибка при установке настройки авто-уведомлений для чата {chat_id}: {e}")
                 return False
-        return await asyncio.get_event_loop().run_in_executor(None, _set_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_sync)
+        settings_cache.invalidate(chat_id, 'auto_accept_notify')
+        return result
     
     async def update_admin_rights(self, chat_id: int, has_rights: bool) -> bool:
         """Обновление информации о правах администратора"""
         def _update_admin_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE chats SET has_admin_rights = ? WHERE chat_id = ?
                     """, (has_rights, chat_id))
@@ -870,59 +1046,46 @@ class Database:
         return await asyncio.get_event_loop().run_in_executor(None, _update_admin_sync)
     
     async def increment_message_count(self, chat_id: int, date: str = None) -> bool:
-        """Увеличение счетчика сообщений за день"""
+        """Увеличение счетчика сообщений за день (через буфер отложенной записи)"""
         if date is None:
             date = datetime.now().strftime('%Y-%m-%d')
         
-        def _increment_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Проверяем, есть ли запись за этот день
-                    cursor = db.execute("""
-                        SELECT message_count FROM daily_stats 
-                        WHERE chat_id = ? AND date = ?
-                    """, (chat_id, date))
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        # Обновляем существующую запись
-                        db.execute("""
-                            UPDATE daily_stats SET message_count = message_count + 1
-                            WHERE chat_id = ? AND date = ?
-                        """, (chat_id, date))
-                    else:
-                        # Создаем новую запись
-                        db.execute("""
-                            INSERT INTO daily_stats (chat_id, date, message_count)
-                            VALUES (?, ?, 1)
-                        """, (chat_id, date))
-                    
-                    db.commit()
-                    return True
-            except Exception as e:
-                logger.error(f"Ошибка при увеличении счетчика сообщений для чата {chat_id}: {e}")
-                return False
-        
-        return await asyncio.get_event_loop().run_in_executor(None, _increment_sync)
+        self.counters.add_chat_message(chat_id, date)
+        if self.counters.should_flush():
+            await self.flush_counters()
+        return True
+    
+    async def flush_counters(self) -> int:
+        """
+        Сбросить буфер счетчиков сообщений в базу данных.
+        Вызывается и перед выборками, которые не добавляют приращения из буфера сами
+        (окна за несколько дней, сводные таблицы, суммы по всем чатам).
+        """
+        if not self.counters.pending:
+            return 0
+        return await asyncio.get_event_loop().run_in_executor(None, self.counters.flush_sync)
     
     async def get_daily_stats(self, chat_id: int, days: int = 7) -> List[Dict[str, Any]]:
         """Получение статистики сообщений за последние N дней"""
         def _get_stats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with self.counters.consistent_read(), get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT date, message_count FROM daily_stats 
                         WHERE chat_id = ? 
                         ORDER BY date DESC 
                         LIMIT ?
                     """, (chat_id, days))
-                    rows = cursor.fetchall()
+                    counts = dict(cursor.fetchall())
+                    # Добавляем несброшенные приращения из буфера счетчиков
+                    for date, delta in self.counters.chat_deltas(chat_id).items():
+                        counts[date] = counts.get(date, 0) + delta
                     return [
                         {
-                            'date': row[0],
-                            'message_count': row[1]
+                            'date': date,
+                            'message_count': counts[date]
                         }
-                        for row in rows
+                        for date in sorted(counts, reverse=True)[:days]
                     ]
             except Exception as e:
                 logger.error(f"Ошибка при получении статистики для чата {chat_id}: {e}")
@@ -946,7 +1109,7 @@ class Database:
 
         def _ensure_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Пытаемся вставить, при конфликте ничего не делаем
                     db.execute(
                         """
@@ -965,7 +1128,7 @@ class Database:
         """Получить дату первого появления пользователя в чате"""
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cur = db.execute(
                         "SELECT first_seen FROM user_chat_meta WHERE chat_id = ? AND user_id = ?",
                         (chat_id, user_id),
@@ -980,9 +1143,11 @@ class Database:
 
     async def get_user_30d_stats(self, chat_id: int, user_id: int) -> list[dict[str, int | str]]:
         """Статистика пользователя по дням за последние 30 дней в чате"""
+        await self.flush_counters()
+        
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cur = db.execute(
                         """
                         SELECT date, message_count FROM user_daily_stats
@@ -1002,9 +1167,11 @@ class Database:
 
     async def get_user_7d_stats(self, chat_id: int, user_id: int) -> list[dict[str, int | str]]:
         """Статистика пользователя по дням за последние 7 дней в чате"""
+        await self.flush_counters()
+        
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cur = db.execute(
                         """
                         SELECT date, message_count FROM user_daily_stats
@@ -1024,9 +1191,11 @@ class Database:
 
     async def get_user_best_day(self, chat_id: int, user_id: int) -> dict | None:
         """Лучший день пользователя (макс. сообщений) в чате"""
+        await self.flush_counters()
+        
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cur = db.execute(
                         """
                         SELECT date, message_count FROM user_daily_stats
@@ -1048,7 +1217,7 @@ class Database:
         """Получение статистики пользователя за конкретный день"""
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with self.counters.consistent_read(), get_connection(self.db_path) as db:
                     cur = db.execute(
                         """
                         SELECT date, message_count FROM user_daily_stats
@@ -1057,8 +1226,12 @@ class Database:
                         (chat_id, user_id, date),
                     )
                     row = cur.fetchone()
+                    # Учитываем несброшенные приращения из буфера счетчиков
+                    delta = self.counters.user_delta(chat_id, user_id, date)
                     if row:
-                        return {"date": row[0], "message_count": row[1]}
+                        return {"date": row[0], "message_count": row[1] + delta}
+                    if delta:
+                        return {"date": date, "message_count": delta}
                     return None
             except Exception as e:
                 logger.error(f"Ошибка при получении дневной статистики пользователя {user_id}: {e}")
@@ -1068,9 +1241,11 @@ class Database:
 
     async def get_user_global_activity(self, user_id: int) -> dict:
         """Глобальная активность по всем чатам: сегодня и за 7 дней"""
+        await self.flush_counters()
+        
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cur = db.execute(
                         """
                         SELECT 
@@ -1093,7 +1268,7 @@ class Database:
         """Очистка старых записей статистики (старше N дней)"""
         def _cleanup_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Вычисляем сегодняшнюю дату по Москве (UTC+3)
                     ts = datetime.utcnow().timestamp() + 10800
                     moscow_today = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
@@ -1105,6 +1280,15 @@ class Database:
                         """.format(days_to_keep),
                         (moscow_today,)
                     )
+                    # Почасовые гистограммы (UTC-дни) храним на день дольше: сегодняшний
+                    # день в поясе UTC+N начинается во вчерашнем UTC-дне
+                    db.execute(
+                        """
+                        DELETE FROM chat_hourly_stats 
+                        WHERE date < date(?, '-{} days')
+                        """.format(days_to_keep + 1),
+                        (moscow_today,)
+                    )
                     db.commit()
                     return True
             except Exception as e:
@@ -1116,48 +1300,19 @@ class Database:
     async def increment_user_message_count(self, chat_id: int, user_id: int, 
                                          username: str = None, first_name: str = None, 
                                          last_name: str = None, date: str = None) -> bool:
-        """Увеличение счетчика сообщений пользователя за день"""
+        """
+        Увеличение счетчика сообщений пользователя за день (через буфер отложенной записи).
+        Имена в счетчиках не хранятся: username, first_name и last_name сохраняются в users (add_user).
+        """
         if date is None:
             # Дата по московскому времени (UTC+3)
             ts = datetime.utcnow().timestamp() + 10800
             date = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
         
-        def _increment_user_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Включаем настройки производительности
-                    _apply_pragma_settings(db)
-                    
-                    # Ищем существующую запись пользователя за день
-                    cursor = db.execute("""
-                        SELECT message_count FROM user_daily_stats 
-                        WHERE chat_id = ? AND user_id = ? AND date = ?
-                    """, (chat_id, user_id, date))
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        # Запись уже существует, увеличиваем счетчик
-                        new_count = row[0] + 1
-                        db.execute("""
-                            UPDATE user_daily_stats 
-                            SET message_count = ?, username = ?, first_name = ?, last_name = ?
-                            WHERE chat_id = ? AND user_id = ? AND date = ?
-                        """, (new_count, username, first_name, last_name, chat_id, user_id, date))
-                    else:
-                        # Записи нет, создаем новую
-                        db.execute("""
-                            INSERT INTO user_daily_stats 
-                            (chat_id, user_id, date, message_count, username, first_name, last_name)
-                            VALUES (?, ?, ?, 1, ?, ?, ?)
-                        """, (chat_id, user_id, date, username, first_name, last_name))
-                    
-                    db.commit()
-                    return True
-            except Exception as e:
-                logger.error(f"Ошибка при увеличении счетчика сообщений пользователя {user_id}: {e}")
-                return False
-        
-        return await asyncio.get_event_loop().run_in_executor(None, _increment_user_sync)
+        self.counters.add_user_message(chat_id, user_id, date)
+        if self.counters.should_flush():
+            await self.flush_counters()
+        return True
     
     async def get_top_users_today(self, chat_id: int, limit: int = 20, timezone_offset: int = 3) -> List[Dict[str, Any]]:
         """Получение топа пользователей за сегодня с учетом часового пояса. Группирует по user_id для предотвращения дубликатов."""
@@ -1167,9 +1322,9 @@ class Database:
         
         def _get_top_users_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Применяем настройки производительности
-                    _apply_pragma_settings(db)
+                with self.counters.consistent_read(), get_connection(self.db_path) as db:
+                    # Несброшенные приращения из буфера счетчиков
+                    deltas = self.counters.user_deltas(chat_id, today)
                     
                     # Отладочная информация только в DEBUG режиме
                     if DEBUG:
@@ -1192,21 +1347,23 @@ class Database:
                         logger.info(f"Записей за {today} для чата {chat_id}: {today_records}")
                     
                     # Основной запрос с оптимизированным индексом
+                    # Берем с запасом на число пользователей в буфере: приращения только
+                    # увеличивают счетчики, поэтому никто за пределами выборки не попадет в топ
                     cursor = db.execute("""
-                        SELECT user_id, MAX(username) as username, MAX(first_name) as first_name, MAX(last_name) as last_name, SUM(message_count) as message_count 
-                        FROM user_daily_stats 
-                        WHERE chat_id = ? AND date = ? AND message_count > 0
-                        GROUP BY user_id
-                        ORDER BY message_count DESC 
+                        SELECT s.user_id, u.username, u.first_name, u.last_name, s.message_count
+                        FROM user_daily_stats s
+                        LEFT JOIN users u ON u.user_id = s.user_id
+                        WHERE s.chat_id = ? AND s.date = ? AND s.message_count > 0
+                        ORDER BY s.message_count DESC
                         LIMIT ?
-                    """, (chat_id, today, limit))
+                    """, (chat_id, today, limit + len(deltas)))
                     rows = cursor.fetchall()
                     
                     if DEBUG:
                         logger.info(f"Найдено {len(rows)} пользователей с сообщениями > 0")
                     
-                    return [
-                        {
+                    users = {
+                        row[0]: {
                             'user_id': row[0],
                             'username': row[1],
                             'first_name': row[2],
@@ -1214,7 +1371,34 @@ class Database:
                             'message_count': row[4]
                         }
                         for row in rows
-                    ]
+                    }
+                    
+                    if deltas:
+                        # Пользователи из буфера, не попавшие в выборку: берем их счетчики и имена из БД
+                        missing = [uid for uid in deltas if uid not in users]
+                        if missing:
+                            placeholders = ','.join(['?'] * len(missing))
+                            cursor = db.execute(f"""
+                                SELECT u.user_id, u.username, u.first_name, u.last_name, s.message_count
+                                FROM users u
+                                LEFT JOIN user_daily_stats s
+                                    ON s.chat_id = ? AND s.user_id = u.user_id AND s.date = ?
+                                WHERE u.user_id IN ({placeholders})
+                            """, (chat_id, today, *missing))
+                            stored = {row[0]: row for row in cursor.fetchall()}
+                            for uid in missing:
+                                row = stored.get(uid)
+                                users[uid] = {
+                                    'user_id': uid,
+                                    'username': row[1] if row else None,
+                                    'first_name': row[2] if row else None,
+                                    'last_name': row[3] if row else None,
+                                    'message_count': (row[4] if row else None) or 0
+                                }
+                        for uid, count in deltas.items():
+                            users[uid]['message_count'] += count
+                    
+                    return sorted(users.values(), key=lambda u: u['message_count'], reverse=True)[:limit]
             except Exception as e:
                 logger.error(f"Ошибка при получении топа пользователей для чата {chat_id}: {e}")
                 return []
@@ -1222,27 +1406,52 @@ class Database:
         return await asyncio.get_event_loop().run_in_executor(None, _get_top_users_sync)
     
     async def get_top_users_last_days_global(self, days: int = 60, limit: int = 30) -> List[Dict[str, Any]]:
-        """Топ пользователей по сообщениям за последние N дней по всем чатам."""
+        """
+        Топ пользователей по сообщениям за последние N дней по всем чатам.
+        Окна длиннее DAILY_STATS_EXACT_DAYS считаются по сводным таблицам (см. stats_rollup.window_bounds).
+        """
+        await self.flush_counters()
+        
         def _get_top_users_last_days_global_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute(
-                        f"""
-                            SELECT 
-                                user_id,
-                                MAX(username) as username,
-                                MAX(first_name) as first_name,
-                                MAX(last_name) as last_name,
-                                SUM(message_count) as total_messages
-                            FROM user_daily_stats
-                            WHERE date >= date('now','-{days} days')
-                            GROUP BY user_id
-                            HAVING total_messages > 0
-                            ORDER BY total_messages DESC
-                            LIMIT ?
-                        """,
-                        (limit,)
-                    )
+                with get_connection(self.db_path) as db:
+                    if days <= DAILY_STATS_EXACT_DAYS:
+                        cursor = db.execute(
+                            f"""
+                                SELECT s.user_id, u.username, u.first_name, u.last_name, s.total_messages
+                                FROM (
+                                    SELECT user_id, SUM(message_count) as total_messages
+                                    FROM user_daily_stats
+                                    WHERE date >= date('now','-{days} days')
+                                    GROUP BY user_id
+                                    HAVING total_messages > 0
+                                    ORDER BY total_messages DESC
+                                    LIMIT ?
+                                ) s
+                                LEFT JOIN users u ON u.user_id = s.user_id
+                                ORDER BY s.total_messages DESC
+                            """,
+                            (limit,)
+                        )
+                    else:
+                        weeks_from, months_from = self._rollup_window(days)
+                        cursor = db.execute(
+                            f"""
+                                SELECT s.user_id, u.username, u.first_name, u.last_name, s.total_messages
+                                FROM (
+                                    SELECT user_id, SUM(message_count) as total_messages
+                                    FROM user_stats_rollup
+                                    WHERE {stats_rollup.window_condition()}
+                                    GROUP BY user_id
+                                    HAVING total_messages > 0
+                                    ORDER BY total_messages DESC
+                                    LIMIT ?
+                                ) s
+                                LEFT JOIN users u ON u.user_id = s.user_id
+                                ORDER BY s.total_messages DESC
+                            """,
+                            (weeks_from, months_from, months_from, limit)
+                        )
                     rows = cursor.fetchall()
                     return [
                         {
@@ -1261,27 +1470,52 @@ class Database:
         return await asyncio.get_event_loop().run_in_executor(None, _get_top_users_last_days_global_sync)
 
     async def get_top_users_last_days(self, chat_id: int, days: int = 60, limit: int = 20) -> List[Dict[str, Any]]:
-        """Топ пользователей по сообщениям за последние N дней для конкретного чата."""
+        """
+        Топ пользователей по сообщениям за последние N дней для конкретного чата.
+        Окна длиннее DAILY_STATS_EXACT_DAYS считаются по сводным таблицам (см. stats_rollup.window_bounds).
+        """
+        await self.flush_counters()
+        
         def _get_top_users_last_days_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute(
-                        f"""
-                            SELECT 
-                                user_id,
-                                MAX(username) as username,
-                                MAX(first_name) as first_name,
-                                MAX(last_name) as last_name,
-                                SUM(message_count) as total_messages
-                            FROM user_daily_stats
-                            WHERE chat_id = ? AND date >= date('now','-{days} days')
-                            GROUP BY user_id
-                            HAVING total_messages > 0
-                            ORDER BY total_messages DESC
-                            LIMIT ?
-                        """,
-                        (chat_id, limit)
-                    )
+                with get_connection(self.db_path) as db:
+                    if days <= DAILY_STATS_EXACT_DAYS:
+                        cursor = db.execute(
+                            f"""
+                                SELECT s.user_id, u.username, u.first_name, u.last_name, s.total_messages
+                                FROM (
+                                    SELECT user_id, SUM(message_count) as total_messages
+                                    FROM user_daily_stats
+                                    WHERE chat_id = ? AND date >= date('now','-{days} days')
+                                    GROUP BY user_id
+                                    HAVING total_messages > 0
+                                    ORDER BY total_messages DESC
+                                    LIMIT ?
+                                ) s
+                                LEFT JOIN users u ON u.user_id = s.user_id
+                                ORDER BY s.total_messages DESC
+                            """,
+                            (chat_id, limit)
+                        )
+                    else:
+                        weeks_from, months_from = self._rollup_window(days)
+                        cursor = db.execute(
+                            f"""
+                                SELECT s.user_id, u.username, u.first_name, u.last_name, s.total_messages
+                                FROM (
+                                    SELECT user_id, SUM(message_count) as total_messages
+                                    FROM user_stats_rollup
+                                    WHERE chat_id = ? AND {stats_rollup.window_condition()}
+                                    GROUP BY user_id
+                                    HAVING total_messages > 0
+                                    ORDER BY total_messages DESC
+                                    LIMIT ?
+                                ) s
+                                LEFT JOIN users u ON u.user_id = s.user_id
+                                ORDER BY s.total_messages DESC
+                            """,
+                            (chat_id, weeks_from, months_from, months_from, limit)
+                        )
                     rows = cursor.fetchall()
                     return [
                         {
@@ -1299,11 +1533,16 @@ class Database:
         
         return await asyncio.get_event_loop().run_in_executor(None, _get_top_users_last_days_sync)
     
+    @staticmethod
+    def _rollup_window(days: int):
+        """Границы сводных строк для окна «последние N дней» (даты в UTC, как date('now'))"""
+        return stats_rollup.window_bounds(datetime.utcnow().strftime('%Y-%m-%d'), days)
+    
     async def get_all_active_chats(self) -> List[Dict[str, Any]]:
         """Получение всех активных чатов"""
         def _get_chats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Используем DISTINCT чтобы избежать дубликатов
                     cursor = db.execute("""
                         SELECT DISTINCT chat_id, chat_title, owner_id, added_date, has_admin_rights, chat_type, member_count
@@ -1334,7 +1573,7 @@ class Database:
         """Получение всех активных чатов для обновления (включая приватные)"""
         def _get_all_chats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT DISTINCT chat_id, chat_title, owner_id, added_date, has_admin_rights, chat_type, member_count
                         FROM chats 
@@ -1362,9 +1601,11 @@ class Database:
     
     async def get_chat_activity_stats(self, chat_id: int, days: int = 7) -> Dict[str, Any]:
         """Получение статистики активности чата за N дней"""
+        await self.flush_counters()
+        
         def _get_stats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Общее количество сообщений за период
                     # Граница периода относительно московской даты
                     ts = datetime.utcnow().timestamp() + 10800
@@ -1406,7 +1647,7 @@ class Database:
         """Создание запроса на вступление в чат"""
         def _create_request_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         INSERT INTO chat_join_requests (chat_id, user_id, request_date, admin_message_id)
                         VALUES (?, ?, ?, ?)
@@ -1423,7 +1664,7 @@ class Database:
         """Обновление статуса запроса на вступление"""
         def _update_request_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE chat_join_requests 
                         SET status = ?, invite_link = ?
@@ -1441,7 +1682,7 @@ class Database:
         """Получение информации о запросе на вступление"""
         def _get_request_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT id, chat_id, user_id, request_date, status, invite_link, admin_message_id
                         FROM chat_join_requests 
@@ -1467,9 +1708,12 @@ class Database:
     
     async def update_chat_id(self, old_chat_id: int, new_chat_id: int) -> bool:
         """Обновление ID чата при миграции группы в супергруппу"""
+        # Сначала записываем буфер счетчиков, чтобы приращения не остались на старых данных
+        await self.flush_counters()
+        
         def _update_chat_id_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Проверяем, существует ли уже чат с новым ID
                     cursor = db.execute("SELECT chat_id FROM chats WHERE chat_id = ?", (new_chat_id,))
                     if cursor.fetchone():
@@ -1481,24 +1725,52 @@ class Database:
                         db.execute("UPDATE chats SET chat_id = ? WHERE chat_id = ?", (new_chat_id, old_chat_id))
                     
                     # Обновляем ID в остальных таблицах
-                    db.execute("UPDATE daily_stats SET chat_id = ? WHERE chat_id = ?", (new_chat_id, old_chat_id))
-                    db.execute("UPDATE user_daily_stats SET chat_id = ? WHERE chat_id = ?", (new_chat_id, old_chat_id))
-                    db.execute("UPDATE user_chat_meta SET chat_id = ? WHERE chat_id = ?", (new_chat_id, old_chat_id))
+                    # Счетчики сливаем: у нового чата могут быть строки за те же дни
+                    db.execute("""
+                        INSERT INTO daily_stats (chat_id, date, message_count)
+                        SELECT ?, date, message_count FROM daily_stats WHERE chat_id = ?
+                        ON CONFLICT(chat_id, date) DO UPDATE SET
+                            message_count = message_count + excluded.message_count
+                    """, (new_chat_id, old_chat_id))
+                    db.execute("DELETE FROM daily_stats WHERE chat_id = ?", (old_chat_id,))
+                    db.execute("""
+                        INSERT INTO user_daily_stats (chat_id, user_id, date, message_count)
+                        SELECT ?, user_id, date, message_count FROM user_daily_stats WHERE chat_id = ?
+                        ON CONFLICT(chat_id, user_id, date) DO UPDATE SET
+                            message_count = message_count + excluded.message_count
+                    """, (new_chat_id, old_chat_id))
+                    db.execute("DELETE FROM user_daily_stats WHERE chat_id = ?", (old_chat_id,))
+                    db.execute("""
+                        INSERT INTO user_chat_meta (chat_id, user_id, first_seen)
+                        SELECT ?, user_id, first_seen FROM user_chat_meta WHERE chat_id = ?
+                        ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                            first_seen = MIN(COALESCE(first_seen, excluded.first_seen),
+                                             COALESCE(excluded.first_seen, first_seen))
+                    """, (new_chat_id, old_chat_id))
+                    db.execute("DELETE FROM user_chat_meta WHERE chat_id = ?", (old_chat_id,))
                     db.execute("UPDATE chat_join_requests SET chat_id = ? WHERE chat_id = ?", (new_chat_id, old_chat_id))
                     
+                    # Сводные строки сливаем: у нового чата уже могут быть строки за те же периоды
+                    stats_rollup.move_chat_sync(db, old_chat_id, new_chat_id)
+                    hourly_histogram.move_chat_sync(db, old_chat_id, new_chat_id)
+                    chat_membership.move_chat_sync(db, old_chat_id, new_chat_id)
+                    
                     db.commit()
                     return True
             except Exception as e:
                 logger.error(f"Ошибка при обновлении ID чата {old_chat_id} -> {new_chat_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _update_chat_id_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _update_chat_id_sync)
+        settings_cache.invalidate(old_chat_id)
+        settings_cache.invalidate(new_chat_id)
+        return result
     
     async def cleanup_old_user_stats(self, days_to_keep: int = 7) -> bool:
         """Очистка старых записей пользовательской статистики"""
         def _cleanup_user_stats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Удаляем записи старше указанного количества дней
                     db.execute("""
                         DELETE FROM user_daily_stats 
@@ -1512,6 +1784,27 @@ class Database:
         
         return await asyncio.get_event_loop().run_in_executor(None, _cleanup_user_stats_sync)
     
+    async def cleanup_old_rollups(self, months_to_keep: int = STATS_ROLLUP_RETENTION_MONTHS) -> bool:
+        """Очистка сводных строк статистики старше N месяцев"""
+        def _cleanup_rollups_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    db.execute("""
+                        DELETE FROM user_stats_rollup
+                        WHERE period_start < date('now', 'start of month', '-{} months')
+                    """.format(months_to_keep))
+                    db.execute("""
+                        DELETE FROM chat_stats_rollup
+                        WHERE period_start < date('now', 'start of month', '-{} months')
+                    """.format(months_to_keep))
+                    db.commit()
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка при очистке старых сводных записей статистики: {e}")
+                return False
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _cleanup_rollups_sync)
+    
     async def get_top_chats_by_activity(self, days: int = 3, limit: int = 30, 
                                        exclude_chat_ids: list = None, 
                                        include_private: bool = False,
@@ -1526,14 +1819,20 @@ class Database:
             include_private: Включать ли частные чаты (по умолчанию только публичные)
             min_activity_threshold: Минимальное количество сообщений для показа
         """
+        await self.flush_counters()
+        
         def _get_top_chats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Формируем условия WHERE
-                    where_conditions = [
-                        "ds.date >= date('now', '-{} days')".format(days),
-                        "c.is_active = 1"
-                    ]
+                with get_connection(self.db_path) as db:
+                    # Формируем условия WHERE и параметры для запроса
+                    params = []
+                    if days <= DAILY_STATS_EXACT_DAYS:
+                        where_conditions = ["ds.date >= date('now', '-{} days')".format(days)]
+                    else:
+                        where_conditions = [stats_rollup.window_condition('ds')]
+                        weeks_from, months_from = self._rollup_window(days)
+                        params.extend([weeks_from, months_from, months_from])
+                    where_conditions.append("c.is_active = 1")
                     
                     # Условие для публичных/частных чатов
                     if not include_private:
@@ -1546,27 +1845,43 @@ class Database:
                     
                     where_clause = " AND ".join(where_conditions)
                     
-                    # Параметры для запроса
-                    params = []
                     if exclude_chat_ids:
                         params.extend(exclude_chat_ids)
                     
                     # Получаем топ чатов по общему количеству сообщений за последние N дней
-                    query = f"""
-                        SELECT 
-                            ds.chat_id,
-                            c.chat_title,
-                            SUM(ds.message_count) as total_messages,
-                            COUNT(DISTINCT ds.date) as active_days,
-                            c.is_public
-                        FROM daily_stats ds
-                        JOIN chats c ON ds.chat_id = c.chat_id
-                        WHERE {where_clause}
-                        GROUP BY ds.chat_id
-                        HAVING total_messages > ?
-                        ORDER BY total_messages DESC, active_days DESC
-                        LIMIT ?
-                    """
+                    if days <= DAILY_STATS_EXACT_DAYS:
+                        query = f"""
+                            SELECT 
+                                ds.chat_id,
+                                c.chat_title,
+                                SUM(ds.message_count) as total_messages,
+                                COUNT(DISTINCT ds.date) as active_days,
+                                c.is_public
+                            FROM daily_stats ds
+                            JOIN chats c ON ds.chat_id = c.chat_id
+                            WHERE {where_clause}
+                            GROUP BY ds.chat_id
+                            HAVING total_messages > ?
+                            ORDER BY total_messages DESC, active_days DESC
+                            LIMIT ?
+                        """
+                    else:
+                        # Длинные окна - по сводным строкам недель и месяцев
+                        query = f"""
+                            SELECT 
+                                ds.chat_id,
+                                c.chat_title,
+                                SUM(ds.message_count) as total_messages,
+                                SUM(ds.active_days) as active_days,
+                                c.is_public
+                            FROM chat_stats_rollup ds
+                            JOIN chats c ON ds.chat_id = c.chat_id
+                            WHERE {where_clause}
+                            GROUP BY ds.chat_id
+                            HAVING total_messages > ?
+                            ORDER BY total_messages DESC, active_days DESC
+                            LIMIT ?
+                        """
                     
                     params.append(min_activity_threshold)
                     params.append(limit)
@@ -1596,7 +1911,7 @@ class Database:
         """Обновление информации о чате"""
         def _update_chat_info_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Формируем запрос обновления только для переданных полей
                     updates = []
                     params = []
@@ -1646,7 +1961,7 @@ class Database:
         """Деактивация чата (бот был удален)"""
         def _deactivate_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("UPDATE chats SET is_active = 0 WHERE chat_id = ?", (chat_id,))
                     db.commit()
                     return True
@@ -1660,7 +1975,7 @@ class Database:
         """Очистка дублирующихся записей чатов"""
         def _cleanup_duplicates_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Находим дубликаты по chat_id
                     cursor = db.execute("""
                         SELECT chat_id, COUNT(*) as count
@@ -1726,7 +2041,7 @@ class Database:
         """Назначение ранга модератора"""
         def _assign_moderator_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Назначаем ранг
                     db.execute("""
                         INSERT OR REPLACE INTO chat_moderators 
@@ -1765,7 +2080,7 @@ class Database:
         """Инициализация прав по умолчанию для всех рангов в чате"""
         def _initialize_permissions_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     from bot import DEFAULT_RANK_PERMISSIONS
                     
                     for rank, permissions in DEFAULT_RANK_PERMISSIONS.items():
@@ -1796,7 +2111,7 @@ class Database:
         """Снятие ранга модератора"""
         def _remove_moderator_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         DELETE FROM chat_moderators 
                         WHERE chat_id = ? AND user_id = ?
@@ -1813,7 +2128,7 @@ class Database:
         """Получение ранга пользователя в чате"""
         def _get_user_rank_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT rank FROM chat_moderators 
                         WHERE chat_id = ? AND user_id = ?
@@ -1830,7 +2145,7 @@ class Database:
         """Получение списка всех модераторов чата"""
         def _get_chat_moderators_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT cm.user_id, cm.rank, u.username, u.first_name, u.last_name
                         FROM chat_moderators cm
@@ -1859,7 +2174,7 @@ class Database:
         """Обновление ранга модератора"""
         def _update_moderator_rank_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE chat_moderators 
                         SET rank = ?, assigned_by = ?, assigned_date = ?
@@ -1879,7 +2194,7 @@ class Database:
         """Получить право для ранга в чате"""
         def _get_rank_permission_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT permission_value FROM rank_permissions 
                         WHERE chat_id = ? AND rank = ? AND permission_type = ?
@@ -1896,7 +2211,7 @@ class Database:
         """Установить право для ранга в чате"""
         def _set_rank_permission_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO rank_permissions 
                         (chat_id, rank, permission_type, permission_value) 
@@ -1914,7 +2229,7 @@ class Database:
         """Получить все права для ранга в чате"""
         def _get_all_rank_permissions_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT permission_type, permission_value FROM rank_permissions 
                         WHERE chat_id = ? AND rank = ?
@@ -1930,7 +2245,7 @@ class Database:
         """Сбросить права ранга к стандартным"""
         def _reset_rank_permissions_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Удаляем все существующие права для этого ранга
                     db.execute("""
                         DELETE FROM rank_permissions 
@@ -1959,7 +2274,7 @@ class Database:
         """Проверить, есть ли у пользователя право. Возвращает None если права не настроены"""
         def _has_permission_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Получаем ранг пользователя из БД
                     cursor = db.execute("""
                         SELECT rank FROM chat_moderators 
@@ -1990,43 +2305,43 @@ class Database:
     async def get_chat_stat_settings(self, chat_id: int) -> dict:
         """Получить настройки статистики для чата"""
         def _get_settings_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute("""
-                        SELECT stats_enabled, count_media, profile_enabled
-                        FROM chat_stat_settings 
-                        WHERE chat_id = ?
-                    """, (chat_id,))
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        return {
-                            'stats_enabled': bool(row[0]),
-                            'count_media': bool(row[1]) if row[1] is not None else True,
-                            'profile_enabled': bool(row[2]) if len(row) > 2 and row[2] is not None else True,
-                        }
-                    else:
-                        # Возвращаем настройки по умолчанию
-                        return {
-                            'stats_enabled': True,
-                            'count_media': True,
-                            'profile_enabled': True,
-                        }
-            except Exception as e:
-                logger.error(f"Ошибка при получении настроек статистики для чата {chat_id}: {e}")
-                return {
-                    'stats_enabled': True,
-                    'count_media': True,
-                    'profile_enabled': True,
-                }
+            with get_connection(self.db_path) as db:
+                cursor = db.execute("""
+                    SELECT stats_enabled, count_media, profile_enabled
+                    FROM chat_stat_settings 
+                    WHERE chat_id = ?
+                """, (chat_id,))
+                row = cursor.fetchone()
+                
+                if row:
+                    return {
+                        'stats_enabled': bool(row[0]),
+                        'count_media': bool(row[1]) if row[1] is not None else True,
+                        'profile_enabled': bool(row[2]) if len(row) > 2 and row[2] is not None else True,
+                    }
+                else:
+                    # Возвращаем настройки по умолчанию
+                    return {
+                        'stats_enabled': True,
+                        'count_media': True,
+                        'profile_enabled': True,
+                    }
         
-        return await asyncio.get_event_loop().run_in_executor(None, _get_settings_sync)
+        try:
+            return await settings_cache.get_or_load('stat_settings', chat_id, _get_settings_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении настроек статистики для чата {chat_id}: {e}")
+            return {
+                'stats_enabled': True,
+                'count_media': True,
+                'profile_enabled': True,
+            }
     
     async def set_chat_stats_enabled(self, chat_id: int, enabled: bool) -> bool:
         """Включить/выключить статистику для чата"""
         def _set_stats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO chat_stat_settings (chat_id, stats_enabled, count_media)
                         VALUES (
@@ -2042,13 +2357,15 @@ class Database:
                 logger.error(f"Ошибка при изменении настройки статистики для чата {chat_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _set_stats_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_stats_sync)
+        settings_cache.invalidate(chat_id, 'stat_settings')
+        return result
 
     async def set_chat_stats_count_media(self, chat_id: int, enabled: bool) -> bool:
         """Включить/выключить учет медиа-сообщений в статистике"""
         def _set_media_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO chat_stat_settings (chat_id, stats_enabled, count_media)
                         VALUES (
@@ -2063,13 +2380,15 @@ class Database:
                 logger.error(f"Ошибка при изменении настройки count_media для чата {chat_id}: {e}")
                 return False
 
-        return await asyncio.get_event_loop().run_in_executor(None, _set_media_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_media_sync)
+        settings_cache.invalidate(chat_id, 'stat_settings')
+        return result
     
     async def set_chat_stats_profile_enabled(self, chat_id: int, enabled: bool) -> bool:
         """Включить/выключить команду профиля в чате"""
         def _set_profile_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO chat_stat_settings (chat_id, stats_enabled, count_media, profile_enabled)
                         VALUES (
@@ -2085,13 +2404,15 @@ class Database:
                 logger.error(f"Ошибка при изменении настройки profile_enabled для чата {chat_id}: {e}")
                 return False
 
-        return await asyncio.get_event_loop().run_in_executor(None, _set_profile_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _set_profile_sync)
+        settings_cache.invalidate(chat_id, 'stat_settings')
+        return result
     
     async def set_user_mention_ping_enabled(self, user_id: int, enabled: bool) -> bool:
         """Включить/выключить кликабельные упоминания (ping) в статистике для пользователя (глобально)"""
         def _set_mention_ping_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Убедимся, что пользователь существует в базе
                     db.execute("""
                         INSERT OR IGNORE INTO users (user_id, mention_ping_enabled)
@@ -2122,7 +2443,7 @@ class Database:
         """Получить время последнего сообщения от пользователя"""
         def _get_last_message_time_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT last_message_time FROM user_last_message 
                         WHERE chat_id = ? AND user_id = ?
@@ -2149,7 +2470,7 @@ class Database:
         """Обновить время последнего сообщения от пользователя"""
         def _update_last_message_time_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO user_last_message (chat_id, user_id, last_message_time)
                         VALUES (?, ?, ?)
@@ -2172,66 +2493,144 @@ class Database:
         
         return result
     
+    async def record_message(self, chat_id: int, user_id: int, username: str = None,
+                             first_name: str = None, last_name: str = None,
+                             is_bot: bool = False, is_text: bool = True) -> Dict[str, Any]:
+        """
+        Учет одного сообщения за одну транзакцию: настройки статистики, антифлуд,
+        время последнего сообщения, пользователь и first_seen.
+        Дневные счетчики попадают в буфер отложенной записи (self.counters).
+
+        Returns:
+            Dict: {
+                'recorded': bool,          # сообщение учтено в статистике
+                'reason': Optional[str],   # 'media_disabled', 'too_fast' или 'error', если не учтено
+                'time_diff': Optional[float],  # секунд с предыдущего сообщения пользователя
+                'chat_known': bool         # есть ли активная запись о чате в таблице chats
+            }
+        """
+        now = datetime.now()
+        now_iso = now.isoformat()
+        local_date = now.strftime('%Y-%m-%d')
+        utc_now = datetime.utcnow()
+        # Дата пользовательской статистики по московскому времени (UTC+3)
+        ts = datetime.utcnow().timestamp() + 10800
+        moscow_date = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
+
+        def _record_sync():
+            result = {'recorded': False, 'reason': None, 'time_diff': None, 'chat_known': True}
+            try:
+                with get_connection(self.db_path) as db:
+                    # Настройки статистики: учитывать ли медиа
+                    row = db.execute(
+                        "SELECT count_media FROM chat_stat_settings WHERE chat_id = ?",
+                        (chat_id,)
+                    ).fetchone()
+                    count_media = bool(row[0]) if row and row[0] is not None else True
+                    if not count_media and not is_text:
+                        result['reason'] = 'media_disabled'
+                        return result
+
+                    # Антифлуд: не учитываем сообщения чаще раза в секунду
+                    row = db.execute(
+                        "SELECT last_message_time FROM user_last_message WHERE chat_id = ? AND user_id = ?",
+                        (chat_id, user_id)
+                    ).fetchone()
+                    if row and row[0]:
+                        try:
+                            time_diff = (now - datetime.fromisoformat(row[0])).total_seconds()
+                            result['time_diff'] = time_diff
+                            if 0 <= time_diff < 1:
+                                result['reason'] = 'too_fast'
+                                return result
+                        except ValueError:
+                            logger.warning(f"Неверный формат времени: {row[0]}")
+
+                    db.execute("""
+                        INSERT INTO user_last_message (chat_id, user_id, last_message_time)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(chat_id, user_id) DO UPDATE SET last_message_time = excluded.last_message_time
+                    """, (chat_id, user_id, now_iso))
+
+                    row = db.execute(
+                        "SELECT 1 FROM chats WHERE chat_id = ? AND is_active = 1", (chat_id,)
+                    ).fetchone()
+                    result['chat_known'] = row is not None
+
+                    # Пользователь (mention_ping_enabled сохраняется)
+                    db.execute("""
+                        INSERT INTO users (user_id, username, first_name, last_name, is_bot, last_seen)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            username = excluded.username,
+                            first_name = excluded.first_name,
+                            last_name = excluded.last_name,
+                            is_bot = excluded.is_bot,
+                            last_seen = excluded.last_seen
+                    """, (user_id, username, first_name, last_name, is_bot, now_iso))
+                    name_index.refresh_keys_sync(db, user_id, username, first_name, last_name)
+
+                    # Дата первого появления пользователя в чате
+                    db.execute("""
+                        INSERT OR IGNORE INTO user_chat_meta (chat_id, user_id, first_seen)
+                        VALUES (?, ?, ?)
+                    """, (chat_id, user_id, local_date))
+
+                result['recorded'] = True
+            except Exception as e:
+                if self._is_database_corrupted_error(e):
+                    logger.critical(f"Обнаружено повреждение базы данных при учете сообщения: {e}")
+                    self._corruption_detected = True
+                else:
+                    logger.error(f"Ошибка при учете сообщения пользователя {user_id} в чате {chat_id}: {e}")
+                return {'recorded': False, 'reason': 'error', 'time_diff': None, 'chat_known': True}
+
+            # Счетчики сообщений чата и пользователя копятся в буфере
+            self.counters.add_message(chat_id, user_id, local_date, moscow_date,
+                                      utc_now.strftime('%Y-%m-%d'), utc_now.hour)
+            if self.counters.should_flush():
+                # Соединение уже возвращено в пул, сброс можно делать в этом же потоке
+                self.counters.flush_sync()
+            return result
+
+        result = await asyncio.get_event_loop().run_in_executor(None, _record_sync)
+
+        # Автоматическое восстановление при обнаружении повреждения
+        if self._corruption_detected and not self._recovery_in_progress:
+            await self.auto_recover_if_needed()
+
+        return result
+
     async def get_hourly_stats_today(self, chat_id: int, timezone_offset: int = 3) -> List[Dict[str, int]]:
         """Получение статистики сообщений по часам за сегодня с учетом часового пояса"""
         def _get_hourly_stats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Получаем дату сегодня с учетом часового пояса
-                    ts = datetime.utcnow().timestamp() + (timezone_offset * 3600)
-                    today = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
-                    
-                    # Получаем все записи из user_daily_stats за сегодня
-                    # Используем данные из user_last_message для получения времени сообщений
-                    cursor = db.execute("""
-                        SELECT 
-                            uds.user_id,
-                            uds.message_count,
-                            ulm.last_message_time
-                        FROM user_daily_stats uds
-                        LEFT JOIN user_last_message ulm 
-                            ON uds.chat_id = ulm.chat_id AND uds.user_id = ulm.user_id
-                        WHERE uds.chat_id = ? AND uds.date = ?
-                    """, (chat_id, today))
-                    
-                    rows = cursor.fetchall()
-                    
-                    # Инициализируем массив для 24 часов
-                    hourly_counts = [0] * 24
-                    
-                    # Распределяем сообщения по часам на основе времени последнего сообщения
-                    for user_id, message_count, last_message_time in rows:
-                        if last_message_time:
-                            try:
-                                # Парсим время последнего сообщения
-                                msg_time = datetime.fromisoformat(last_message_time)
-                                # Корректируем с учетом часового пояса (если нужно)
-                                # Получаем час сообщения
-                                hour = msg_time.hour
-                                
-                                # Распределяем сообщения пользователя по этому часу
-                                # Это приблизительная оценка, так как мы знаем только время последнего сообщения
-                                hourly_counts[hour] += message_count
-                            except (ValueError, TypeError):
-                                # Если не удалось распарсить время, пропускаем
-                                continue
-                        else:
-                            # Если нет времени последнего сообщения, распределяем равномерно
-                            # Это менее точный вариант, но лучше чем ничего
-                            messages_per_hour = message_count // 24
-                            remainder = message_count % 24
-                            for h in range(24):
-                                hourly_counts[h] += messages_per_hour + (1 if h < remainder else 0)
-                    
-                    # Формируем результат
-                    result = []
-                    for hour in range(24):
-                        result.append({
-                            'hour': hour,
-                            'count': hourly_counts[hour]
-                        })
-                    
-                    return result
+                # Получаем дату сегодня с учетом часового пояса
+                ts = datetime.utcnow().timestamp() + (timezone_offset * 3600)
+                today = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
+                days = hourly_histogram.utc_days_for_local_day(today, timezone_offset)
+                
+                with self.counters.consistent_read(), get_connection(self.db_path) as db:
+                    placeholders = ','.join(['?'] * len(days))
+                    cursor = db.execute(f"""
+                        SELECT date, counts FROM chat_hourly_stats
+                        WHERE chat_id = ? AND date IN ({placeholders})
+                    """, (chat_id, *days))
+                    utc_counts = {day: hourly_histogram.unpack(counts) for day, counts in cursor.fetchall()}
+                    # Добавляем несброшенные приращения из буфера счетчиков
+                    for day, delta in self.counters.hourly_deltas(chat_id).items():
+                        if day in days:
+                            counts = utc_counts.get(day) or [0] * hourly_histogram.HOURS
+                            utc_counts[day] = [a + b for a, b in zip(counts, delta)]
+                
+                hourly_counts = hourly_histogram.local_day_counts(utc_counts, today, timezone_offset)
+                return [
+                    {
+                        'hour': hour,
+                        'count': hourly_counts[hour]
+                    }
+                    for hour in range(hourly_histogram.HOURS)
+                ]
             except Exception as e:
                 logger.error(f"Ошибка при получении почасовой статистики для чата {chat_id}: {e}")
                 return []
@@ -2241,12 +2640,15 @@ class Database:
     async def get_chat_users(self, chat_id: int) -> List[dict]:
         """Получить всех пользователей чата с их username из базы данных"""
         def _get_chat_users_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.cursor()
                 cursor.execute("""
-                    SELECT DISTINCT user_id, username 
-                    FROM user_daily_stats 
-                    WHERE chat_id = ? AND message_count > 0
+                    SELECT u.user_id, u.username
+                    FROM users u
+                    WHERE EXISTS (
+                        SELECT 1 FROM user_daily_stats s
+                        WHERE s.user_id = u.user_id AND s.chat_id = ? AND s.message_count > 0
+                    )
                 """, (chat_id,))
                 return [{'user_id': row[0], 'username': row[1]} for row in cursor.fetchall()]
         
@@ -2256,24 +2658,22 @@ class Database:
         """Поиск пользователей по имени в конкретном чате"""
         def _search_users_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    name_lower = name.lower()
-                    # Ищем пользователей, которые когда-либо были в этом чате (через user_daily_stats)
-                    # убираем условие message_count > 0, чтобы найти всех пользователей
+                key = name_index.normalize(name.lstrip('@'))
+                if not key:
+                    return []
+                with get_connection(self.db_path) as db:
+                    # Совпадение по имени, username или «имя фамилия» (см. name_index) среди
+                    # пользователей, которые когда-либо писали в этом чате (user_chat_meta).
+                    # Первым идет совпадение по username, затем недавно активные
                     cursor = db.execute("""
-                        SELECT DISTINCT u.user_id, u.username, u.first_name, u.last_name, u.is_bot
-                        FROM users u
-                        WHERE (
-                            LOWER(u.first_name) = ? 
-                            OR LOWER(u.username) = ?
-                            OR LOWER(u.first_name || ' ' || COALESCE(u.last_name, '')) = ?
-                        )
-                        AND EXISTS (
-                            SELECT 1 FROM user_daily_stats uds 
-                            WHERE uds.user_id = u.user_id AND uds.chat_id = ?
-                        )
+                        SELECT u.user_id, u.username, u.first_name, u.last_name, u.is_bot
+                        FROM user_name_keys k
+                        JOIN user_chat_meta m ON m.chat_id = ? AND m.user_id = k.user_id
+                        JOIN users u ON u.user_id = k.user_id
+                        WHERE k.name_key = ?
+                        ORDER BY (u.username = ? COLLATE NOCASE) DESC, u.last_seen DESC, u.user_id
                         LIMIT 10
-                    """, (name_lower, name_lower, name_lower, chat_id))
+                    """, (chat_id, key, name.lstrip('@')))
                     
                     rows = cursor.fetchall()
                     return [
@@ -2292,27 +2692,36 @@ class Database:
         
         return await asyncio.get_event_loop().run_in_executor(None, _search_users_sync)
     
+    def _recent_activity_condition(self, kind: str, days: int, id_expr: str):
+        """
+        Условие EXISTS «была активность за последние N дней» для пользователя или чата id_expr
+        и его параметры. Дневные счетчики хранятся DAILY_STATS_EXACT_DAYS дней,
+        для более длинных окон проверяются сводные таблицы (окно может быть чуть шире N дней).
+        """
+        column = 'user_id' if kind == bulk_purge.USER else 'chat_id'
+        if days <= DAILY_STATS_EXACT_DAYS:
+            table = 'user_daily_stats' if kind == bulk_purge.USER else 'daily_stats'
+            return (
+                f"EXISTS (SELECT 1 FROM {table} s WHERE s.{column} = {id_expr}"
+                f" AND s.date >= date('now', ?) AND s.message_count > 0)",
+                (f'-{days} days',)
+            )
+        table = 'user_stats_rollup' if kind == bulk_purge.USER else 'chat_stats_rollup'
+        weeks_from, months_from = self._rollup_window(days)
+        return (
+            f"EXISTS (SELECT 1 FROM {table} r WHERE r.{column} = {id_expr}"
+            f" AND {stats_rollup.window_condition('r')} AND r.message_count > 0)",
+            (weeks_from, months_from, months_from)
+        )
+    
     async def get_inactive_users(self, days: int = 30) -> List[int]:
-        """Найти пользователей, у которых нет записей в user_daily_stats за последние N дней"""
+        """Найти пользователей без сообщений за последние N дней"""
         def _get_inactive_users_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Находим всех пользователей, у которых нет записей в user_daily_stats за последние N дней
-                    cursor = db.execute(
-                        f"""
-                        SELECT DISTINCT u.user_id
-                        FROM users u
-                        WHERE NOT EXISTS (
-                            SELECT 1 
-                            FROM user_daily_stats uds 
-                            WHERE uds.user_id = u.user_id 
-                            AND uds.date >= date('now', '-{days} days')
-                            AND uds.message_count > 0
-                        )
-                        """,
-                    )
-                    rows = cursor.fetchall()
-                    return [row[0] for row in rows]
+                with get_connection(self.db_path) as db:
+                    condition, params = self._recent_activity_condition(bulk_purge.USER, days, 'u.user_id')
+                    cursor = db.execute(f"SELECT u.user_id FROM users u WHERE NOT {condition}", params)
+                    return [row[0] for row in cursor.fetchall()]
             except Exception as e:
                 logger.error(f"Ошибка при поиске неактивных пользователей: {e}")
                 return []
@@ -2320,26 +2729,13 @@ class Database:
         return await asyncio.get_event_loop().run_in_executor(None, _get_inactive_users_sync)
     
     async def get_inactive_chats(self, days: int = 30) -> List[int]:
-        """Найти чаты, у которых нет записей в daily_stats за последние N дней"""
+        """Найти чаты без сообщений за последние N дней"""
         def _get_inactive_chats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    # Находим все чаты, у которых нет записей в daily_stats за последние N дней
-                    cursor = db.execute(
-                        f"""
-                        SELECT DISTINCT c.chat_id
-                        FROM chats c
-                        WHERE NOT EXISTS (
-                            SELECT 1 
-                            FROM daily_stats ds 
-                            WHERE ds.chat_id = c.chat_id 
-                            AND ds.date >= date('now', '-{days} days')
-                            AND ds.message_count > 0
-                        )
-                        """,
-                    )
-                    rows = cursor.fetchall()
-                    return [row[0] for row in rows]
+                with get_connection(self.db_path) as db:
+                    condition, params = self._recent_activity_condition(bulk_purge.CHAT, days, 'c.chat_id')
+                    cursor = db.execute(f"SELECT c.chat_id FROM chats c WHERE NOT {condition}", params)
+                    return [row[0] for row in cursor.fetchall()]
             except Exception as e:
                 logger.error(f"Ошибка при поиске неактивных чатов: {e}")
                 return []
@@ -2348,9 +2744,12 @@ class Database:
     
     async def delete_user_completely(self, user_id: int) -> bool:
         """Удалить пользователя из всех таблиц основной БД"""
+        # Сначала записываем буфер счетчиков, чтобы приращения не остались на старых данных
+        await self.flush_counters()
+        
         def _delete_user_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Удаляем в правильном порядке: сначала связанные данные, потом основные записи
                     
                     # 1. Удаляем из chat_moderators (модераторы)
@@ -2365,15 +2764,18 @@ class Database:
                     # 4. Удаляем из user_last_message (время последнего сообщения)
                     db.execute("DELETE FROM user_last_message WHERE user_id = ?", (user_id,))
                     
-                    # 5. Удаляем из user_daily_stats (статистика)
+                    # 5. Удаляем из user_daily_stats и сводной таблицы (статистика)
                     db.execute("DELETE FROM user_daily_stats WHERE user_id = ?", (user_id,))
+                    db.execute("DELETE FROM user_stats_rollup WHERE user_id = ?", (user_id,))
+                    db.execute("DELETE FROM user_chat_membership WHERE user_id = ?", (user_id,))
                     
                     # 6. Удаляем из rank_permissions (если есть связи через assigned_by)
                     # Сначала удаляем права, где пользователь был назначен модератором
                     # Но rank_permissions связан с chat_id и rank, не с user_id напрямую
                     # Оставляем rank_permissions, так как они связаны с чатами, а не с пользователями
                     
-                    # 7. Удаляем из users (основная таблица)
+                    # 7. Удаляем из users (основная таблица) и индекса имен
+                    db.execute("DELETE FROM user_name_keys WHERE user_id = ?", (user_id,))
                     db.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
                     
                     db.commit()
@@ -2387,9 +2789,12 @@ class Database:
     
     async def delete_chat_completely(self, chat_id: int) -> bool:
         """Удалить чат из всех таблиц основной БД"""
+        # Сначала записываем буфер счетчиков, чтобы приращения не остались на старых данных
+        await self.flush_counters()
+        
         def _delete_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Удаляем в правильном порядке: сначала связанные данные, потом основные записи
                     
                     # 1. Удаляем из chat_moderators (все модераторы чата)
@@ -2416,6 +2821,12 @@ class Database:
                     # 8. Удаляем из daily_stats (статистика чата)
                     db.execute("DELETE FROM daily_stats WHERE chat_id = ?", (chat_id,))
                     
+                    # 8.1. Удаляем сводную и почасовую статистику чата
+                    db.execute("DELETE FROM chat_stats_rollup WHERE chat_id = ?", (chat_id,))
+                    db.execute("DELETE FROM user_stats_rollup WHERE chat_id = ?", (chat_id,))
+                    db.execute("DELETE FROM chat_hourly_stats WHERE chat_id = ?", (chat_id,))
+                    db.execute("DELETE FROM user_chat_membership WHERE chat_id = ?", (chat_id,))
+                    
                     # 9. Удаляем из blacklisted_chats (если есть)
                     db.execute("DELETE FROM blacklisted_chats WHERE chat_id = ?", (chat_id,))
                     
@@ -2429,12 +2840,110 @@ class Database:
                 logger.error(f"Ошибка при удалении чата {chat_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _delete_chat_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _delete_chat_sync)
+        settings_cache.invalidate(chat_id)
+        return result
+    
+    async def delete_users_bulk(self, user_ids: List[int]) -> bool:
+        """Удалить порцию пользователей из всех таблиц основной БД одной транзакцией"""
+        def _delete_users_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    bulk_purge.stage_ids(db, user_ids)
+                    for table in ('chat_moderators', 'chat_join_requests', 'user_chat_meta',
+                                  'user_last_message', 'user_daily_stats', 'user_stats_rollup',
+                                  'user_chat_membership', 'user_name_keys', 'users'):
+                        db.execute(f"DELETE FROM {table} WHERE user_id IN {bulk_purge.STAGED_IDS}")
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка при пакетном удалении пользователей: {e}")
+                return False
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _delete_users_sync)
+    
+    async def delete_chats_bulk(self, chat_ids: List[int]) -> bool:
+        """Удалить порцию чатов из всех таблиц основной БД одной транзакцией"""
+        def _delete_chats_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    bulk_purge.stage_ids(db, chat_ids)
+                    for table in ('chat_moderators', 'chat_join_requests', 'user_chat_meta', 'rank_permissions',
+                                  'chat_stat_settings', 'user_last_message', 'user_daily_stats', 'daily_stats',
+                                  'chat_stats_rollup', 'user_stats_rollup', 'chat_hourly_stats',
+                                  'user_chat_membership', 'blacklisted_chats', 'chats'):
+                        db.execute(f"DELETE FROM {table} WHERE chat_id IN {bulk_purge.STAGED_IDS}")
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка при пакетном удалении чатов: {e}")
+                return False
+        
+        result = await asyncio.get_event_loop().run_in_executor(None, _delete_chats_sync)
+        if result:
+            for chat_id in chat_ids:
+                settings_cache.invalidate(chat_id)
+        return result
+    
+    async def _stage_inactive(self, days: int) -> Dict[str, int]:
+        """
+        Поставить неактивных пользователей и чаты в очередь удаления.
+        Записи, оставшиеся от прерванной очистки, сохраняются, кроме снова ставших активными.
+        Возвращает размер очереди по видам.
+        """
+        def _stage_sync():
+            with get_connection(self.db_path) as db:
+                for kind, table, column in ((bulk_purge.USER, 'users', 'user_id'),
+                                            (bulk_purge.CHAT, 'chats', 'chat_id')):
+                    condition, params = self._recent_activity_condition(kind, days, 'purge_queue.entity_id')
+                    db.execute(f"DELETE FROM purge_queue WHERE kind = ? AND {condition}", (kind, *params))
+                    condition, params = self._recent_activity_condition(kind, days, f't.{column}')
+                    db.execute(f"""
+                        INSERT OR IGNORE INTO purge_queue (kind, entity_id)
+                        SELECT ?, t.{column} FROM {table} t WHERE NOT {condition}
+                    """, (kind, *params))
+                cursor = db.execute("SELECT kind, COUNT(*) FROM purge_queue GROUP BY kind")
+                return dict(cursor.fetchall())
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _stage_sync)
+    
+    async def _purge_queued(self, kind: str, total: int, deleters) -> Dict[str, int]:
+        """
+        Удалить ID вида kind из очереди порциями: каждая функция deleters удаляет порцию
+        в своей базе. При ошибке очистка останавливается, остаток ждет следующего запуска.
+        """
+        def _next_chunk_sync():
+            with get_connection(self.db_path) as db:
+                return bulk_purge.next_chunk_sync(db, kind, INACTIVE_PURGE_CHUNK_SIZE)
+        
+        def _dequeue_sync(ids):
+            with get_connection(self.db_path) as db:
+                bulk_purge.dequeue_sync(db, kind, ids)
+        
+        loop = asyncio.get_event_loop()
+        title = bulk_purge.KIND_TITLES[kind]
+        deleted = 0
+        started = time.monotonic()
+        while True:
+            ids = await loop.run_in_executor(None, _next_chunk_sync)
+            if not ids:
+                break
+            results = [await delete(ids) for delete in deleters]
+            if not all(results):
+                logger.error(f"Очистка {title} прервана на порции из {len(ids)} ID, продолжится при следующем запуске")
+                break
+            await loop.run_in_executor(None, _dequeue_sync, ids)
+            deleted += len(ids)
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Очистка {title}: удалено {deleted}/{total}, "
+                f"{deleted / elapsed if elapsed > 0 else 0:.0f} ID/с"
+            )
+        return {'deleted': deleted, 'failed': max(total - deleted, 0)}
     
     async def cleanup_inactive_users_and_chats(self, days: int = 30) -> Dict[str, int]:
         """
         Основная функция очистки неактивных пользователей и чатов
-        Координирует удаление из всех баз данных
+        Координирует удаление из всех баз данных: ID ставятся в очередь purge_queue
+        и удаляются порциями (см. bulk_purge), прерванная очистка продолжается при следующем вызове
         
         Returns:
             Dict с статистикой: {'users_deleted': int, 'chats_deleted': int, 'users_failed': int, 'chats_failed': int}
@@ -2453,49 +2962,35 @@ class Database:
         }
         
         try:
-            # 1. Находим неактивных пользователей и чаты
-            logger.info(f"Поиск неактивных пользователей и чатов (неактивность > {days} дней)...")
-            inactive_users = await self.get_inactive_users(days)
-            inactive_chats = await self.get_inactive_chats(days)
-            
-            logger.info(f"Найдено неактивных пользователей: {len(inactive_users)}, чатов: {len(inactive_chats)}")
+            # Записываем буфер счетчиков, чтобы приращения не остались на удаляемых данных
+            await self.flush_counters()
             
-            # 2. Удаляем неактивных пользователей
-            if inactive_users:
-                logger.info(f"🧹 Начинаю удаление {len(inactive_users)} неактивных пользователей...")
-            for user_id in inactive_users:
-                try:
-                    # Удаляем из других БД
-                    await timezone_db.delete_user_timezone(user_id)
-                    await reputation_db.delete_user_reputation(user_id)
-                    await friends_db.delete_user_friends(user_id)
-                    
-                    # Удаляем из основной БД
-                    if await self.delete_user_completely(user_id):
-                        stats['users_deleted'] += 1
-                    else:
-                        stats['users_failed'] += 1
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении пользователя {user_id}: {e}")
-                    stats['users_failed'] += 1
+            # 1. Ставим неактивных пользователей и чаты в очередь
+            logger.info(f"Поиск неактивных пользователей и чатов (неактивность > {days} дней)...")
+            queued = await self._stage_inactive(days)
+            users_total = queued.get(bulk_purge.USER, 0)
+            chats_total = queued.get(bulk_purge.CHAT, 0)
+            logger.info(f"В очереди на удаление пользователей: {users_total}, чатов: {chats_total}")
             
-            # 3. Удаляем неактивные чаты из сетей
-            if inactive_chats:
-                logger.info(f"🌐 Удаляю {len(inactive_chats)} неактивных чатов из сетей...")
-                await network_db.cleanup_inactive_chats_from_networks(inactive_chats)
+            # 2. Удаляем неактивных пользователей (основная БД - последней, ее users - источник очереди)
+            if users_total:
+                logger.info(f"🧹 Начинаю удаление {users_total} неактивных пользователей...")
+                result = await self._purge_queued(bulk_purge.USER, users_total, (
+                    timezone_db.delete_users_bulk,
+                    reputation_db.delete_users_bulk,
+                    friends_db.delete_users_bulk,
+                    self.delete_users_bulk,
+                ))
+                stats['users_deleted'], stats['users_failed'] = result['deleted'], result['failed']
             
-            # 4. Удаляем неактивные чаты из основной БД
-            if inactive_chats:
-                logger.info(f"🗑️ Начинаю удаление {len(inactive_chats)} неактивных чатов из основной БД...")
-            for chat_id in inactive_chats:
-                try:
-                    if await self.delete_chat_completely(chat_id):
-                        stats['chats_deleted'] += 1
-                    else:
-                        stats['chats_failed'] += 1
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении чата {chat_id}: {e}")
-                    stats['chats_failed'] += 1
+            # 3. Удаляем неактивные чаты из сетей и из основной БД
+            if chats_total:
+                logger.info(f"🗑️ Начинаю удаление {chats_total} неактивных чатов...")
+                result = await self._purge_queued(bulk_purge.CHAT, chats_total, (
+                    network_db.cleanup_inactive_chats_from_networks,
+                    self.delete_chats_bulk,
+                ))
+                stats['chats_deleted'], stats['chats_failed'] = result['deleted'], result['failed']
             
             logger.info(
                 f"Очистка завершена: "
@@ -2512,18 +3007,25 @@ class Database:
     
     async def get_user_top_chats(self, user_id: int, limit: int = 3) -> List[Dict]:
         """Получить топ чатов пользователя по активности за последние 6 дней"""
+        await self.flush_counters()
+        
         def _get_user_top_chats_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
+                # Кандидаты - чаты, где пользователь писал за эти дни (user_chat_membership),
+                # счетчики каждого берутся из диапазона первичного ключа user_daily_stats
                 cursor = db.execute("""
                     SELECT 
-                        uds.chat_id,
+                        m.chat_id,
                         c.chat_title,
                         SUM(uds.message_count) as total_messages
-                    FROM user_daily_stats uds
-                    LEFT JOIN chats c ON uds.chat_id = c.chat_id
-                    WHERE uds.user_id = ? 
-                    AND uds.date >= date('now', '-6 days')
-                    GROUP BY uds.chat_id, c.chat_title
+                    FROM user_chat_membership m
+                    JOIN user_daily_stats uds
+                        ON uds.chat_id = m.chat_id AND uds.user_id = m.user_id
+                        AND uds.date >= date('now', '-6 days')
+                    LEFT JOIN chats c ON m.chat_id = c.chat_id
+                    WHERE m.user_id = ? 
+                    AND m.last_seen >= date('now', '-6 days')
+                    GROUP BY m.chat_id, c.chat_title
                     ORDER BY total_messages DESC
                     LIMIT ?
                 """, (user_id, limit))
@@ -2537,26 +3039,24 @@ class Database:
         return await asyncio.get_event_loop().run_in_executor(None, _get_user_top_chats_sync)
     
     async def get_common_chats(self, user_id_1: int, user_id_2: int) -> List[Dict]:
-        """Получить общие чаты двух пользователей"""
+        """Получить общие чаты двух пользователей (чаты, где писали оба)"""
         def _get_common_chats_sync():
-            with sqlite3.connect(self.db_path) as db:
-                cursor = db.execute("""
-                    SELECT DISTINCT 
-                        c.chat_id, 
-                        c.chat_title
-                    FROM chats c
-                    WHERE c.chat_id IN (
-                        SELECT DISTINCT chat_id 
-                        FROM user_daily_stats 
-                        WHERE user_id = ? AND message_count > 0
-                    )
-                    AND c.chat_id IN (
-                        SELECT DISTINCT chat_id 
-                        FROM user_daily_stats 
-                        WHERE user_id = ? AND message_count > 0
-                    )
-                    ORDER BY c.chat_title
-                """, (user_id_1, user_id_2))
+            with get_connection(self.db_path) as db:
+                # Чаты каждого пользователя - отсортированный диапазон первичного ключа,
+                # пересечение считается слиянием двух списков
+                common = chat_membership.intersect_sorted(
+                    chat_membership.chat_ids_sync(db, user_id_1),
+                    chat_membership.chat_ids_sync(db, user_id_2)
+                )
+                if not common:
+                    return []
+                placeholders = ','.join(['?'] * len(common))
+                cursor = db.execute(f"""
+                    SELECT chat_id, chat_title
+                    FROM chats
+                    WHERE chat_id IN ({placeholders})
+                    ORDER BY chat_title
+                """, common)
                 
                 return [{
                     'chat_id': row[0],
@@ -0,0 +1,210 @@
+"""
+Пул постоянных соединений SQLite для всех баз данных бота
+Соединения открываются один раз, PRAGMA применяются при создании,
+а каждый поток повторно использует "своё" соединение
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import DB_POOL_SIZE, DB_POOL_HEALTH_CHECK_INTERVAL
+except ImportError:
+    DB_POOL_SIZE = 8
+    DB_POOL_HEALTH_CHECK_INTERVAL = 60
+
+
+def _apply_pragma_settings(db):
+    """Применить настройки производительности SQLite к соединению"""
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA cache_size=-64000")  # 64MB cache
+        db.execute("PRAGMA temp_store=MEMORY")
+    except Exception:
+        pass  # Игнорируем ошибки, если PRAGMA не поддерживается
+
+
+class SQLitePool:
+    """Пул соединений к одному файлу базы данных"""
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE,
+                 health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._idle: List[sqlite3.Connection] = []
+        self._last_used: Dict[int, float] = {}
+        self._created = 0
+        self._generation = 0
+        self._conn_generation: Dict[int, int] = {}
+        self._local = threading.local()
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """Открыть новое соединение и применить PRAGMA"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        _apply_pragma_settings(conn)
+        conn.commit()
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """Проверить, что соединение живо (только если оно давно простаивало)"""
+        last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        """Закрыть соединение и освободить место в пуле (вызывается под блокировкой)"""
+        self._last_used.pop(id(conn), None)
+        self._conn_generation.pop(id(conn), None)
+        self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _acquire(self) -> sqlite3.Connection:
+        """Взять соединение: сначала своё (привязанное к потоку), затем любое свободное"""
+        own = getattr(self._local, 'conn', None)
+        with self._cond:
+            while True:
+                if own is not None and own in self._idle:
+                    self._idle.remove(own)
+                    conn = own
+                    break
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    conn = None
+                    break
+                self._cond.wait()
+
+            if conn is not None and not self._is_healthy(conn):
+                logger.warning(f"Соединение с {self.db_path} не прошло проверку, переподключаемся")
+                self._discard(conn)
+                self._created += 1
+                conn = None
+            generation = self._generation
+
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._conn_generation[id(conn)] = generation
+
+        self._local.conn = conn
+        return conn
+
+    def _release(self, conn: sqlite3.Connection, broken: bool = False):
+        """Вернуть соединение в пул"""
+        conn.row_factory = None
+        with self._cond:
+            stale = self._conn_generation.get(id(conn)) != self._generation
+            if broken or stale:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Получить соединение из пула.
+        Как и `with sqlite3.connect(...)`: коммит при успехе, откат при ошибке.
+        Повторный вход в том же потоке возвращает уже выданное соединение.
+        """
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.held = conn
+        self._local.depth = 0
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            if type(e) is sqlite3.DatabaseError:
+                # Повреждение файла и подобные ошибки: соединение пересоздаем
+                broken = True
+            raise
+        finally:
+            self._local.held = None
+            self._release(conn, broken)
+
+    def close(self):
+        """Закрыть все свободные соединения; занятые будут закрыты при возврате"""
+        with self._cond:
+            self._generation += 1
+            for conn in self._idle:
+                self._discard(conn)
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> SQLitePool:
+    """Получить (или создать) пул для файла базы данных"""
+    key = os.path.abspath(db_path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = SQLitePool(db_path)
+                _pools[key] = pool
+    return pool
+
+
+def get_connection(db_path: str):
+    """Контекстный менеджер соединения из пула (замена `sqlite3.connect`)"""
+    return get_pool(db_path).connection()
+
+
+def close_pool(db_path: str):
+    """Закрыть соединения пула конкретной базы (например, перед её заменой на диске)"""
+    pool = _pools.get(os.path.abspath(db_path))
+    if pool is not None:
+        pool.close()
+
+
+def close_all_pools():
+    """Закрыть соединения всех пулов при остановке бота"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+    logger.info("Соединения с базами данных закрыты")
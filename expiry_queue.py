@@ -0,0 +1,115 @@
+"""
+Очередь сроков истечения наказаний (мутов и банов)
+Мин-куча по времени истечения: планировщик спит ровно до ближайшего срока,
+а не опрашивает все чаты. Обновляется из moderation_db при добавлении
+и деактивации наказаний. Используется только из цикла событий asyncio.
+"""
+import asyncio
+import heapq
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Типы наказаний, которые снимаются автоматически
+EXPIRING_PUNISHMENT_TYPES = ('mute', 'ban')
+
+
+def expiry_timestamp(expiry_date: str) -> Optional[float]:
+    """Перевести expiry_date (ISO, с часовым поясом или локальное время) в unix-время"""
+    try:
+        return datetime.fromisoformat(expiry_date).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class PunishmentExpiryQueue:
+    """Мин-куча (срок, id наказания) с ленивым удалением отмененных записей"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        # id наказания -> актуальный срок; записи кучи с другим сроком считаются удаленными
+        self._deadlines: Dict[int, float] = {}
+        self._changed: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def _event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def schedule(self, punishment_id: int, expiry_date: str):
+        """Добавить (или перенести) срок истечения наказания"""
+        deadline = expiry_timestamp(expiry_date)
+        if deadline is None:
+            logger.warning(f"Некорректный срок истечения наказания {punishment_id}: {expiry_date}")
+            return
+        # Тот же срок уже в очереди: повторная запись в куче стала бы дублем,
+        # а после истечения наказание было бы снято дважды
+        if self._deadlines.get(punishment_id) == deadline:
+            return
+        self._deadlines[punishment_id] = deadline
+        heapq.heappush(self._heap, (deadline, punishment_id))
+        # Будим ожидающего, если новый срок стал ближайшим
+        if self._heap[0] == (deadline, punishment_id):
+            self._event().set()
+
+    def cancel(self, punishment_id: int):
+        """Убрать наказание из очереди (запись в куче удалится при извлечении)"""
+        self._deadlines.pop(punishment_id, None)
+
+    def _discard_stale(self):
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def next_deadline(self) -> Optional[float]:
+        """Ближайший срок истечения или None, если очередь пуста"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[int]:
+        """Извлечь id всех наказаний, срок которых наступил"""
+        if now is None:
+            now = time.time()
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, punishment_id = heapq.heappop(self._heap)
+            del self._deadlines[punishment_id]
+            due.append(punishment_id)
+            self._discard_stale()
+        return due
+
+    async def wait_due(self, max_wait: float) -> List[int]:
+        """
+        Дождаться ближайшего срока и вернуть истекшие наказания.
+        Возвращает пустой список, если за max_wait секунд ничего не истекло.
+        """
+        started = time.time()
+        while True:
+            now = time.time()
+            due = self.pop_due(now)
+            if due:
+                return due
+
+            remaining = started + max_wait - now
+            if remaining <= 0:
+                return []
+            deadline = self.next_deadline()
+            timeout = remaining if deadline is None else min(remaining, deadline - now)
+
+            event = self._event()
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+
+# Глобальная очередь сроков истечения наказаний
+punishment_expiry_queue = PunishmentExpiryQueue()
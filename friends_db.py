@@ -9,70 +9,54 @@ import string
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 from config import DATABASE_PATH
+from db_pool import get_connection
+from bulk_purge import stage_ids, STAGED_IDS
 
 logger = logging.getLogger(__name__)
 
 
+# Таблицы друзей хранятся в основной базе и создаются ее миграциями (database.SCHEMA_MIGRATIONS)
+CREATE_TABLES_SQL = (
+    # Таблица для временных кодов добавления в друзья
+    """
+    CREATE TABLE IF NOT EXISTS friend_codes (
+        user_id INTEGER,
+        code TEXT,
+        expires_at TEXT,
+        created_at TEXT,
+        PRIMARY KEY (user_id),
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    """,
+    # Таблица для связей друзей
+    """
+    CREATE TABLE IF NOT EXISTS friendships (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id_1 INTEGER,
+        user_id_2 INTEGER,
+        created_at TEXT,
+        FOREIGN KEY (user_id_1) REFERENCES users (user_id),
+        FOREIGN KEY (user_id_2) REFERENCES users (user_id),
+        UNIQUE(user_id_1, user_id_2)
+    )
+    """,
+    # Индексы для быстрого поиска
+    "CREATE INDEX IF NOT EXISTS idx_friendships_user1 ON friendships (user_id_1)",
+    "CREATE INDEX IF NOT EXISTS idx_friendships_user2 ON friendships (user_id_2)",
+    "CREATE INDEX IF NOT EXISTS idx_friend_codes_expires ON friend_codes (expires_at)",
+)
+
+
 class FriendsDatabase:
     """Класс для работы с базой данных друзей"""
     
     def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
     
-    async def init_db(self):
-        """Инициализация базы данных и создание таблиц для друзей"""
-        def _init_sync():
-            with sqlite3.connect(self.db_path) as db:
-                # Таблица для временных кодов добавления в друзья
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS friend_codes (
-                        user_id INTEGER,
-                        code TEXT,
-                        expires_at TEXT,
-                        created_at TEXT,
-                        PRIMARY KEY (user_id),
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                """)
-                
-                # Таблица для связей друзей
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS friendships (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id_1 INTEGER,
-                        user_id_2 INTEGER,
-                        created_at TEXT,
-                        FOREIGN KEY (user_id_1) REFERENCES users (user_id),
-                        FOREIGN KEY (user_id_2) REFERENCES users (user_id),
-                        UNIQUE(user_id_1, user_id_2)
-                    )
-                """)
-                
-                # Создаем индексы для быстрого поиска
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_friendships_user1 
-                    ON friendships (user_id_1)
-                """)
-                
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_friendships_user2 
-                    ON friendships (user_id_2)
-                """)
-                
-                db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_friend_codes_expires 
-                    ON friend_codes (expires_at)
-                """)
-                
-                db.commit()
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
-        logger.info("База данных друзей инициализирована")
-    
     async def generate_friend_code(self, user_id: int) -> str:
         """Генерирует 6-значный цифровой код для добавления в друзья"""
         def _generate_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 # Сначала очищаем все истекшие коды
                 now = datetime.now().isoformat()
                 db.execute("DELETE FROM friend_codes WHERE expires_at < ?", (now,))
@@ -101,7 +85,7 @@ class FriendsDatabase:
         Проверяет код и возвращает (is_valid, message)
         """
         def _validate_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 # Ищем код
                 cursor = db.execute("""
                     SELECT user_id, expires_at FROM friend_codes 
@@ -128,7 +112,7 @@ class FriendsDatabase:
                 
                 # Проверяем, что уже не друзья
                 def _check_friends_sync():
-                    with sqlite3.connect(self.db_path) as db:
+                    with get_connection(self.db_path) as db:
                         cursor = db.execute("""
                             SELECT 1 FROM friendships 
                             WHERE (user_id_1 = ? AND user_id_2 = ?) 
@@ -147,7 +131,7 @@ class FriendsDatabase:
     async def are_friends(self, user_id_1: int, user_id_2: int) -> bool:
         """Проверяет, являются ли пользователи друзьями"""
         def _check_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.execute("""
                     SELECT 1 FROM friendships 
                     WHERE (user_id_1 = ? AND user_id_2 = ?) 
@@ -161,7 +145,7 @@ class FriendsDatabase:
         """Добавляет дружбу между пользователями"""
         def _add_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Упорядочиваем ID для консистентности
                     smaller_id = min(user_id_1, user_id_2)
                     larger_id = max(user_id_1, user_id_2)
@@ -188,7 +172,7 @@ class FriendsDatabase:
     async def remove_friendship(self, user_id_1: int, user_id_2: int) -> bool:
         """Удаляет дружбу между пользователями"""
         def _remove_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.execute("""
                     DELETE FROM friendships 
                     WHERE (user_id_1 = ? AND user_id_2 = ?) 
@@ -203,7 +187,7 @@ class FriendsDatabase:
     async def get_friends(self, user_id: int) -> List[Dict[str, Any]]:
         """Получает список друзей пользователя"""
         def _get_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.execute("""
                     SELECT 
                         CASE 
@@ -231,7 +215,7 @@ class FriendsDatabase:
     async def get_friend_count(self, user_id: int) -> int:
         """Получает количество друзей пользователя"""
         def _count_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.execute("""
                     SELECT COUNT(*) FROM friendships 
                     WHERE user_id_1 = ? OR user_id_2 = ?
@@ -243,7 +227,7 @@ class FriendsDatabase:
     async def cleanup_expired_codes(self):
         """Очищает истекшие коды"""
         def _cleanup_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 now = datetime.now().isoformat()
                 cursor = db.execute("""
                     DELETE FROM friend_codes WHERE expires_at < ?
@@ -257,7 +241,7 @@ class FriendsDatabase:
     async def get_active_codes(self) -> List[Dict[str, Any]]:
         """Получает все активные коды с информацией о пользователях"""
         def _get_active_codes_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 now = datetime.now().isoformat()
                 cursor = db.execute("""
                     SELECT 
@@ -300,7 +284,7 @@ class FriendsDatabase:
     async def get_user_active_codes(self, user_id: int) -> List[Dict[str, Any]]:
         """Получает активные коды конкретного пользователя"""
         def _get_user_codes_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 now = datetime.now().isoformat()
                 cursor = db.execute("""
                     SELECT code, expires_at, created_at
@@ -326,7 +310,7 @@ class FriendsDatabase:
         """Удалить все данные пользователя из системы друзей"""
         def _delete_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Удаляем из friend_codes (коды пользователя)
                     db.execute("DELETE FROM friend_codes WHERE user_id = ?", (user_id,))
                     
@@ -344,6 +328,24 @@ class FriendsDatabase:
                 return False
         
         return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
+    
+    async def delete_users_bulk(self, user_ids: List[int]) -> bool:
+        """Удалить коды и связи друзей порции пользователей одной транзакцией"""
+        def _delete_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    stage_ids(db, user_ids)
+                    db.execute(f"DELETE FROM friend_codes WHERE user_id IN {STAGED_IDS}")
+                    db.execute(f"""
+                        DELETE FROM friendships
+                        WHERE user_id_1 IN {STAGED_IDS} OR user_id_2 IN {STAGED_IDS}
+                    """)
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка при пакетном удалении данных системы друзей: {e}")
+                return False
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
 
 
 # Создаем глобальный экземпляр
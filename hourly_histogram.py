@@ -0,0 +1,85 @@
+"""
+Почасовые гистограммы сообщений чата
+Для каждой пары (чат, день по UTC) хранится BLOB из 24 счетчиков uint32 (96 байт).
+Гистограмма дня в любом часовом поясе собирается из двух соседних UTC-дней
+сдвигом на смещение пояса, без просмотра отдельных сообщений.
+"""
+import struct
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+HOURS = 24
+
+_FORMAT = struct.Struct(f'<{HOURS}I')
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS chat_hourly_stats (
+        chat_id INTEGER,
+        date TEXT,
+        counts BLOB,
+        PRIMARY KEY (chat_id, date)
+    )
+"""
+
+
+def pack(counts: Sequence[int]) -> bytes:
+    """Упаковать 24 счетчика в BLOB"""
+    return _FORMAT.pack(*counts)
+
+
+def unpack(blob: Optional[bytes]) -> List[int]:
+    """Распаковать BLOB в список из 24 счетчиков (пустой BLOB - нули)"""
+    if not blob:
+        return [0] * HOURS
+    return list(_FORMAT.unpack(blob))
+
+
+def merge_sync(db, deltas: Dict[tuple, List[int]]):
+    """
+    Прибавить приращения {(chat_id, utc_date): [24 счетчика]} к гистограммам в БД.
+    Вызывается внутри транзакции сброса буфера счетчиков.
+    """
+    rows = []
+    for (chat_id, day), delta in deltas.items():
+        row = db.execute(
+            "SELECT counts FROM chat_hourly_stats WHERE chat_id = ? AND date = ?", (chat_id, day)
+        ).fetchone()
+        counts = unpack(row[0] if row else None)
+        rows.append((chat_id, day, pack([a + b for a, b in zip(counts, delta)])))
+    db.executemany(
+        "INSERT OR REPLACE INTO chat_hourly_stats (chat_id, date, counts) VALUES (?, ?, ?)",
+        rows
+    )
+
+
+def move_chat_sync(db, old_chat_id: int, new_chat_id: int):
+    """Перенести гистограммы чата на новый ID, складывая с уже имеющимися"""
+    rows = db.execute(
+        "SELECT date, counts FROM chat_hourly_stats WHERE chat_id = ?", (old_chat_id,)
+    ).fetchall()
+    merge_sync(db, {(new_chat_id, day): unpack(counts) for day, counts in rows})
+    db.execute("DELETE FROM chat_hourly_stats WHERE chat_id = ?", (old_chat_id,))
+
+
+def utc_days_for_local_day(local_day: str, timezone_offset: int) -> List[str]:
+    """UTC-дни, на которые приходится локальный день в поясе UTC+timezone_offset"""
+    d = date.fromisoformat(local_day)
+    if timezone_offset > 0:
+        return [(d - timedelta(days=1)).isoformat(), d.isoformat()]
+    if timezone_offset < 0:
+        return [d.isoformat(), (d + timedelta(days=1)).isoformat()]
+    return [d.isoformat()]
+
+
+def local_day_counts(utc_counts: Dict[str, List[int]], local_day: str, timezone_offset: int) -> List[int]:
+    """
+    Гистограмма локального дня по гистограммам UTC-дней.
+    Локальный час h соответствует UTC-часу h - timezone_offset.
+    """
+    days = utc_days_for_local_day(local_day, timezone_offset)
+    hours = []
+    for day in days:
+        hours.extend(utc_counts.get(day) or [0] * HOURS)
+    # Начало локального дня в общем ряду UTC-часов
+    start = (-timezone_offset) % HOURS if timezone_offset > 0 else -timezone_offset
+    return hours[start:start + HOURS]
@@ -3,28 +3,41 @@
 """
 from datetime import datetime, timedelta
 from io import BytesIO
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, NamedTuple
 from PIL import Image, ImageDraw, ImageFont
 import colorsys
+import functools
 import os
 import platform
 import logging
+import time
+from render_cache import render_cache, RenderedImage
+from avatar_cache import avatar_cache, tile_image, TILE_SIZE
 
 logger = logging.getLogger(__name__)
 
+try:
+    from config import CHART_OUTPUT_PROFILE
+except ImportError:
+    CHART_OUTPUT_PROFILE = 'png'
 
-def _load_cyrillic_font(size: int) -> ImageFont.FreeTypeFont:
+
+# Реестр шрифтов процесса: файл шрифта ищется один раз, объекты FreeTypeFont
+# кэшируются по размеру. preload_fonts() вызывается при запуске бота до создания
+# пула рендеринга, поэтому процессы пула получают готовый реестр и не ищут шрифт сами
+FONT_SIZES = (14, 16, 20, 24, 32, 40)
+
+_font_path: Optional[str] = None
+_font_path_resolved = False
+_fonts: Dict[int, ImageFont.ImageFont] = {}
+
+
+def _find_cyrillic_font_path() -> Optional[str]:
     """
-    Загружает шрифт с поддержкой кириллицы, доступный на Windows и Linux
+    Ищет файл шрифта с поддержкой кириллицы, доступный на Windows и Linux
     
-    Args:
-        size: Размер шрифта
-        
     Returns:
-        ImageFont.FreeTypeFont: Загруженный шрифт
-        
-    Raises:
-        OSError: Если не удалось найти ни один подходящий шрифт
+        Optional[str]: Путь к файлу шрифта или None, если ни один шрифт не найден
     """
     # Список шрифтов для проверки (в порядке приоритета)
     font_names = [
@@ -64,7 +77,8 @@ def _load_cyrillic_font(size: int) -> ImageFont.FreeTypeFont:
     local_font_path = "data/fonts/NotoSans-Regular.ttf"
     if os.path.exists(local_font_path):
         try:
-            return ImageFont.truetype(local_font_path, size)
+            ImageFont.truetype(local_font_path, 12)
+            return local_font_path
         except Exception:
             pass
     
@@ -86,14 +100,15 @@ def _load_cyrillic_font(size: int) -> ImageFont.FreeTypeFont:
                     font_path = os.path.join(font_path_dir, name)
                     if os.path.exists(font_path):
                         try:
-                            return ImageFont.truetype(font_path, size)
+                            ImageFont.truetype(font_path, 12)
+                            return font_path
                         except Exception as e:
                             logger.debug(f"Не удалось загрузить шрифт {font_path}: {e}")
                             continue
         
         # Также пробуем прямой путь без расширения (для PIL, который может найти системный шрифт)
         try:
-            return ImageFont.truetype(font_name, size)
+            return ImageFont.truetype(font_name, 12).path
         except Exception:
             continue
     
@@ -110,82 +125,137 @@ def _load_cyrillic_font(size: int) -> ImageFont.FreeTypeFont:
             if result.returncode == 0 and result.stdout.strip():
                 font_file = result.stdout.strip()
                 if os.path.exists(font_file):
-                    return ImageFont.truetype(font_file, size)
+                    ImageFont.truetype(font_file, 12)
+                    return font_file
         except Exception:
             pass
     
-    # Если ничего не сработало, генерируем ошибку
-    raise OSError(
-        f"Не удалось найти шрифт с поддержкой кириллицы. "
-        f"Проверьте наличие DejaVu Sans, Liberation Sans, Arial или Tahoma в системе."
-    )
+    return None
 
 
-def generate_modern_profile_card(
-    user_data: Dict[str, Any],
-    monthly_stats: List[Dict[str, Any]],
-    avatar_path: Optional[str] = None
-) -> BytesIO:
+def _load_cyrillic_font(size: int) -> ImageFont.FreeTypeFont:
     """
-    Генерация современного графика профиля пользователя за месяц в темной теме
+    Загружает шрифт с поддержкой кириллицы (файл ищется один раз на процесс)
     
     Args:
-        user_data: Данные пользователя (не используется)
-        monthly_stats: Статистика за 30 дней
-        avatar_path: Путь к файлу аватарки (не используется)
-    
+        size: Размер шрифта
+        
     Returns:
-        BytesIO: Буфер с изображением PNG
+        ImageFont.FreeTypeFont: Загруженный шрифт
+        
+    Raises:
+        OSError: Если не удалось найти ни один подходящий шрифт
     """
-    # Размеры графика в ультра-широком формате (увеличенное разрешение для лучшего качества)
-    width, height = 2880, 960  # Увеличено в 1.5 раза
-    padding = 120  # Пропорционально увеличено
-    
-    # Создаем основное изображение с темно-серым фоном
-    image = Image.new('RGB', (width, height), '#374151')
-    draw = ImageDraw.Draw(image)
-    
-    # Загружаем шрифты (с поддержкой кириллицы)
+    global _font_path, _font_path_resolved
+    if not _font_path_resolved:
+        _font_path = _find_cyrillic_font_path()
+        _font_path_resolved = True
+    if _font_path is None:
+        raise OSError(
+            f"Не удалось найти шрифт с поддержкой кириллицы. "
+            f"Проверьте наличие DejaVu Sans, Liberation Sans, Arial или Tahoma в системе."
+        )
+    return ImageFont.truetype(_font_path, size)
+
+
+def _get_font(size: int) -> ImageFont.ImageFont:
+    """Шрифт нужного размера из реестра (при отсутствии кириллического - запасной)"""
+    font = _fonts.get(size)
+    if font is not None:
+        return font
     try:
-        font_title = _load_cyrillic_font(32)
-        font_medium = _load_cyrillic_font(20)
-        font_small = _load_cyrillic_font(16)
-        font_tiny = _load_cyrillic_font(14)
+        font = _load_cyrillic_font(size)
     except OSError as e:
         logger.error(f"Ошибка загрузки шрифта с поддержкой кириллицы: {e}")
-        # В критическом случае пробуем загрузить через PIL напрямую
+        # В критическом случае пробуем загрузить через PIL напрямую,
         # но это может не поддерживать кириллицу
         try:
-            font_title = ImageFont.truetype("arial.ttf", 32)
-            font_medium = ImageFont.truetype("arial.ttf", 20)
-            font_small = ImageFont.truetype("arial.ttf", 16)
-            font_tiny = ImageFont.truetype("arial.ttf", 14)
+            font = ImageFont.truetype("arial.ttf", size)
         except Exception:
-            # Последняя попытка - но это может не работать с кириллицей
             logger.warning("Используется запасной шрифт, кириллица может отображаться некорректно")
-            font_title = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-            font_tiny = ImageFont.load_default()
+            font = ImageFont.load_default()
+    _fonts[size] = font
+    return font
+
+
+def preload_fonts():
+    """Найти шрифт и загрузить все размеры, используемые графиками"""
+    started = time.perf_counter()
+    for size in FONT_SIZES:
+        _get_font(size)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Шрифты загружены: {_font_path or 'запасной шрифт'} ({elapsed_ms:.0f} мс)")
+
+
+# Шаблоны фонов: статичная часть каждого типа графика (фон, декор, постоянные надписи)
+# рисуется один раз на процесс для каждого размера, рендер начинается с ее копии.
+# preload_templates() вызывается при запуске бота вместе с preload_fonts()
+_templates: Dict[tuple, Image.Image] = {}
+
+
+@functools.lru_cache(maxsize=1024)
+def _text_bbox(text: str, size: int) -> tuple:
+    """Габариты текста шрифтом _get_font(size) (как draw.textbbox((0, 0), ...))"""
+    return _get_font(size).getbbox(text)
+
+
+def _text_width(text: str, size: int) -> int:
+    bbox = _text_bbox(text, size)
+    return bbox[2] - bbox[0]
+
+
+def _draw_plain_background(width: int, height: int) -> Image.Image:
+    """Темно-серый фон"""
+    return Image.new('RGB', (width, height), '#374151')
+
+
+def _draw_top_chart_background(width: int, height: int) -> Image.Image:
+    """Фон графика топа: сетка для глубины и круги в углах"""
+    image = _draw_plain_background(width, height)
+    draw = ImageDraw.Draw(image)
     
-    # Добавляем заголовок
-    title = "Ваша активность за 30 дней"
-    title_bbox = draw.textbbox((0, 0), title, font=font_title)
-    title_width = title_bbox[2] - title_bbox[0]
-    draw.text(((width - title_width) // 2, 20), title, fill='#ffffff', font=font_title)
+    # Вертикальные линии для глубины
+    for i in range(5):
+        x = width // 6 * (i + 1)
+        draw.line([x, 0, x, height], fill='#4b5563', width=1)
     
-    # Создаем график
-    chart_x = padding
-    chart_y = 70
-    chart_width = width - padding * 2
-    chart_height = height - chart_y - padding
+    # Горизонтальные линии
+    for i in range(3):
+        y = height // 4 * (i + 1)
+        draw.line([0, y, width, y], fill='#4b5563', width=1)
     
-    _create_modern_chart(draw, monthly_stats, chart_x, chart_y, chart_width, chart_height,
-                        font_medium, font_small, font_tiny)
+    # Декоративные круги в углах
+    circle_size = 200
+    
+    # Левый верхний угол
+    draw.ellipse([-circle_size//2, -circle_size//2, circle_size//2, circle_size//2], 
+                fill='#4b5563', outline=None)
+    # Правый верхний угол
+    draw.ellipse([width - circle_size//2, -circle_size//2, width + circle_size//2, circle_size//2], 
+                fill='#4b5563', outline=None)
+    # Левый нижний угол
+    draw.ellipse([-circle_size//2, height - circle_size//2, circle_size//2, height + circle_size//2], 
+                fill='#4b5563', outline=None)
+    # Правый нижний угол
+    draw.ellipse([width - circle_size//2, height - circle_size//2, width + circle_size//2, height + circle_size//2], 
+                fill='#4b5563', outline=None)
+    return image
+
+
+def _draw_profile_card_background(width: int, height: int) -> Image.Image:
+    """Фон карточки профиля: заголовок и подписи осей"""
+    image = _draw_plain_background(width, height)
+    draw = ImageDraw.Draw(image)
+    font_title = _get_font(32)
+    font_small = _get_font(16)
+    
+    # Заголовок
+    title = "Ваша активность за 30 дней"
+    draw.text(((width - _text_width(title, 32)) // 2, 20), title, fill='#ffffff', font=font_title)
     
     # Подпись оси Y (вертикальная) - переворачиваем текст
     y_label = "Сообщений"
-    y_label_bbox = draw.textbbox((0, 0), y_label, font=font_small)
+    y_label_bbox = _text_bbox(y_label, 16)
     y_label_width = y_label_bbox[2] - y_label_bbox[0]
     y_label_height = y_label_bbox[3] - y_label_bbox[1]
     
@@ -202,15 +272,164 @@ def generate_modern_profile_card(
     
     # Подпись оси X (горизонтальная)
     x_label = "Дата"
-    x_label_bbox = draw.textbbox((0, 0), x_label, font=font_small)
-    x_label_width = x_label_bbox[2] - x_label_bbox[0]
-    draw.text(((width - x_label_width) // 2, height - 30), x_label, fill='#ffffff', font=font_small)
-    
-    # Сохраняем в буфер с максимальным качеством
+    draw.text(((width - _text_width(x_label, 16)) // 2, height - 30), x_label, fill='#ffffff', font=font_small)
+    return image
+
+
+_TEMPLATE_BUILDERS = {
+    'plain': _draw_plain_background,
+    'top_chart': _draw_top_chart_background,
+    'profile_card': _draw_profile_card_background,
+}
+
+# Типы и размеры шаблонов, используемые графиками
+_TEMPLATE_SIZES = (
+    ('plain', 2880, 960),
+    ('top_chart', 2880, 1620),
+    ('profile_card', 2880, 960),
+)
+
+
+def _new_canvas(kind: str, width: int, height: int) -> Image.Image:
+    """Холст графика: копия шаблона нужного типа и размера"""
+    key = (kind, width, height)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = _TEMPLATE_BUILDERS[kind](width, height)
+    return template.copy()
+
+
+def preload_templates():
+    """Нарисовать шаблоны всех графиков заранее (процессы пула получают их готовыми)"""
+    for kind, width, height in _TEMPLATE_SIZES:
+        _new_canvas(kind, width, height)
+
+
+class EncodingProfile(NamedTuple):
+    """Параметры сохранения графика"""
+    format: str  # 'PNG', 'JPEG' или 'WEBP'
+    quality: int  # качество JPEG/WEBP; для PNG - уровень сжатия zlib
+    max_width: Optional[int] = None  # уменьшить изображение до этой ширины
+    max_bytes: Optional[int] = None  # наибольшее качество, при котором файл не больше max_bytes
+
+
+# Профили вывода (CHART_OUTPUT_PROFILE). Графики - плоские заливки и текст:
+# PNG у них компактный, но кодируется дольше; JPEG сохраняется без субдискретизации цвета,
+# чтобы не размывать подписи
+ENCODING_PROFILES: Dict[str, EncodingProfile] = {
+    'png': EncodingProfile('PNG', 6),
+    'png_fast': EncodingProfile('PNG', 1),
+    'jpeg': EncodingProfile('JPEG', 88),
+    'jpeg_1920': EncodingProfile('JPEG', 88, max_width=1920),
+    'webp': EncodingProfile('WEBP', 85),
+    # Telegram сам пережимает фото и хранит его не больше 2560 пикселей по стороне
+    'telegram': EncodingProfile('JPEG', 90, max_width=2560, max_bytes=512 * 1024),
+}
+
+_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
+
+# Нижняя граница качества при подборе под max_bytes
+_MIN_QUALITY = 40
+
+
+def _get_profile(profile: str) -> EncodingProfile:
+    return ENCODING_PROFILES.get(profile) or ENCODING_PROFILES['png']
+
+
+def _save_image(image: Image.Image, fmt: str, quality: int) -> bytes:
     buf = BytesIO()
-    image.save(buf, format='PNG', optimize=False)  # Без оптимизации для максимального качества
-    buf.seek(0)
-    return buf
+    if fmt == 'PNG':
+        image.save(buf, format='PNG', compress_level=quality)
+    elif fmt == 'JPEG':
+        image.save(buf, format='JPEG', quality=quality, subsampling=0)
+    else:
+        image.save(buf, format=fmt, quality=quality, method=4)
+    return buf.getvalue()
+
+
+def _encode_image(image: Image.Image, profile: str = CHART_OUTPUT_PROFILE) -> BytesIO:
+    """
+    Сохраняет изображение по профилю вывода
+    
+    Args:
+        image: Готовое изображение
+        profile: Имя профиля из ENCODING_PROFILES (неизвестное - 'png')
+    
+    Returns:
+        BytesIO: Буфер с закодированным изображением
+    """
+    spec = _get_profile(profile)
+    if spec.max_width and image.width > spec.max_width:
+        height = round(image.height * spec.max_width / image.width)
+        image = image.resize((spec.max_width, height), Image.Resampling.LANCZOS)
+    
+    data = _save_image(image, spec.format, spec.quality)
+    if spec.max_bytes and len(data) > spec.max_bytes and spec.format != 'PNG':
+        # Двоичный поиск наибольшего качества, укладывающегося в max_bytes;
+        # если не укладывается и минимальное - отдаем минимальное
+        low, high = _MIN_QUALITY, spec.quality - 1
+        fitting = None
+        smallest = data
+        while low <= high:
+            quality = (low + high) // 2
+            candidate = _save_image(image, spec.format, quality)
+            if len(candidate) <= spec.max_bytes:
+                fitting = candidate
+                low = quality + 1
+            else:
+                smallest = min(smallest, candidate, key=len)
+                high = quality - 1
+        data = fitting if fitting is not None else smallest
+    
+    return BytesIO(data)
+
+
+def output_filename(stem: str, profile: str = CHART_OUTPUT_PROFILE) -> str:
+    """Имя файла графика с расширением формата профиля"""
+    return f"{stem}.{_EXTENSIONS[_get_profile(profile).format]}"
+
+
+def generate_modern_profile_card(
+    user_data: Dict[str, Any],
+    monthly_stats: List[Dict[str, Any]],
+    avatar_path: Optional[str] = None,
+    profile: str = CHART_OUTPUT_PROFILE
+) -> BytesIO:
+    """
+    Генерация современного графика профиля пользователя за месяц в темной теме
+    
+    Args:
+        user_data: Данные пользователя (не используется)
+        monthly_stats: Статистика за 30 дней
+        avatar_path: Путь к файлу аватарки (не используется)
+        profile: Профиль вывода (ENCODING_PROFILES)
+    
+    Returns:
+        BytesIO: Буфер с изображением
+    """
+    # Размеры графика в ультра-широком формате (увеличенное разрешение для лучшего качества)
+    width, height = 2880, 960  # Увеличено в 1.5 раза
+    padding = 120  # Пропорционально увеличено
+    
+    # Фон с заголовком и подписями осей - из шаблона
+    image = _new_canvas('profile_card', width, height)
+    draw = ImageDraw.Draw(image)
+    
+    # Загружаем шрифты (с поддержкой кириллицы)
+    font_medium = _get_font(20)
+    font_small = _get_font(16)
+    font_tiny = _get_font(14)
+    
+    # Создаем график
+    chart_x = padding
+    chart_y = 70
+    chart_width = width - padding * 2
+    chart_height = height - chart_y - padding
+    
+    _create_modern_chart(draw, monthly_stats, chart_x, chart_y, chart_width, chart_height,
+                        font_medium, font_small, font_tiny)
+    
+    return _encode_image(image, profile)
 
 
 
@@ -553,7 +772,8 @@ def generate_activity_chart(
     title: str = "Активность",
     subtitle: str = "",
     x_label: str = "Время",
-    is_hourly: bool = True
+    is_hourly: bool = True,
+    profile: str = CHART_OUTPUT_PROFILE
 ) -> BytesIO:
     """
     Генерация графика активности по часам или дням
@@ -564,62 +784,45 @@ def generate_activity_chart(
         subtitle: Подзаголовок графика
         x_label: Подпись оси X
         is_hourly: True для часового графика, False для дневного
+        profile: Профиль вывода (ENCODING_PROFILES)
     
     Returns:
-        BytesIO: Буфер с изображением PNG
+        BytesIO: Буфер с изображением
     """
     # Размеры графика
     width, height = 2880, 960
     padding = 120
     
     # Создаем основное изображение с темно-серым фоном
-    image = Image.new('RGB', (width, height), '#374151')
+    image = _new_canvas('plain', width, height)
     draw = ImageDraw.Draw(image)
     
     # Загружаем шрифты
-    try:
-        font_title = _load_cyrillic_font(32)
-        font_subtitle = _load_cyrillic_font(20)
-        font_medium = _load_cyrillic_font(20)
-        font_small = _load_cyrillic_font(16)
-        font_tiny = _load_cyrillic_font(14)
-    except OSError as e:
-        logger.error(f"Ошибка загрузки шрифта: {e}")
-        try:
-            font_title = ImageFont.truetype("arial.ttf", 32)
-            font_subtitle = ImageFont.truetype("arial.ttf", 20)
-            font_medium = ImageFont.truetype("arial.ttf", 20)
-            font_small = ImageFont.truetype("arial.ttf", 16)
-            font_tiny = ImageFont.truetype("arial.ttf", 14)
-        except Exception:
-            font_title = ImageFont.load_default()
-            font_subtitle = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-            font_tiny = ImageFont.load_default()
+    font_title = _get_font(32)
+    font_subtitle = _get_font(20)
+    font_medium = _get_font(20)
+    font_small = _get_font(16)
+    font_tiny = _get_font(14)
     
     # Заголовок
     title_y = 20
-    title_bbox = draw.textbbox((0, 0), title, font=font_title)
+    title_bbox = _text_bbox(title, 32)
     title_width = title_bbox[2] - title_bbox[0]
     draw.text(((width - title_width) // 2, title_y), title, fill='#ffffff', font=font_title)
     
     # Подзаголовок
     if subtitle:
         subtitle_y = title_y + 50
-        subtitle_bbox = draw.textbbox((0, 0), subtitle, font=font_subtitle)
+        subtitle_bbox = _text_bbox(subtitle, 20)
         subtitle_width = subtitle_bbox[2] - subtitle_bbox[0]
         draw.text(((width - subtitle_width) // 2, subtitle_y), subtitle, fill='#9ca3af', font=font_subtitle)
     
     if not activity_data:
         no_data_text = "Нет данных для отображения"
-        no_data_bbox = draw.textbbox((0, 0), no_data_text, font=font_medium)
+        no_data_bbox = _text_bbox(no_data_text, 20)
         no_data_width = no_data_bbox[2] - no_data_bbox[0]
         draw.text(((width - no_data_width) // 2, height // 2), no_data_text, fill='#9ca3af', font=font_medium)
-        buf = BytesIO()
-        image.save(buf, format='PNG', optimize=False)
-        buf.seek(0)
-        return buf
+        return _encode_image(image, profile)
     
     # Область графика
     chart_x = padding + 100  # Место для подписи оси Y
@@ -672,7 +875,7 @@ def generate_activity_chart(
         
         # Подписи значений на оси Y
         label = str(value)
-        label_bbox = draw.textbbox((0, 0), label, font=font_small)
+        label_bbox = _text_bbox(label, 16)
         label_width = label_bbox[2] - label_bbox[0]
         label_height = label_bbox[3] - label_bbox[1]
         draw.text((chart_x - label_width - 10, y_pos - label_height // 2), 
@@ -680,7 +883,7 @@ def generate_activity_chart(
     
     # Подпись оси Y (вертикальная) - переворачиваем текст
     y_label = "Сообщений"
-    y_label_bbox = draw.textbbox((0, 0), y_label, font=font_small)
+    y_label_bbox = _text_bbox(y_label, 16)
     y_label_width = y_label_bbox[2] - y_label_bbox[0]
     y_label_height = y_label_bbox[3] - y_label_bbox[1]
     
@@ -756,7 +959,7 @@ def generate_activity_chart(
             show_label = (i % 5 == 0 or i == num_items - 1)
         
         if show_label:
-            label_bbox = draw.textbbox((0, 0), label, font=font_tiny)
+            label_bbox = _text_bbox(label, 14)
             label_width = label_bbox[2] - label_bbox[0]
             label_x = int(bar_x + (bar_width - label_width) / 2)
             draw.text((label_x, y_bottom + 5), label, fill='#ffffff', font=font_tiny)
@@ -769,15 +972,12 @@ def generate_activity_chart(
     draw.line([chart_x, chart_y + chart_height, chart_x + chart_width, chart_y + chart_height], fill='#9ca3af', width=2)  # Горизонтальная ось X
     
     # Подпись оси X
-    x_label_bbox = draw.textbbox((0, 0), x_label, font=font_small)
+    x_label_bbox = _text_bbox(x_label, 16)
     x_label_width = x_label_bbox[2] - x_label_bbox[0]
     draw.text(((width - x_label_width) // 2, height - 30), x_label, fill='#ffffff', font=font_small)
     
     # Сохраняем в буфер
-    buf = BytesIO()
-    image.save(buf, format='PNG', optimize=False)
-    buf.seek(0)
-    return buf
+    return _encode_image(image, profile)
 
 
 async def generate_top_chart(
@@ -785,106 +985,93 @@ async def generate_top_chart(
     title: str = "Топ активных пользователей",
     subtitle: str = "",
     bot_instance = None
-) -> BytesIO:
+) -> RenderedImage:
     """
     Генерация графика топ пользователей
+    Аватарки берутся из кэша (скачиваются только новые и смененные фото),
+    рисование выполняется в пуле процессов. График с теми же данными и аватарками
+    берется из кэша изображений (с file_id, если уже отправлялся).
+    
+    Args:
+        top_users: Список пользователей с полями user_id, message_count, username, first_name
+        title: Заголовок графика
+        subtitle: Подзаголовок графика
+    
+    Returns:
+        RenderedImage: Изображение или file_id ранее отправленного
+    
+    Raises:
+        RenderUnavailable: очередь рендеринга заполнена или истек таймаут
+    """
+    avatars = {}
+    if bot_instance and top_users:
+        avatars = await avatar_cache.get_tiles((user['user_id'] for user in top_users), bot_instance)
+    # Профиль передается явно: он входит в ключ кэша изображений
+    return await render_cache.render(render_top_chart, top_users, title, subtitle, avatars, CHART_OUTPUT_PROFILE)
+
+
+def render_top_chart(
+    top_users: List[Dict[str, Any]],
+    title: str,
+    subtitle: str,
+    avatars: Dict[int, bytes],
+    profile: str = CHART_OUTPUT_PROFILE
+) -> BytesIO:
+    """
+    Отрисовка графика топ пользователей (выполняется в пуле процессов)
     
     Args:
         top_users: Список пользователей с полями user_id, message_count, username, first_name
         title: Заголовок графика
         subtitle: Подзаголовок графика
+        avatars: Аватарки пользователей: user_id -> плитка avatar_cache (байты RGBA с круглой маской)
+        profile: Профиль вывода (ENCODING_PROFILES)
     
     Returns:
-        BytesIO: Буфер с изображением PNG
+        BytesIO: Буфер с изображением
     """
     # Размеры графика (16:9)
     width, height = 2880, 1620  # Формат 16:9 для горизонтальных столбцов
     padding = 120
     
-    # Создаем основное изображение с темно-серым фоном
-    image = Image.new('RGB', (width, height), '#374151')
+    # Фон с сеткой и кругами в углах - из шаблона
+    image = _new_canvas('top_chart', width, height)
     draw = ImageDraw.Draw(image)
     
-    # Добавляем декоративные элементы на фон
-    # Вертикальные линии для глубины
-    for i in range(5):
-        x = width // 6 * (i + 1)
-        draw.line([x, 0, x, height], fill='#4b5563', width=1)
-    
-    # Горизонтальные линии
-    for i in range(3):
-        y = height // 4 * (i + 1)
-        draw.line([0, y, width, y], fill='#4b5563', width=1)
-    
-    # Декоративные круги в углах
-    circle_size = 200
-    circle_alpha = 30  # Прозрачность через цвет
-    
-    # Левый верхний угол
-    draw.ellipse([-circle_size//2, -circle_size//2, circle_size//2, circle_size//2], 
-                fill='#4b5563', outline=None)
-    # Правый верхний угол
-    draw.ellipse([width - circle_size//2, -circle_size//2, width + circle_size//2, circle_size//2], 
-                fill='#4b5563', outline=None)
-    # Левый нижний угол
-    draw.ellipse([-circle_size//2, height - circle_size//2, circle_size//2, height + circle_size//2], 
-                fill='#4b5563', outline=None)
-    # Правый нижний угол
-    draw.ellipse([width - circle_size//2, height - circle_size//2, width + circle_size//2, height + circle_size//2], 
-                fill='#4b5563', outline=None)
-    
     # Загружаем шрифты
-    try:
-        font_title = _load_cyrillic_font(40)
-        font_subtitle = _load_cyrillic_font(24)
-        font_medium = _load_cyrillic_font(20)
-        font_small = _load_cyrillic_font(16)
-        font_tiny = _load_cyrillic_font(14)
-    except OSError as e:
-        logger.error(f"Ошибка загрузки шрифта: {e}")
-        try:
-            font_title = ImageFont.truetype("arial.ttf", 40)
-            font_subtitle = ImageFont.truetype("arial.ttf", 24)
-            font_medium = ImageFont.truetype("arial.ttf", 20)
-            font_small = ImageFont.truetype("arial.ttf", 16)
-            font_tiny = ImageFont.truetype("arial.ttf", 14)
-        except Exception:
-            font_title = ImageFont.load_default()
-            font_subtitle = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-            font_tiny = ImageFont.load_default()
+    font_title = _get_font(40)
+    font_subtitle = _get_font(24)
+    font_medium = _get_font(20)
+    font_small = _get_font(16)
+    font_tiny = _get_font(14)
     
     # Заголовок
     title_y = 40
-    title_bbox = draw.textbbox((0, 0), title, font=font_title)
+    title_bbox = _text_bbox(title, 40)
     title_width = title_bbox[2] - title_bbox[0]
     draw.text(((width - title_width) // 2, title_y), title, fill='#ffffff', font=font_title)
     
     # Подзаголовок
     if subtitle:
         subtitle_y = title_y + 60
-        subtitle_bbox = draw.textbbox((0, 0), subtitle, font=font_subtitle)
+        subtitle_bbox = _text_bbox(subtitle, 24)
         subtitle_width = subtitle_bbox[2] - subtitle_bbox[0]
         draw.text(((width - subtitle_width) // 2, subtitle_y), subtitle, fill='#9ca3af', font=font_subtitle)
     
     if not top_users:
         # Если нет данных, показываем сообщение
         no_data_text = "Нет данных для отображения"
-        no_data_bbox = draw.textbbox((0, 0), no_data_text, font=font_medium)
+        no_data_bbox = _text_bbox(no_data_text, 20)
         no_data_width = no_data_bbox[2] - no_data_bbox[0]
         draw.text(((width - no_data_width) // 2, height // 2), no_data_text, fill='#9ca3af', font=font_medium)
-        buf = BytesIO()
-        image.save(buf, format='PNG', optimize=False)
-        buf.seek(0)
-        return buf
+        return _encode_image(image, profile)
     
     # Подготовка данных
     max_count = max(user['message_count'] for user in top_users) if top_users else 1
     max_count_actual = max_count
     
     # Область графика
-    avatar_size = 60  # Размер аватарки
+    avatar_size = TILE_SIZE  # Размер аватарки
     chart_x = padding + avatar_size + 20 + 200  # Место для аватарок и подписей пользователей
     chart_y = (subtitle_y + 80) if subtitle else (title_y + 100)
     chart_width = width - chart_x - padding
@@ -895,36 +1082,13 @@ async def generate_top_chart(
     bar_height = (chart_height - (num_users - 1) * 10) / num_users  # 10px между столбцами
     bar_height = min(bar_height, 80)  # Максимальная высота столбца
     
-    # Получаем аватары параллельно для всех пользователей
+    # Аватары уже уменьшены и обрезаны по кругу
     avatar_images = {}
-    if bot_instance:
-        async def get_avatar(user_id: int):
-            try:
-                photos = await bot_instance.get_user_profile_photos(user_id, limit=1)
-                if photos and photos.total_count > 0:
-                    file = await bot_instance.get_file(photos.photos[0][-1].file_id)
-                    avatar_bytes = await bot_instance.download_file(file.file_path)
-                    avatar_img = Image.open(avatar_bytes)
-                    avatar_img = avatar_img.resize((avatar_size, avatar_size), Image.Resampling.LANCZOS)
-                    # Создаем круглую маску
-                    mask = Image.new('L', (avatar_size, avatar_size), 0)
-                    mask_draw = ImageDraw.Draw(mask)
-                    mask_draw.ellipse([0, 0, avatar_size, avatar_size], fill=255)
-                    avatar_img.putalpha(mask)
-                    return user_id, avatar_img
-            except Exception as e:
-                logger.debug(f"Не удалось загрузить аватар для пользователя {user_id}: {e}")
-            return user_id, None
-        
-        # Получаем все аватары параллельно
-        import asyncio
-        tasks = [get_avatar(user['user_id']) for user in top_users]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for result in results:
-            if isinstance(result, tuple) and len(result) == 2:
-                user_id, avatar_img = result
-                if avatar_img:
-                    avatar_images[user_id] = avatar_img
+    for user_id, tile in avatars.items():
+        try:
+            avatar_images[user_id] = tile_image(tile)
+        except Exception as e:
+            logger.debug(f"Не удалось обработать аватар пользователя {user_id}: {e}")
     
     # Рисуем столбцы
     for i, user in enumerate(top_users):
@@ -1031,10 +1195,7 @@ async def generate_top_chart(
             draw.text((count_x, count_y), count_text, fill='#374151', font=font_medium)
     
     # Сохраняем в буфер
-    buf = BytesIO()
-    image.save(buf, format='PNG', optimize=False)
-    buf.seek(0)
-    return buf
+    return _encode_image(image, profile)
 
 
 def _draw_rounded_rectangle(draw: ImageDraw.Draw, xy: tuple, fill: str, radius: int = 5):
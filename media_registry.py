@@ -0,0 +1,133 @@
+"""
+Реестр Telegram file_id для медиафайлов команд (Gifs/<command>)
+После первой загрузки файла запоминается file_id, дальше файл отправляется по нему,
+без повторной загрузки. Запись недействительна, если файл на диске изменился
+(размер или время изменения).
+"""
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from db_pool import get_connection
+from migrations import run_migrations_sync
+
+logger = logging.getLogger(__name__)
+
+# Импортируем BASE_PATH из config, если доступен
+try:
+    from config import BASE_PATH
+except ImportError:
+    BASE_PATH = Path(__file__).parent.absolute()
+
+
+def _schema_v1(db):
+    """Исходная схема: таблица file_id медиафайлов"""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS media_file_ids (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            file_type TEXT,
+            file_id TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
+
+class MediaRegistry:
+    """Хранит file_id загруженных файлов; чтение идет из памяти, запись - в БД"""
+
+    def __init__(self, db_path: str = None):
+        if db_path is None:
+            db_path = str(BASE_PATH / 'data' / 'media_registry.db')
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # path -> (size, mtime_ns, file_type, file_id)
+        self._entries: Dict[str, Tuple[int, int, str, str]] = {}
+
+    async def init_db(self):
+        """Применить миграции схемы и загрузить реестр в память"""
+        def _init_sync():
+            try:
+                run_migrations_sync(self.db_path, "реестра медиафайлов", SCHEMA_MIGRATIONS)
+                with get_connection(self.db_path) as db:
+                    cursor = db.execute("SELECT path, size, mtime_ns, file_type, file_id FROM media_file_ids")
+                    return {row[0]: (row[1], row[2], row[3], row[4]) for row in cursor.fetchall()}
+            except Exception as e:
+                logger.error(f"Ошибка при инициализации реестра медиафайлов: {e}")
+                return {}
+
+        self._entries = await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        logger.info(f"Реестр медиафайлов загружен ({len(self._entries)} файлов)")
+
+    @staticmethod
+    def _key(path: Path) -> str:
+        return Path(path).as_posix()
+
+    def get_file_id(self, path: Path, file_type: str) -> Optional[str]:
+        """file_id для файла, если он уже загружался и не изменился с тех пор"""
+        entry = self._entries.get(self._key(path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        size, mtime_ns, cached_type, file_id = entry
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns or cached_type != file_type:
+            return None
+        return file_id
+
+    async def remember(self, path: Path, file_type: str, file_id: str):
+        """Запомнить file_id, полученный после загрузки файла"""
+        key = self._key(path)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            logger.debug(f"Не удалось получить сведения о файле {key}: {e}")
+            return
+        entry = (stat.st_size, stat.st_mtime_ns, file_type, file_id)
+        self._entries[key] = entry
+
+        def _remember_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    db.execute("""
+                        INSERT INTO media_file_ids (path, size, mtime_ns, file_type, file_id, updated_at)
+                        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(path) DO UPDATE SET
+                            size = excluded.size,
+                            mtime_ns = excluded.mtime_ns,
+                            file_type = excluded.file_type,
+                            file_id = excluded.file_id,
+                            updated_at = excluded.updated_at
+                    """, (key, *entry))
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении file_id для {key}: {e}")
+
+        await asyncio.get_event_loop().run_in_executor(None, _remember_sync)
+
+    async def forget(self, path: Path):
+        """Удалить запись (например, если Telegram больше не принимает file_id)"""
+        key = self._key(path)
+        if self._entries.pop(key, None) is None:
+            return
+
+        def _forget_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    db.execute("DELETE FROM media_file_ids WHERE path = ?", (key,))
+            except Exception as e:
+                logger.error(f"Ошибка при удалении file_id для {key}: {e}")
+
+        await asyncio.get_event_loop().run_in_executor(None, _forget_sync)
+
+
+# Глобальный экземпляр реестра медиафайлов
+media_registry = MediaRegistry()
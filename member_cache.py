@@ -0,0 +1,98 @@
+"""
+Кэш статусов участников чатов (результаты bot.get_chat_member)
+Записи живут CHAT_MEMBER_CACHE_TTL секунд и обновляются из апдейтов
+my_chat_member / chat_member. Одновременные запросы одного участника
+объединяются в один вызов API. Используется только из цикла событий asyncio.
+"""
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import CHAT_MEMBER_CACHE_TTL
+except ImportError:
+    CHAT_MEMBER_CACHE_TTL = 300
+
+
+class ChatMemberCache:
+    """TTL-кэш ChatMember по (chat_id, user_id) с объединением одновременных запросов"""
+
+    def __init__(self, ttl: float = CHAT_MEMBER_CACHE_TTL, max_entries: int = 50_000):
+        self.bot = None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (chat_id, user_id) -> (время истечения, ChatMember)
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[float, Any]]" = OrderedDict()
+        # Запросы к API, которые сейчас выполняются
+        self._inflight: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    def set_bot(self, bot):
+        """Установить бота для запросов к API"""
+        self.bot = bot
+
+    def _store(self, key: Tuple[int, int], member: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, member)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def peek(self, chat_id: int, user_id: int) -> Optional[Any]:
+        """Участник из кэша без обращения к API (None, если записи нет или она устарела)"""
+        entry = self._entries.get((chat_id, user_id))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    async def get(self, chat_id: int, user_id: int) -> Any:
+        """
+        Получить ChatMember: из кэша или одним запросом к API на всех ожидающих.
+        Ошибки API пробрасываются и не кэшируются.
+        """
+        key = (chat_id, user_id)
+        member = self.peek(chat_id, user_id)
+        if member is not None:
+            return member
+
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            member = await self.bot.get_chat_member(chat_id, user_id)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Исключение получают ожидающие; помечаем его обработанным, если их нет
+                future.exception()
+            else:
+                # Запрос отменен - отменяем и ожидание остальных
+                future.cancel()
+            raise
+        else:
+            self._store(key, member)
+            future.set_result(member)
+            return member
+        finally:
+            self._inflight.pop(key, None)
+
+    def update(self, chat_id: int, user_id: int, member: Any):
+        """Обновить запись из апдейта chat_member / my_chat_member"""
+        self._store((chat_id, user_id), member)
+
+    def invalidate(self, chat_id: int, user_id: Optional[int] = None):
+        """Сбросить запись участника или все записи чата"""
+        if user_id is not None:
+            self._entries.pop((chat_id, user_id), None)
+            return
+        for key in [key for key in self._entries if key[0] == chat_id]:
+            del self._entries[key]
+
+
+# Глобальный кэш участников чатов
+chat_member_cache = ChatMemberCache()
@@ -0,0 +1,58 @@
+"""
+Версионные миграции схем баз данных
+Номер примененной миграции хранится в PRAGMA user_version файла базы.
+При запуске применяются только недостающие шаги, поэтому повторный запуск
+с актуальной схемой сводится к одному чтению PRAGMA.
+Шаг i (с единицы) переводит схему из версии i-1 в версию i. Первый шаг каждой базы -
+прежний init_db целиком: базы, созданные до появления миграций, имеют версию 0
+и проходят его еще раз, поэтому шаги должны быть идемпотентными.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Callable, Sequence, Tuple
+
+from db_pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции: получает соединение и меняет схему (фиксация - после шага)
+MigrationStep = Callable[[sqlite3.Connection], None]
+
+
+def get_schema_version(db_path: str) -> int:
+    """Текущая версия схемы базы (0 для новой базы или базы до миграций)"""
+    with get_connection(db_path) as db:
+        return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations_sync(db_path: str, name: str, steps: Sequence[MigrationStep]) -> Tuple[int, int]:
+    """
+    Применить недостающие шаги миграции к базе.
+    name - название базы в родительном падеже для журнала («базы модерации»).
+    Возвращает (версия до, версия после).
+    """
+    target = len(steps)
+    version = get_schema_version(db_path)
+    if version >= target:
+        if version > target:
+            logger.warning(f"Схема {name} новее кода (v{version} > v{target}), миграции пропущены")
+        return version, version
+
+    started = time.perf_counter()
+    for number in range(version + 1, target + 1):
+        with get_connection(db_path) as db:
+            steps[number - 1](db)
+            # Номер версии записывается вместе с последними изменениями шага
+            db.execute(f"PRAGMA user_version = {number}")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Схема {name} обновлена: v{version} → v{target} за {elapsed_ms:.0f} мс")
+    return version, target
+
+
+async def run_migrations(db_path: str, name: str, steps: Sequence[MigrationStep]) -> Tuple[int, int]:
+    """Асинхронная обертка над run_migrations_sync (выполняется в пуле потоков)"""
+    return await asyncio.get_event_loop().run_in_executor(
+        None, run_migrations_sync, db_path, name, steps
+    )
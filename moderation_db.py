@@ -9,6 +9,10 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import os
 from pathlib import Path
+from db_pool import get_connection
+from migrations import run_migrations
+from settings_cache import settings_cache
+from expiry_queue import punishment_expiry_queue, EXPIRING_PUNISHMENT_TYPES
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +22,83 @@ try:
 except ImportError:
     BASE_PATH = Path(__file__).parent.absolute()
 
+
+def _schema_v1(db):
+    """Исходная схема: таблицы, колонки и индексы, которые раньше создавал init_db"""
+    # Таблица истории наказаний
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS punishments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            moderator_id INTEGER,
+            punishment_type TEXT,
+            reason TEXT,
+            duration_seconds INTEGER,
+            punishment_date TEXT,
+            expiry_date TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            user_username TEXT,
+            user_first_name TEXT,
+            user_last_name TEXT,
+            moderator_username TEXT,
+            moderator_first_name TEXT,
+            moderator_last_name TEXT
+        )
+    """)
+
+    # Таблица варнов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS warns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            moderator_id INTEGER,
+            reason TEXT,
+            warn_date TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            user_username TEXT,
+            user_first_name TEXT,
+            user_last_name TEXT,
+            moderator_username TEXT,
+            moderator_first_name TEXT,
+            moderator_last_name TEXT
+        )
+    """)
+
+    # Таблица настроек варнов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS warn_settings (
+            chat_id INTEGER PRIMARY KEY,
+            warn_limit INTEGER DEFAULT 3,
+            punishment_type TEXT DEFAULT 'kick',
+            mute_duration INTEGER DEFAULT NULL
+        )
+    """)
+
+    # Миграция: добавляем поле reason в таблицу warns, если его нет
+    try:
+        db.execute("ALTER TABLE warns ADD COLUMN reason TEXT")
+        logger.info("Добавлено поле reason в таблицу warns")
+    except sqlite3.OperationalError:
+        # Поле уже существует
+        pass
+
+    # Создаем индексы для оптимизации
+    db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_chat_user ON punishments (chat_id, user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_chat_type ON punishments (chat_id, punishment_type)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_active ON punishments (is_active)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_expiry ON punishments (expiry_date)")
+
+    # Индексы для варнов
+    db.execute("CREATE INDEX IF NOT EXISTS idx_warns_chat_user ON warns (chat_id, user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_warns_active ON warns (is_active)")
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
+
 class ModerationDatabase:
     """Класс для работы с базой данных модерации"""
     
@@ -27,82 +108,8 @@ class ModerationDatabase:
         self.db_path = db_path
     
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        def _init_sync():
-            with sqlite3.connect(self.db_path) as db:
-                # Таблица истории наказаний
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS punishments (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        moderator_id INTEGER,
-                        punishment_type TEXT,
-                        reason TEXT,
-                        duration_seconds INTEGER,
-                        punishment_date TEXT,
-                        expiry_date TEXT,
-                        is_active BOOLEAN DEFAULT 1,
-                        user_username TEXT,
-                        user_first_name TEXT,
-                        user_last_name TEXT,
-                        moderator_username TEXT,
-                        moderator_first_name TEXT,
-                        moderator_last_name TEXT
-                    )
-                """)
-                
-                # Таблица варнов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS warns (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        moderator_id INTEGER,
-                        reason TEXT,
-                        warn_date TEXT,
-                        is_active BOOLEAN DEFAULT 1,
-                        user_username TEXT,
-                        user_first_name TEXT,
-                        user_last_name TEXT,
-                        moderator_username TEXT,
-                        moderator_first_name TEXT,
-                        moderator_last_name TEXT
-                    )
-                """)
-                
-                # Таблица настроек варнов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS warn_settings (
-                        chat_id INTEGER PRIMARY KEY,
-                        warn_limit INTEGER DEFAULT 3,
-                        punishment_type TEXT DEFAULT 'kick',
-                        mute_duration INTEGER DEFAULT NULL
-                    )
-                """)
-                
-                # Миграция: добавляем поле reason в таблицу warns, если его нет
-                try:
-                    db.execute("ALTER TABLE warns ADD COLUMN reason TEXT")
-                    logger.info("Добавлено поле reason в таблицу warns")
-                except sqlite3.OperationalError:
-                    # Поле уже существует
-                    pass
-                
-                # Создаем индексы для оптимизации
-                db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_chat_user ON punishments (chat_id, user_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_chat_type ON punishments (chat_id, punishment_type)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_active ON punishments (is_active)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_punishments_expiry ON punishments (expiry_date)")
-                
-                # Индексы для варнов
-                db.execute("CREATE INDEX IF NOT EXISTS idx_warns_chat_user ON warns (chat_id, user_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_warns_active ON warns (is_active)")
-                
-                db.commit()
-                logger.info("База данных модерации инициализирована")
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        await run_migrations(self.db_path, "базы модерации", SCHEMA_MIGRATIONS)
     
     async def add_punishment(self, chat_id: int, user_id: int, moderator_id: int, 
                            punishment_type: str, reason: str = None, 
@@ -112,8 +119,8 @@ class ModerationDatabase:
         """Добавление записи о наказании"""
         def _add_punishment_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
-                    db.execute("""
+                with get_connection(self.db_path) as db:
+                    cursor = db.execute("""
                         INSERT INTO punishments 
                         (chat_id, user_id, moderator_id, punishment_type, reason, 
                          duration_seconds, punishment_date, expiry_date,
@@ -125,18 +132,25 @@ class ModerationDatabase:
                           user_username, user_first_name, user_last_name,
                           moderator_username, moderator_first_name, moderator_last_name))
                     db.commit()
-                    return True
+                    return cursor.lastrowid
             except Exception as e:
                 logger.error(f"Ошибка при добавлении наказания для пользователя {user_id} в чате {chat_id}: {e}")
-                return False
+                return None
+        
+        punishment_id = await asyncio.get_event_loop().run_in_executor(None, _add_punishment_sync)
+        if punishment_id is None:
+            return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _add_punishment_sync)
+        # Срок истечения попадает в очередь планировщика
+        if expiry_date and punishment_type in EXPIRING_PUNISHMENT_TYPES:
+            punishment_expiry_queue.schedule(punishment_id, expiry_date)
+        return True
     
     async def get_user_punishments(self, chat_id: int, user_id: int, active_only: bool = True) -> List[Dict[str, Any]]:
         """Получение истории наказаний пользователя"""
         def _get_user_punishments_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     query = """
                         SELECT id, punishment_type, reason, duration_seconds, 
                                punishment_date, expiry_date, is_active,
@@ -175,7 +189,7 @@ class ModerationDatabase:
         """Деактивация наказания (например, при размуте). Возвращает True только если наказание было активно и успешно деактивировано."""
         def _deactivate_punishment_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Атомарно деактивируем только если наказание еще активно (защита от дублирования)
                     cursor = db.execute("""
                         UPDATE punishments SET is_active = 0 
@@ -188,13 +202,67 @@ class ModerationDatabase:
                 logger.error(f"Ошибка при деактивации наказания {punishment_id}: {e}")
                 return False
         
+        punishment_expiry_queue.cancel(punishment_id)
         return await asyncio.get_event_loop().run_in_executor(None, _deactivate_punishment_sync)
     
+    async def get_punishment(self, punishment_id: int) -> Optional[Dict[str, Any]]:
+        """Получение наказания по ID"""
+        def _get_punishment_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    cursor = db.execute("""
+                        SELECT id, chat_id, user_id, punishment_type, expiry_date, is_active,
+                               user_username, user_first_name, user_last_name
+                        FROM punishments
+                        WHERE id = ?
+                    """, (punishment_id,))
+                    row = cursor.fetchone()
+                    if not row:
+                        return None
+                    return {
+                        'id': row[0],
+                        'chat_id': row[1],
+                        'user_id': row[2],
+                        'punishment_type': row[3],
+                        'expiry_date': row[4],
+                        'is_active': bool(row[5]),
+                        'user_username': row[6],
+                        'user_first_name': row[7],
+                        'user_last_name': row[8]
+                    }
+            except Exception as e:
+                logger.error(f"Ошибка при получении наказания {punishment_id}: {e}")
+                return None
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _get_punishment_sync)
+    
+    async def load_expiry_queue(self) -> int:
+        """Загрузить сроки истечения активных мутов и банов в очередь планировщика"""
+        def _get_expiring_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    placeholders = ','.join('?' * len(EXPIRING_PUNISHMENT_TYPES))
+                    cursor = db.execute(f"""
+                        SELECT id, expiry_date
+                        FROM punishments
+                        WHERE is_active = 1 AND expiry_date IS NOT NULL
+                        AND punishment_type IN ({placeholders})
+                    """, EXPIRING_PUNISHMENT_TYPES)
+                    return cursor.fetchall()
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке сроков истечения наказаний: {e}")
+                return []
+        
+        rows = await asyncio.get_event_loop().run_in_executor(None, _get_expiring_sync)
+        for punishment_id, expiry_date in rows:
+            punishment_expiry_queue.schedule(punishment_id, expiry_date)
+        return len(rows)
+    
     async def get_active_punishments(self, chat_id: int, punishment_type: str = None) -> List[Dict[str, Any]]:
         """Получение активных наказаний в чате"""
         def _get_active_punishments_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     query = """
                         SELECT id, user_id, punishment_type, reason, 
                                duration_seconds, punishment_date, expiry_date,
@@ -237,7 +305,7 @@ class ModerationDatabase:
         """Очистка истекших наказаний"""
         def _cleanup_expired_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         UPDATE punishments 
                         SET is_active = 0 
@@ -257,7 +325,7 @@ class ModerationDatabase:
         """Автоматическая очистка старых записей (по умолчанию старше 6 месяцев)"""
         def _cleanup_old_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Вычисляем дату, старше которой удаляем записи
                     cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).isoformat()
                     
@@ -313,7 +381,7 @@ class ModerationDatabase:
         """Получить список банов за последние N дней по всем чатам."""
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute(
                         """
                         SELECT chat_id, user_id, reason, punishment_date, expiry_date, user_username, user_first_name, user_last_name
@@ -350,7 +418,7 @@ class ModerationDatabase:
         """Добавление варна пользователю"""
         def _add_warn_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO warns 
                         (chat_id, user_id, moderator_id, reason, warn_date,
@@ -372,7 +440,7 @@ class ModerationDatabase:
         """Удаление последнего варна пользователя"""
         def _remove_warn_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Находим последний активный варн
                     cursor = db.execute("""
                         SELECT id FROM warns 
@@ -400,7 +468,7 @@ class ModerationDatabase:
         """Получение истории варнов пользователя"""
         def _get_user_warns_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     query = """
                         SELECT id, reason, warn_date, is_active,
                                moderator_username, moderator_first_name, moderator_last_name
@@ -435,7 +503,7 @@ class ModerationDatabase:
         """Получение количества активных варнов пользователя"""
         def _get_user_warn_count_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT COUNT(*) FROM warns 
                         WHERE chat_id = ? AND user_id = ? AND is_active = 1
@@ -451,7 +519,7 @@ class ModerationDatabase:
         """Очистка всех варнов пользователя"""
         def _clear_user_warns_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         UPDATE warns SET is_active = 0 
                         WHERE chat_id = ? AND user_id = ? AND is_active = 1
@@ -467,43 +535,43 @@ class ModerationDatabase:
     async def get_warn_settings(self, chat_id: int) -> Dict[str, Any]:
         """Получение настроек варнов для чата"""
         def _get_warn_settings_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute("""
-                        SELECT warn_limit, punishment_type, mute_duration
-                        FROM warn_settings WHERE chat_id = ?
-                    """, (chat_id,))
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        return {
-                            'warn_limit': row[0],
-                            'punishment_type': row[1],
-                            'mute_duration': row[2]
-                        }
-                    else:
-                        # Возвращаем настройки по умолчанию
-                        return {
-                            'warn_limit': 3,
-                            'punishment_type': 'kick',
-                            'mute_duration': None
-                        }
-            except Exception as e:
-                logger.error(f"Ошибка при получении настроек варнов для чата {chat_id}: {e}")
-                return {
-                    'warn_limit': 3,
-                    'punishment_type': 'kick',
-                    'mute_duration': None
-                }
+            with get_connection(self.db_path) as db:
+                cursor = db.execute("""
+                    SELECT warn_limit, punishment_type, mute_duration
+                    FROM warn_settings WHERE chat_id = ?
+                """, (chat_id,))
+                row = cursor.fetchone()
+                
+                if row:
+                    return {
+                        'warn_limit': row[0],
+                        'punishment_type': row[1],
+                        'mute_duration': row[2]
+                    }
+                else:
+                    # Возвращаем настройки по умолчанию
+                    return {
+                        'warn_limit': 3,
+                        'punishment_type': 'kick',
+                        'mute_duration': None
+                    }
         
-        return await asyncio.get_event_loop().run_in_executor(None, _get_warn_settings_sync)
+        try:
+            return await settings_cache.get_or_load('warn_settings', chat_id, _get_warn_settings_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении настроек варнов для чата {chat_id}: {e}")
+            return {
+                'warn_limit': 3,
+                'punishment_type': 'kick',
+                'mute_duration': None
+            }
     
     async def update_warn_settings(self, chat_id: int, warn_limit: int = None, 
                                  punishment_type: str = None, mute_duration: int = None) -> bool:
         """Обновление настроек варнов для чата"""
         def _update_warn_settings_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Проверяем, есть ли уже настройки для этого чата
                     cursor = db.execute("SELECT chat_id FROM warn_settings WHERE chat_id = ?", (chat_id,))
                     exists = cursor.fetchone() is not None
@@ -543,7 +611,9 @@ class ModerationDatabase:
                 logger.error(f"Ошибка при обновлении настроек варнов для чата {chat_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _update_warn_settings_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _update_warn_settings_sync)
+        settings_cache.invalidate(chat_id, 'warn_settings')
+        return result
 
 
 # Глобальный экземпляр базы данных модерации
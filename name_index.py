@@ -0,0 +1,64 @@
+"""
+Индекс имен пользователей для поиска по имени в чате
+Для каждого пользователя хранятся нормализованные ключи: username, имя и «имя фамилия».
+Нормализация: NFKC, casefold, ё -> е и схлопывание пробелов, поэтому «Алиса», «АЛИСА»
+и «алиса » дают один ключ. Похожие по начертанию буквы разных алфавитов не сливаются:
+иначе «Вова» совпадал бы с «boba».
+Поиск - точное совпадение ключа по первичному индексу вместо LOWER(...) по всей таблице users.
+"""
+import unicodedata
+from typing import Optional, Set
+
+CREATE_TABLE_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS user_name_keys (
+        name_key TEXT,
+        user_id INTEGER,
+        PRIMARY KEY (name_key, user_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_user_name_keys_user ON user_name_keys (user_id)",
+)
+
+def normalize(text: Optional[str]) -> str:
+    """Нормализованный ключ строки (пустая строка, если ключа нет)"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return ' '.join(text.split())
+
+
+def name_keys(username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> Set[str]:
+    """Ключи пользователя: username, имя и «имя фамилия»"""
+    keys = {normalize(username), normalize(first_name)}
+    if first_name and last_name:
+        keys.add(normalize(f"{first_name} {last_name}"))
+    keys.discard('')
+    return keys
+
+
+def refresh_keys_sync(db, user_id: int, username: Optional[str],
+                      first_name: Optional[str], last_name: Optional[str]):
+    """Обновить ключи пользователя (запись только если имя изменилось)"""
+    keys = name_keys(username, first_name, last_name)
+    current = {
+        row[0] for row in db.execute("SELECT name_key FROM user_name_keys WHERE user_id = ?", (user_id,))
+    }
+    if current == keys:
+        return
+    db.execute("DELETE FROM user_name_keys WHERE user_id = ?", (user_id,))
+    db.executemany(
+        "INSERT OR IGNORE INTO user_name_keys (name_key, user_id) VALUES (?, ?)",
+        [(key, user_id) for key in keys]
+    )
+
+
+def rebuild_sync(db):
+    """Заполнить индекс имен по таблице users (для существующих баз)"""
+    db.execute("DELETE FROM user_name_keys")
+    rows = db.execute("SELECT user_id, username, first_name, last_name FROM users").fetchall()
+    db.executemany(
+        "INSERT OR IGNORE INTO user_name_keys (name_key, user_id) VALUES (?, ?)",
+        [(key, user_id) for user_id, username, first_name, last_name in rows
+         for key in name_keys(username, first_name, last_name)]
+    )
@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import os
 from pathlib import Path
+from db_pool import get_connection
+from migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,102 @@ try:
 except ImportError:
     BASE_PATH = Path(__file__).parent.absolute()
 
+
+def _schema_v1(db):
+    """Исходная схема: таблицы, колонки и индексы, которые раньше создавал init_db"""
+    # Проверяем, существует ли таблица с AUTOINCREMENT
+    cursor = db.execute("""
+        SELECT sql FROM sqlite_master 
+        WHERE type='table' AND name='chat_networks'
+    """)
+    table_sql = cursor.fetchone()
+
+    # Если таблица существует с AUTOINCREMENT, пересоздаем её
+    if table_sql and 'AUTOINCREMENT' in table_sql[0]:
+        logger.info("Миграция таблицы chat_networks для переиспользования ID...")
+
+        # Создаем временную таблицу
+        db.execute("""
+            CREATE TABLE chat_networks_new (
+                network_id INTEGER PRIMARY KEY,
+                owner_id INTEGER,
+                created_date TEXT
+            )
+        """)
+
+        # Копируем данные
+        db.execute("""
+            INSERT INTO chat_networks_new (network_id, owner_id, created_date)
+            SELECT network_id, owner_id, created_date FROM chat_networks
+        """)
+
+        # Удаляем старую таблицу
+        db.execute("DROP TABLE chat_networks")
+
+        # Переименовываем новую таблицу
+        db.execute("ALTER TABLE chat_networks_new RENAME TO chat_networks")
+
+        logger.info("Миграция завершена")
+
+    # Таблица сетей чатов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_networks (
+            network_id INTEGER PRIMARY KEY,
+            owner_id INTEGER,
+            created_date TEXT
+        )
+    """)
+
+    # Таблица чатов в сетях
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS network_chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            network_id INTEGER,
+            chat_id INTEGER,
+            joined_date TEXT,
+            is_primary BOOLEAN DEFAULT 0,
+            priority INTEGER DEFAULT 0,
+            FOREIGN KEY (network_id) REFERENCES chat_networks (network_id)
+        )
+    """)
+
+    # Проверяем, нужно ли добавить поле priority в network_chats (для старых баз данных)
+    try:
+        cursor = db.execute("PRAGMA table_info(network_chats)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'priority' not in columns:
+            logger.info("Добавление поля priority в таблицу network_chats...")
+            db.execute("ALTER TABLE network_chats ADD COLUMN priority INTEGER DEFAULT 0")
+            logger.info("Поле priority добавлено")
+    except sqlite3.OperationalError:
+        # Таблица еще не существует, но мы только что её создали выше, так что это не должно произойти
+        # Но на всякий случай игнорируем ошибку
+        pass
+
+    # Таблица кодов для связывания
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS network_codes (
+            code TEXT PRIMARY KEY,
+            network_id INTEGER,
+            code_type TEXT,
+            created_date TEXT,
+            expires_at TEXT,
+            used BOOLEAN DEFAULT 0,
+            FOREIGN KEY (network_id) REFERENCES chat_networks (network_id)
+        )
+    """)
+
+    # Создаем индексы для оптимизации
+    db.execute("CREATE INDEX IF NOT EXISTS idx_network_chats_network_id ON network_chats (network_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_network_chats_chat_id ON network_chats (chat_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_network_codes_expires ON network_codes (expires_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_network_codes_used ON network_codes (used)")
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
+
 class NetworkDatabase:
     """Класс для работы с базой данных сетей чатов"""
     
@@ -27,107 +125,14 @@ class NetworkDatabase:
         self.db_path = db_path
     
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        def _init_sync():
-            with sqlite3.connect(self.db_path) as db:
-                # Проверяем, существует ли таблица с AUTOINCREMENT
-                cursor = db.execute("""
-                    SELECT sql FROM sqlite_master 
-                    WHERE type='table' AND name='chat_networks'
-                """)
-                table_sql = cursor.fetchone()
-                
-                # Если таблица существует с AUTOINCREMENT, пересоздаем её
-                if table_sql and 'AUTOINCREMENT' in table_sql[0]:
-                    logger.info("Миграция таблицы chat_networks для переиспользования ID...")
-                    
-                    # Создаем временную таблицу
-                    db.execute("""
-                        CREATE TABLE chat_networks_new (
-                            network_id INTEGER PRIMARY KEY,
-                            owner_id INTEGER,
-                            created_date TEXT
-                        )
-                    """)
-                    
-                    # Копируем данные
-                    db.execute("""
-                        INSERT INTO chat_networks_new (network_id, owner_id, created_date)
-                        SELECT network_id, owner_id, created_date FROM chat_networks
-                    """)
-                    
-                    # Удаляем старую таблицу
-                    db.execute("DROP TABLE chat_networks")
-                    
-                    # Переименовываем новую таблицу
-                    db.execute("ALTER TABLE chat_networks_new RENAME TO chat_networks")
-                    
-                    logger.info("Миграция завершена")
-                
-                # Таблица сетей чатов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_networks (
-                        network_id INTEGER PRIMARY KEY,
-                        owner_id INTEGER,
-                        created_date TEXT
-                    )
-                """)
-                
-                # Таблица чатов в сетях
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS network_chats (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        network_id INTEGER,
-                        chat_id INTEGER,
-                        joined_date TEXT,
-                        is_primary BOOLEAN DEFAULT 0,
-                        priority INTEGER DEFAULT 0,
-                        FOREIGN KEY (network_id) REFERENCES chat_networks (network_id)
-                    )
-                """)
-                
-                # Проверяем, нужно ли добавить поле priority в network_chats (для старых баз данных)
-                try:
-                    cursor = db.execute("PRAGMA table_info(network_chats)")
-                    columns = [column[1] for column in cursor.fetchall()]
-                    if 'priority' not in columns:
-                        logger.info("Добавление поля priority в таблицу network_chats...")
-                        db.execute("ALTER TABLE network_chats ADD COLUMN priority INTEGER DEFAULT 0")
-                        logger.info("Поле priority добавлено")
-                except sqlite3.OperationalError:
-                    # Таблица еще не существует, но мы только что её создали выше, так что это не должно произойти
-                    # Но на всякий случай игнорируем ошибку
-                    pass
-                
-                # Таблица кодов для связывания
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS network_codes (
-                        code TEXT PRIMARY KEY,
-                        network_id INTEGER,
-                        code_type TEXT,
-                        created_date TEXT,
-                        expires_at TEXT,
-                        used BOOLEAN DEFAULT 0,
-                        FOREIGN KEY (network_id) REFERENCES chat_networks (network_id)
-                    )
-                """)
-                
-                # Создаем индексы для оптимизации
-                db.execute("CREATE INDEX IF NOT EXISTS idx_network_chats_network_id ON network_chats (network_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_network_chats_chat_id ON network_chats (chat_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_network_codes_expires ON network_codes (expires_at)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_network_codes_used ON network_codes (used)")
-                
-                db.commit()
-                logger.info("База данных сетей чатов инициализирована")
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        await run_migrations(self.db_path, "базы сетей чатов", SCHEMA_MIGRATIONS)
     
     async def create_network(self, owner_id: int) -> int:
         """Создание новой сети чатов"""
         def _create_network_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Получаем максимальный номер сетки
                     cursor = db.execute("SELECT MAX(network_id) FROM chat_networks")
                     max_id = cursor.fetchone()[0]
@@ -151,7 +156,7 @@ class NetworkDatabase:
         """Добавление чата в сеть"""
         def _add_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO network_chats (network_id, chat_id, joined_date, is_primary)
                         VALUES (?, ?, ?, ?)
@@ -168,7 +173,7 @@ class NetworkDatabase:
         """Удаление чата из сети"""
         def _remove_chat_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         DELETE FROM network_chats WHERE chat_id = ?
                     """, (chat_id,))
@@ -184,7 +189,7 @@ class NetworkDatabase:
         """Получение сети по ID чата"""
         def _get_network_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT cn.network_id, cn.owner_id, cn.created_date
                         FROM chat_networks cn
@@ -209,7 +214,7 @@ class NetworkDatabase:
         """Получение всех чатов в сети"""
         def _get_network_chats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT chat_id, joined_date, is_primary
                         FROM network_chats
@@ -235,7 +240,7 @@ class NetworkDatabase:
         """Получение всех сетей пользователя"""
         def _get_user_networks_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT network_id, created_date
                         FROM chat_networks
@@ -260,7 +265,7 @@ class NetworkDatabase:
         """Получение количества чатов в сети"""
         def _get_chat_count_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT COUNT(*) FROM network_chats WHERE network_id = ?
                     """, (network_id,))
@@ -275,7 +280,7 @@ class NetworkDatabase:
         """Удаление сети с переупорядочиванием номеров"""
         def _delete_network_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Получаем максимальный номер сетки
                     cursor = db.execute("SELECT MAX(network_id) FROM chat_networks")
                     max_id = cursor.fetchone()[0]
@@ -332,7 +337,7 @@ class NetworkDatabase:
         """Генерация кода для связывания чатов"""
         def _generate_code_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Очищаем истекшие коды
                     db.execute("""
                         DELETE FROM network_codes 
@@ -379,7 +384,7 @@ class NetworkDatabase:
         """Проверка кода (без пометки как использованный)"""
         def _validate_code_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT network_id, code_type, expires_at, used
                         FROM network_codes
@@ -419,7 +424,7 @@ class NetworkDatabase:
         """Пометка кода как использованного"""
         def _mark_used_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("UPDATE network_codes SET used = 1 WHERE code = ?", (code,))
                     db.commit()
                     return cursor.rowcount > 0
@@ -433,7 +438,7 @@ class NetworkDatabase:
         """Очистка истекших кодов"""
         def _cleanup_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         DELETE FROM network_codes 
                         WHERE expires_at < datetime('now')
@@ -450,7 +455,7 @@ class NetworkDatabase:
         """Проверка, находится ли чат в какой-либо сети"""
         def _check_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT 1 FROM network_chats WHERE chat_id = ?
                     """, (chat_id,))
@@ -465,7 +470,7 @@ class NetworkDatabase:
         """Установка приоритета чата в сети"""
         def _set_priority_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         UPDATE network_chats 
                         SET priority = ? 
@@ -483,7 +488,7 @@ class NetworkDatabase:
         """Получение чатов сети с сортировкой"""
         def _get_chats_sorted_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     if sort_by == 'priority':
                         # Сортировка по приоритету (больше = выше)
                         cursor = db.execute("""
@@ -525,7 +530,7 @@ class NetworkDatabase:
         """Получение владельца сети"""
         def _get_owner_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT owner_id FROM chat_networks WHERE network_id = ?
                     """, (network_id,))
@@ -541,7 +546,7 @@ class NetworkDatabase:
         """Удалить неактивные чаты из сетей"""
         def _cleanup_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     if not inactive_chat_ids:
                         return True
                     
@@ -6,20 +6,34 @@ import hashlib
 import re
 from datetime import datetime
 from typing import Dict, Any, Optional, List, Tuple
-from difflib import SequenceMatcher
 from aiogram.types import Message
 from aiogram import Bot
 from raid_protection_db import raid_protection_db
+from sliding_window import SlidingWindowStore
+from text_similarity import NearDuplicateDetector
+from content_sketch import CoordinatedContentDetector
+from member_cache import chat_member_cache
+from config import RAID_PROTECTION
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Ссылки в тексте: с протоколом, www. или t.me/
+_URL_PATTERN = re.compile(r'(?:https?://|www\.|t\.me/)\S+', re.IGNORECASE)
+
 
 class RaidProtection:
     """Класс для защиты от рейдов"""
     
     def __init__(self):
         self.bot: Optional[Bot] = None
+        # Окна активности по (chat_id, user_id, тип) - в БД пишутся только инциденты
+        self.activity = SlidingWindowStore()
+        # LSH-индексы недавних текстов по чатам для поиска почти одинаковых сообщений
+        self.near_duplicates = NearDuplicateDetector()
+        # Частоты контента для обнаружения рейдов с нескольких аккаунтов:
+        # по детектору на каждое окно coordinated_window из настроек чатов
+        self._coordinated: Dict[int, CoordinatedContentDetector] = {}
     
     def set_bot(self, bot: Bot):
         """Установить бота для отправки сообщений"""
@@ -40,6 +54,11 @@ class RaidProtection:
         if not settings.get('enabled', True):
             return False, None, None
         
+        # Один и тот же контент от многих пользователей (проверка не привязана к одному пользователю)
+        is_raid, raid_type, message_id = await self._check_coordinated_content(message, settings)
+        if is_raid:
+            return is_raid, raid_type, message_id
+        
         # Проверяем тип сообщения
         if message.animation:
             return await self._check_gif_spam(message, settings)
@@ -62,17 +81,14 @@ class RaidProtection:
         # Получаем хеш GIF-файла для отслеживания повторений
         gif_hash = await self._get_gif_hash(message)
         
-        # Добавляем запись о активности
-        await raid_protection_db.add_activity(chat_id, user_id, 'gif', gif_hash, message_id)
+        # Учитываем событие и получаем количество за окно
+        recent_count, _ = self.activity.add((chat_id, user_id, 'gif'), time_window, gif_hash)
         
-        # Проверяем недавнюю активность
-        recent_activity = await raid_protection_db.get_recent_activity(chat_id, user_id, 'gif', time_window)
-        
-        if len(recent_activity) >= limit:
+        if recent_count >= limit:
             # Обнаружен рейд GIF-спама
             await raid_protection_db.log_raid_incident(
                 chat_id, user_id, 'gif_spam',
-                f"Отправлено {len(recent_activity)} GIF за {time_window} секунд",
+                f"Отправлено {recent_count} GIF за {time_window} секунд",
                 message_id, "delete_message"
             )
             return True, 'gif_spam', message_id
@@ -91,17 +107,14 @@ class RaidProtection:
         # Получаем ID стикера для отслеживания
         sticker_id = message.sticker.file_unique_id if message.sticker else None
         
-        # Добавляем запись о активности
-        await raid_protection_db.add_activity(chat_id, user_id, 'sticker', sticker_id, message_id)
-        
-        # Проверяем недавнюю активность
-        recent_activity = await raid_protection_db.get_recent_activity(chat_id, user_id, 'sticker', time_window)
+        # Учитываем событие и получаем количество за окно
+        recent_count, _ = self.activity.add((chat_id, user_id, 'sticker'), time_window, sticker_id)
         
-        if len(recent_activity) >= limit:
+        if recent_count >= limit:
             # Обнаружен рейд стикер-спама
             await raid_protection_db.log_raid_incident(
                 chat_id, user_id, 'sticker_spam',
-                f"Отправлено {len(recent_activity)} стикеров за {time_window} секунд",
+                f"Отправлено {recent_count} стикеров за {time_window} секунд",
                 message_id, "delete_message"
             )
             return True, 'sticker_spam', message_id
@@ -122,19 +135,16 @@ class RaidProtection:
         normalized_text = self._normalize_text(message.text)
         text_hash = self._hash_text(normalized_text)
         
-        # Добавляем запись о активности
-        await raid_protection_db.add_activity(chat_id, user_id, 'text', text_hash, message_id)
+        # Учитываем сообщение: окно хранит число повторов каждого хеша
+        recent_count, similar_count = self.activity.add((chat_id, user_id, 'text'), time_window, text_hash)
         
-        # Получаем недавние текстовые сообщения
-        recent_activity = await raid_protection_db.get_recent_activity(chat_id, user_id, 'text', time_window)
+        # Почти одинаковые тексты (измененные на несколько символов) ищем через LSH-индекс
+        near_count = self.near_duplicates.check(
+            chat_id, user_id, normalized_text, time_window, similarity_threshold
+        )
+        similar_count = max(similar_count, near_count)
         
-        if len(recent_activity) >= limit:
-            # Проверяем похожесть текстов
-            similar_count = 0
-            for activity in recent_activity:
-                if activity['content_hash'] == text_hash:
-                    similar_count += 1
-            
+        if recent_count >= limit:
             # Если есть похожие сообщения, это рейд
             if similar_count >= limit:
                 await raid_protection_db.log_raid_incident(
@@ -146,6 +156,81 @@ class RaidProtection:
         
         return False, None, None
     
+    async def _check_coordinated_content(self, message: Message, settings: Dict[str, Any]) -> Tuple[bool, str, Optional[int]]:
+        """Проверить, не отправляют ли один и тот же контент разные пользователи"""
+        chat_id = message.chat.id
+        user_id = message.from_user.id
+        message_id = message.message_id
+        
+        limit = settings.get('coordinated_user_limit', RAID_PROTECTION['coordinated_user_limit'])
+        window = settings.get('coordinated_window', RAID_PROTECTION['coordinated_window'])
+        detector = self._coordinated_detector(window)
+        
+        for fingerprint in self._get_content_fingerprints(message, settings):
+            users_count = detector.add(chat_id, user_id, fingerprint)
+            if users_count >= limit:
+                await raid_protection_db.log_raid_incident(
+                    chat_id, user_id, 'coordinated_raid',
+                    f"Один и тот же контент ({fingerprint.split(':', 1)[0]}) отправили "
+                    f"{users_count} пользователей за {window} секунд",
+                    message_id, "delete_message"
+                )
+                return True, 'coordinated_raid', message_id
+        
+        return False, None, None
+    
+    def _coordinated_detector(self, window: int) -> CoordinatedContentDetector:
+        """Детектор одинакового контента с окном window секунд"""
+        detector = self._coordinated.get(window)
+        if detector is None:
+            detector = self._coordinated[window] = CoordinatedContentDetector(window)
+        return detector
+    
+    def _get_content_fingerprints(self, message: Message, settings: Dict[str, Any]) -> List[str]:
+        """
+        Отпечатки контента сообщения: нормализованный текст, а также анимация/стикер
+        и ссылки, если их сравнение включено в чате (популярные стикеры и ссылки
+        в активных чатах разные участники отправляют и без всякого рейда)
+        """
+        fingerprints = []
+        
+        if settings.get('coordinated_media', False):
+            if message.animation:
+                fingerprints.append(f"animation:{message.animation.file_unique_id}")
+            elif message.sticker:
+                fingerprints.append(f"sticker:{message.sticker.file_unique_id}")
+        
+        text = message.text or message.caption
+        if text:
+            # Короткие фразы ("привет", "+") естественно повторяются разными участниками
+            min_length = settings.get('coordinated_min_text_length', RAID_PROTECTION['coordinated_min_text_length'])
+            normalized_text = self._normalize_text(text)
+            if len(normalized_text) >= min_length:
+                fingerprints.append(f"text:{self._hash_text(normalized_text)}")
+            
+            if not settings.get('coordinated_links', False):
+                return fingerprints
+            
+            urls = set(self._extract_urls(text))
+            for entity in (message.entities or message.caption_entities or []):
+                if entity.type == 'text_link' and entity.url:
+                    urls.add(self._normalize_url(entity.url))
+            fingerprints.extend(f"url:{url}" for url in sorted(urls)[:5])
+        
+        return fingerprints
+    
+    def _extract_urls(self, text: str) -> List[str]:
+        """Найти ссылки в тексте"""
+        return [self._normalize_url(url) for url in _URL_PATTERN.findall(text)]
+    
+    def _normalize_url(self, url: str) -> str:
+        """Привести ссылку к виду для сравнения (без схемы, www и завершающих знаков)"""
+        url = url.lower().rstrip('.,!?;:)]}>\'"')
+        url = re.sub(r'^https?://', '', url)
+        if url.startswith('www.'):
+            url = url[4:]
+        return url.rstrip('/')
+    
     async def check_mass_join(self, chat_id: int, settings: Dict[str, Any]) -> Tuple[bool, List[Dict[str, Any]]]:
         """
         Проверить на массовое присоединение участников
@@ -255,7 +340,7 @@ class RaidProtection:
             
             # Проверяем, что владелец действительно является создателем чата
             try:
-                owner_member = await self.bot.get_chat_member(chat_id, owner_id)
+                owner_member = await chat_member_cache.get(chat_id, owner_id)
                 if owner_member.status != 'creator':
                     logger.warning(f"Пользователь {owner_id} не является создателем чата {chat_id}, уведомление не отправлено")
                     return False
@@ -310,7 +395,8 @@ class RaidProtection:
             'gif_spam': 'GIF спам',
             'sticker_spam': 'Стикер спам',
             'duplicate_text': 'Дублирующиеся сообщения',
-            'mass_join': 'Массовое присоединение'
+            'mass_join': 'Массовое присоединение',
+            'coordinated_raid': 'Одинаковый контент от разных пользователей'
         }
         return names.get(raid_type, raid_type)
 
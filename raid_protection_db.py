@@ -9,6 +9,9 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import os
 from pathlib import Path
+from db_pool import get_connection
+from migrations import run_migrations
+from settings_cache import settings_cache
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,133 @@ try:
 except ImportError:
     BASE_PATH = Path(__file__).parent.absolute()
 
+
+def _schema_v1(db):
+    """Исходная схема: таблицы, колонки и индексы, которые раньше создавал init_db"""
+    # Таблица настроек защиты от рейдов для каждого чата
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS raid_protection_settings (
+            chat_id INTEGER PRIMARY KEY,
+            enabled BOOLEAN DEFAULT 1,
+            gif_limit INTEGER DEFAULT 3,
+            gif_time_window INTEGER DEFAULT 5,
+            sticker_limit INTEGER DEFAULT 5,
+            sticker_time_window INTEGER DEFAULT 10,
+            duplicate_text_limit INTEGER DEFAULT 3,
+            duplicate_text_window INTEGER DEFAULT 30,
+            mass_join_limit INTEGER DEFAULT 10,
+            mass_join_window INTEGER DEFAULT 60,
+            similarity_threshold REAL DEFAULT 0.7,
+            notification_mode INTEGER DEFAULT 1
+        )
+    """)
+
+    # Добавляем колонку notification_mode если её нет
+    try:
+        db.execute("ALTER TABLE raid_protection_settings ADD COLUMN notification_mode INTEGER DEFAULT 1")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку last_notification_time если её нет
+    try:
+        db.execute("ALTER TABLE raid_protection_settings ADD COLUMN last_notification_time TEXT")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Добавляем колонку auto_mute_duration если её нет
+    try:
+        db.execute("ALTER TABLE raid_protection_settings ADD COLUMN auto_mute_duration INTEGER DEFAULT 0")
+        db.commit()
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+
+    # Таблица для отслеживания недавней активности пользователей
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS recent_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            activity_type TEXT,
+            content_hash TEXT,
+            timestamp TEXT,
+            message_id INTEGER
+        )
+    """)
+
+    # Таблица для отслеживания новых участников
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS recent_joins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            timestamp TEXT
+        )
+    """)
+
+    # Таблица для отслеживания удаленных сообщений (для подсчета количества атакующих пользователей)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS recent_deleted_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            incident_type TEXT,
+            timestamp TEXT
+        )
+    """)
+
+    # Таблица инцидентов рейдов
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS raid_incidents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            incident_type TEXT,
+            details TEXT,
+            message_id INTEGER,
+            timestamp TEXT,
+            action_taken TEXT
+        )
+    """)
+
+    # Создаем индексы для оптимизации
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_activity_chat_user ON recent_activity (chat_id, user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_activity_type ON recent_activity (activity_type)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_activity_timestamp ON recent_activity (timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_joins_chat ON recent_joins (chat_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_joins_timestamp ON recent_joins (timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_deleted_chat_timestamp ON recent_deleted_messages (chat_id, timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_raid_incidents_chat ON raid_incidents (chat_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_raid_incidents_timestamp ON raid_incidents (timestamp)")
+
+
+def _schema_v2(db):
+    """Настройки поиска одинакового контента от разных пользователей"""
+    # Пороги: NULL - значение из config.RAID_PROTECTION.
+    # Стикеры/GIF и ссылки сравниваются между пользователями только по явному включению
+    for column in ("coordinated_user_limit INTEGER",
+                   "coordinated_window INTEGER",
+                   "coordinated_min_text_length INTEGER",
+                   "coordinated_media BOOLEAN DEFAULT 0",
+                   "coordinated_links BOOLEAN DEFAULT 0"):
+        try:
+            db.execute(f"ALTER TABLE raid_protection_settings ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            # Колонка уже существует
+            pass
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1, _schema_v2)
+
+
 class RaidProtectionDatabase:
     """Класс для работы с базой данных защиты от рейдов"""
     
@@ -29,187 +159,84 @@ class RaidProtectionDatabase:
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        def _init_sync():
-            with sqlite3.connect(self.db_path) as db:
-                # Таблица настроек защиты от рейдов для каждого чата
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS raid_protection_settings (
-                        chat_id INTEGER PRIMARY KEY,
-                        enabled BOOLEAN DEFAULT 1,
-                        gif_limit INTEGER DEFAULT 3,
-                        gif_time_window INTEGER DEFAULT 5,
-                        sticker_limit INTEGER DEFAULT 5,
-                        sticker_time_window INTEGER DEFAULT 10,
-                        duplicate_text_limit INTEGER DEFAULT 3,
-                        duplicate_text_window INTEGER DEFAULT 30,
-                        mass_join_limit INTEGER DEFAULT 10,
-                        mass_join_window INTEGER DEFAULT 60,
-                        similarity_threshold REAL DEFAULT 0.7,
-                        notification_mode INTEGER DEFAULT 1
-                    )
-                """)
-                
-                # Добавляем колонку notification_mode если её нет
-                try:
-                    db.execute("ALTER TABLE raid_protection_settings ADD COLUMN notification_mode INTEGER DEFAULT 1")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку last_notification_time если её нет
-                try:
-                    db.execute("ALTER TABLE raid_protection_settings ADD COLUMN last_notification_time TEXT")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Добавляем колонку auto_mute_duration если её нет
-                try:
-                    db.execute("ALTER TABLE raid_protection_settings ADD COLUMN auto_mute_duration INTEGER DEFAULT 0")
-                    db.commit()
-                except sqlite3.OperationalError:
-                    # Колонка уже существует
-                    pass
-                
-                # Таблица для отслеживания недавней активности пользователей
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS recent_activity (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        activity_type TEXT,
-                        content_hash TEXT,
-                        timestamp TEXT,
-                        message_id INTEGER
-                    )
-                """)
-                
-                # Таблица для отслеживания новых участников
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS recent_joins (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        timestamp TEXT
-                    )
-                """)
-                
-                # Таблица для отслеживания удаленных сообщений (для подсчета количества атакующих пользователей)
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS recent_deleted_messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        incident_type TEXT,
-                        timestamp TEXT
-                    )
-                """)
-                
-                # Таблица инцидентов рейдов
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS raid_incidents (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        user_id INTEGER,
-                        incident_type TEXT,
-                        details TEXT,
-                        message_id INTEGER,
-                        timestamp TEXT,
-                        action_taken TEXT
-                    )
-                """)
-                
-                # Создаем индексы для оптимизации
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_activity_chat_user ON recent_activity (chat_id, user_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_activity_type ON recent_activity (activity_type)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_activity_timestamp ON recent_activity (timestamp)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_joins_chat ON recent_joins (chat_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_joins_timestamp ON recent_joins (timestamp)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_deleted_chat_timestamp ON recent_deleted_messages (chat_id, timestamp)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_raid_incidents_chat ON raid_incidents (chat_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_raid_incidents_timestamp ON raid_incidents (timestamp)")
-                
-                db.commit()
-                logger.info("База данных защиты от рейдов инициализирована")
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        await run_migrations(self.db_path, "базы защиты от рейдов", SCHEMA_MIGRATIONS)
+    
+    @staticmethod
+    def _default_settings() -> Dict[str, Any]:
+        """Настройки защиты от рейдов по умолчанию"""
+        from config import RAID_PROTECTION
+        return {
+            'enabled': True,
+            'gif_limit': RAID_PROTECTION['gif_limit'],
+            'gif_time_window': RAID_PROTECTION['gif_time_window'],
+            'sticker_limit': RAID_PROTECTION['sticker_limit'],
+            'sticker_time_window': RAID_PROTECTION['sticker_time_window'],
+            'duplicate_text_limit': RAID_PROTECTION['duplicate_text_limit'],
+            'duplicate_text_window': RAID_PROTECTION['duplicate_text_window'],
+            'mass_join_limit': RAID_PROTECTION['mass_join_limit'],
+            'mass_join_window': RAID_PROTECTION['mass_join_window'],
+            'similarity_threshold': RAID_PROTECTION['similarity_threshold'],
+            'notification_mode': 1,
+            'auto_mute_duration': 0,
+            'coordinated_user_limit': RAID_PROTECTION['coordinated_user_limit'],
+            'coordinated_window': RAID_PROTECTION['coordinated_window'],
+            'coordinated_min_text_length': RAID_PROTECTION['coordinated_min_text_length'],
+            'coordinated_media': False,
+            'coordinated_links': False
+        }
     
     async def get_settings(self, chat_id: int) -> Dict[str, Any]:
         """Получить настройки защиты от рейдов для чата"""
         def _get_sync():
-            try:
-                with sqlite3.connect(self.db_path) as db:
-                    cursor = db.execute("""
-                        SELECT enabled, gif_limit, gif_time_window, sticker_limit, sticker_time_window,
-                               duplicate_text_limit, duplicate_text_window, mass_join_limit, mass_join_window,
-                               similarity_threshold, notification_mode, auto_mute_duration
-                        FROM raid_protection_settings WHERE chat_id = ?
-                    """, (chat_id,))
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        return {
-                            'enabled': bool(row[0]),
-                            'gif_limit': row[1],
-                            'gif_time_window': row[2],
-                            'sticker_limit': row[3],
-                            'sticker_time_window': row[4],
-                            'duplicate_text_limit': row[5],
-                            'duplicate_text_window': row[6],
-                            'mass_join_limit': row[7],
-                            'mass_join_window': row[8],
-                            'similarity_threshold': row[9],
-                            'notification_mode': row[10] if len(row) > 10 else 1,
-                            'auto_mute_duration': row[11] if len(row) > 11 else 0
-                        }
-                    else:
-                        # Возвращаем настройки по умолчанию
-                        from config import RAID_PROTECTION
-                        return {
-                            'enabled': True,
-                            'gif_limit': RAID_PROTECTION['gif_limit'],
-                            'gif_time_window': RAID_PROTECTION['gif_time_window'],
-                            'sticker_limit': RAID_PROTECTION['sticker_limit'],
-                            'sticker_time_window': RAID_PROTECTION['sticker_time_window'],
-                            'duplicate_text_limit': RAID_PROTECTION['duplicate_text_limit'],
-                            'duplicate_text_window': RAID_PROTECTION['duplicate_text_window'],
-                            'mass_join_limit': RAID_PROTECTION['mass_join_limit'],
-                            'mass_join_window': RAID_PROTECTION['mass_join_window'],
-                            'similarity_threshold': RAID_PROTECTION['similarity_threshold'],
-                            'notification_mode': 1,
-                            'auto_mute_duration': 0
-                        }
-            except Exception as e:
-                logger.error(f"Ошибка при получении настроек защиты от рейдов для чата {chat_id}: {e}")
-                from config import RAID_PROTECTION
-                return {
-                    'enabled': True,
-                    'gif_limit': RAID_PROTECTION['gif_limit'],
-                    'gif_time_window': RAID_PROTECTION['gif_time_window'],
-                    'sticker_limit': RAID_PROTECTION['sticker_limit'],
-                    'sticker_time_window': RAID_PROTECTION['sticker_time_window'],
-                    'duplicate_text_limit': RAID_PROTECTION['duplicate_text_limit'],
-                    'duplicate_text_window': RAID_PROTECTION['duplicate_text_window'],
-                    'mass_join_limit': RAID_PROTECTION['mass_join_limit'],
-                    'mass_join_window': RAID_PROTECTION['mass_join_window'],
-                    'similarity_threshold': RAID_PROTECTION['similarity_threshold'],
-                    'notification_mode': 1,
-                    'auto_mute_duration': 0
-                }
+            with get_connection(self.db_path) as db:
+                cursor = db.execute("""
+                    SELECT enabled, gif_limit, gif_time_window, sticker_limit, sticker_time_window,
+                           duplicate_text_limit, duplicate_text_window, mass_join_limit, mass_join_window,
+                           similarity_threshold, notification_mode, auto_mute_duration,
+                           coordinated_user_limit, coordinated_window, coordinated_min_text_length,
+                           coordinated_media, coordinated_links
+                    FROM raid_protection_settings WHERE chat_id = ?
+                """, (chat_id,))
+                row = cursor.fetchone()
+                
+                if row:
+                    defaults = self._default_settings()
+                    return {
+                        'enabled': bool(row[0]),
+                        'gif_limit': row[1],
+                        'gif_time_window': row[2],
+                        'sticker_limit': row[3],
+                        'sticker_time_window': row[4],
+                        'duplicate_text_limit': row[5],
+                        'duplicate_text_window': row[6],
+                        'mass_join_limit': row[7],
+                        'mass_join_window': row[8],
+                        'similarity_threshold': row[9],
+                        'notification_mode': row[10] if len(row) > 10 else 1,
+                        'auto_mute_duration': row[11] if len(row) > 11 else 0,
+                        'coordinated_user_limit': row[12] if row[12] is not None else defaults['coordinated_user_limit'],
+                        'coordinated_window': row[13] if row[13] is not None else defaults['coordinated_window'],
+                        'coordinated_min_text_length': (
+                            row[14] if row[14] is not None else defaults['coordinated_min_text_length']
+                        ),
+                        'coordinated_media': bool(row[15]),
+                        'coordinated_links': bool(row[16])
+                    }
+                # Возвращаем настройки по умолчанию
+                return self._default_settings()
         
-        return await asyncio.get_event_loop().run_in_executor(None, _get_sync)
+        try:
+            return await settings_cache.get_or_load('raid_settings', chat_id, _get_sync)
+        except Exception as e:
+            logger.error(f"Ошибка при получении настроек защиты от рейдов для чата {chat_id}: {e}")
+            return self._default_settings()
     
     async def update_setting(self, chat_id: int, setting_name: str, value: Any) -> bool:
         """Обновить настройку защиты от рейдов для чата"""
         def _update_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Конвертируем bool в int если нужно
                     db_value = value
                     if isinstance(value, bool):
@@ -219,16 +246,12 @@ class RaidProtectionDatabase:
                     cursor = db.execute("SELECT chat_id FROM raid_protection_settings WHERE chat_id = ?", (chat_id,))
                     exists = cursor.fetchone() is not None
                     
-                    if exists:
-                        # Обновляем существующие настройки
-                        db.execute(f"UPDATE raid_protection_settings SET {setting_name} = ? WHERE chat_id = ?", 
-                                  (db_value, chat_id))
-                    else:
-                        # Создаем новые настройки
+                    if not exists:
+                        # Создаем настройки по умолчанию; нужная настройка записывается ниже,
+                        # поэтому так можно менять и колонки, не перечисленные в INSERT
                         from config import RAID_PROTECTION
                         defaults = RAID_PROTECTION.copy()
                         defaults['chat_id'] = chat_id
-                        defaults[setting_name] = db_value
                         
                         db.execute("""
                             INSERT INTO raid_protection_settings 
@@ -251,20 +274,25 @@ class RaidProtectionDatabase:
                             defaults.get('notification_mode', 1)
                         ))
                     
+                    db.execute(f"UPDATE raid_protection_settings SET {setting_name} = ? WHERE chat_id = ?", 
+                              (db_value, chat_id))
+                    
                     db.commit()
                     return True
             except Exception as e:
                 logger.error(f"Ошибка при обновлении настройки {setting_name} для чата {chat_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _update_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _update_sync)
+        settings_cache.invalidate(chat_id, 'raid_settings')
+        return result
     
     async def add_activity(self, chat_id: int, user_id: int, activity_type: str, content_hash: str = None, 
                           message_id: int = None) -> bool:
         """Добавить запись о активности пользователя"""
         def _add_activity_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO recent_activity 
                         (chat_id, user_id, activity_type, content_hash, timestamp, message_id)
@@ -284,7 +312,7 @@ class RaidProtectionDatabase:
         def _get_recent_sync():
             try:
                 cutoff_time = (datetime.now() - timedelta(seconds=time_window_seconds)).isoformat()
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT id, content_hash, timestamp, message_id
                         FROM recent_activity
@@ -313,7 +341,7 @@ class RaidProtectionDatabase:
         """Добавить запись о недавнем присоединении"""
         def _add_join_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO recent_joins 
                         (chat_id, user_id, username, first_name, last_name, timestamp)
@@ -332,7 +360,7 @@ class RaidProtectionDatabase:
         def _get_joins_sync():
             try:
                 cutoff_time = (datetime.now() - timedelta(seconds=time_window_seconds)).isoformat()
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT id, user_id, username, first_name, last_name, timestamp
                         FROM recent_joins
@@ -363,7 +391,7 @@ class RaidProtectionDatabase:
         """Записать инцидент рейда"""
         def _log_incident_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO raid_incidents 
                         (chat_id, user_id, incident_type, details, message_id, timestamp, action_taken)
@@ -382,7 +410,7 @@ class RaidProtectionDatabase:
         def _cleanup_sync():
             try:
                 cutoff_time = (datetime.now() - timedelta(days=days_to_keep)).isoformat()
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         DELETE FROM recent_activity WHERE timestamp < ?
                     """, (cutoff_time,))
@@ -402,7 +430,7 @@ class RaidProtectionDatabase:
         def _cleanup_sync():
             try:
                 cutoff_time = (datetime.now() - timedelta(hours=hours_to_keep)).isoformat()
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         DELETE FROM recent_joins WHERE timestamp < ?
                     """, (cutoff_time,))
@@ -421,7 +449,7 @@ class RaidProtectionDatabase:
         """Добавить запись об удаленном сообщении"""
         def _add_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO recent_deleted_messages 
                         (chat_id, user_id, incident_type, timestamp)
@@ -440,7 +468,7 @@ class RaidProtectionDatabase:
         def _get_sync():
             try:
                 cutoff_time = (datetime.now() - timedelta(minutes=minutes)).isoformat()
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT COUNT(DISTINCT user_id)
                         FROM recent_deleted_messages
@@ -459,7 +487,7 @@ class RaidProtectionDatabase:
         def _cleanup_sync():
             try:
                 cutoff_time = (datetime.now() - timedelta(minutes=minutes_to_keep)).isoformat()
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         DELETE FROM recent_deleted_messages WHERE timestamp < ?
                     """, (cutoff_time,))
@@ -478,7 +506,7 @@ class RaidProtectionDatabase:
         """Получить время последнего уведомления о рейде для чата"""
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT last_notification_time 
                         FROM raid_protection_settings 
@@ -496,7 +524,7 @@ class RaidProtectionDatabase:
         """Обновить время последнего уведомления о рейде"""
         def _update_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Проверяем, существуют ли настройки для этого чата
                     cursor = db.execute("SELECT chat_id FROM raid_protection_settings WHERE chat_id = ?", (chat_id,))
                     exists = cursor.fetchone() is not None
@@ -528,7 +556,10 @@ class RaidProtectionDatabase:
                 logger.error(f"Ошибка при обновлении времени последнего уведомления: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _update_sync)
+        result = await asyncio.get_event_loop().run_in_executor(None, _update_sync)
+        # При отсутствии настроек создается строка со своими значениями по умолчанию
+        settings_cache.invalidate(chat_id, 'raid_settings')
+        return result
 
 
 # Глобальный экземпляр базы данных защиты от рейдов
@@ -0,0 +1,228 @@
+"""
+Кэш готовых изображений (графики /top, /topall, /myprofile)
+Ключ - SHA-256 от функции рендеринга и ее аргументов (список пользователей со счетчиками,
+заголовки, плитки аватарок), поэтому изображение по неизменным данным не рисуется заново.
+Изображение хранится в памяти (LRU в пределах RENDER_CACHE_MEMORY_BYTES) и на диске
+(RENDER_CACHE_DIR, в пределах RENDER_CACHE_DISK_BYTES, вытесняются давно не нужные).
+После первой отправки запоминается file_id фото (<ключ>.fid рядом с <ключ>.img):
+повторное изображение отправляется по нему без загрузки файла.
+Используется только из цикла событий asyncio.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from render_service import render_service
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import RENDER_CACHE_DIR, RENDER_CACHE_MEMORY_BYTES, RENDER_CACHE_DISK_BYTES
+except ImportError:
+    RENDER_CACHE_DIR = os.path.join('data', 'render_cache')
+    RENDER_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+    RENDER_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+
+class RenderedImage(NamedTuple):
+    """Изображение из кэша или после рендеринга"""
+    key: str
+    data: Optional[bytes]  # None, если изображение уже отправлялось и есть file_id
+    file_id: Optional[str]
+
+
+class RenderCache:
+    """Кэш изображений по ключу содержимого с file_id отправленных фото"""
+
+    def __init__(self, directory: str = RENDER_CACHE_DIR, memory_bytes: int = RENDER_CACHE_MEMORY_BYTES,
+                 disk_bytes: int = RENDER_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        # Файлы на диске от давно не нужных к недавним: ключ -> [размер файла, file_id]
+        self._disk: Optional["OrderedDict[str, list]"] = None
+        self._disk_used = 0
+        self._loading: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def key(func: Callable[..., Any], *args) -> str:
+        """Ключ изображения: хэш функции рендеринга и ее аргументов"""
+        payload = pickle.dumps((func.__module__, func.__qualname__, args), protocol=4)
+        return hashlib.sha256(payload).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    # Дисковый уровень (выполняется в пуле потоков)
+
+    def _scan_sync(self) -> List[tuple]:
+        """Файлы кэша на диске: [(ключ, размер, file_id)] по возрастанию времени последнего использования"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.name.endswith('.img'):
+                    continue
+                key = item.name[:-4]
+                stat = item.stat()
+                file_id = None
+                try:
+                    with open(self._path(key, '.fid'), encoding='utf-8') as f:
+                        file_id = f.read().strip() or None
+                except OSError:
+                    pass
+                entries.append((stat.st_mtime, key, stat.st_size, file_id))
+        entries.sort()
+        return [entry[1:] for entry in entries]
+
+    def _read_sync(self, key: str) -> Optional[bytes]:
+        try:
+            path = self._path(key, '.img')
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError as e:
+            logger.debug(f"Не удалось прочитать изображение {key} из кэша: {e}")
+            return None
+
+    def _write_sync(self, key: str, data: bytes, evicted: List[str]):
+        try:
+            path = self._path(key, '.img')
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.debug(f"Не удалось сохранить изображение {key} в кэш: {e}")
+        self._remove_sync(evicted)
+
+    def _remove_sync(self, keys: List[str]):
+        for key in keys:
+            for suffix in ('.img', '.fid'):
+                try:
+                    os.remove(self._path(key, suffix))
+                except OSError:
+                    pass
+
+    def _write_file_id_sync(self, key: str, file_id: Optional[str]):
+        try:
+            if file_id is None:
+                os.remove(self._path(key, '.fid'))
+            else:
+                with open(self._path(key, '.fid'), 'w', encoding='utf-8') as f:
+                    f.write(file_id)
+        except OSError as e:
+            logger.debug(f"Не удалось сохранить file_id изображения {key}: {e}")
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    async def init(self):
+        """Прочитать список файлов кэша на диске (при первом обращении, если не вызван при запуске)"""
+        if self._disk is not None:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load_index())
+        await asyncio.shield(self._loading)
+
+    async def _load_index(self):
+        disk: "OrderedDict[str, list]" = OrderedDict()
+        try:
+            for key, size, file_id in await self._run(self._scan_sync):
+                disk[key] = [size, file_id]
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша изображений: {e}")
+        self._disk = disk
+        self._disk_used = sum(entry[0] for entry in disk.values())
+        logger.info(f"Кэш изображений: {len(disk)} файлов, {self._disk_used / 1024 / 1024:.1f} МБ")
+
+    # Память
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous)
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    # Использование
+
+    async def render(self, func: Callable[..., Any], *args) -> RenderedImage:
+        """
+        Изображение по аргументам: file_id или байты из кэша, иначе рендеринг в пуле процессов.
+        Функция рендеринга должна возвращать BytesIO; RenderUnavailable пробрасывается.
+        """
+        await self.init()
+        key = self.key(func, *args)
+
+        entry = self._disk.get(key)
+        if entry is not None:
+            self._disk.move_to_end(key)
+            if entry[1] is not None:
+                return RenderedImage(key, None, entry[1])
+
+        data = await self.load(key)
+        if data is not None:
+            return RenderedImage(key, data, None)
+
+        data = (await render_service.render(func, *args)).getvalue()
+        self._remember(key, data)
+        await self._store(key, data)
+        return RenderedImage(key, data, None)
+
+    async def load(self, key: str) -> Optional[bytes]:
+        """Байты изображения из памяти или с диска (None, если изображения нет в кэше)"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            return data
+        if self._disk is None or key not in self._disk:
+            return None
+        data = await self._run(self._read_sync, key)
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    async def _store(self, key: str, data: bytes):
+        previous = self._disk.pop(key, None)
+        if previous is not None:
+            self._disk_used -= previous[0]
+        self._disk[key] = [len(data), None]
+        self._disk_used += len(data)
+        evicted = []
+        while self._disk_used > self.disk_bytes and len(self._disk) > 1:
+            evicted_key, (size, _) = self._disk.popitem(last=False)
+            self._disk_used -= size
+            evicted.append(evicted_key)
+        await self._run(self._write_sync, key, data, evicted)
+
+    async def remember_file_id(self, key: str, file_id: str):
+        """Запомнить file_id фото после первой отправки"""
+        entry = self._disk.get(key) if self._disk is not None else None
+        if entry is None:
+            return
+        entry[1] = file_id
+        await self._run(self._write_file_id_sync, key, file_id)
+
+    async def forget_file_id(self, key: str):
+        """Удалить file_id (Telegram больше не принимает его)"""
+        entry = self._disk.get(key) if self._disk is not None else None
+        if entry is None or entry[1] is None:
+            return
+        entry[1] = None
+        await self._run(self._write_file_id_sync, key, None)
+
+
+# Глобальный кэш изображений
+render_cache = RenderCache()
@@ -0,0 +1,120 @@
+"""
+Сервис рендеринга изображений в пуле процессов
+Pillow-рисование (графики /top, /myprofile) выполняется вне цикла событий,
+поэтому одно тяжелое изображение не задерживает обработку остальных обновлений.
+Функции и аргументы должны сериализоваться pickle (аватарки передаются как bytes).
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import RENDER_WORKERS, RENDER_QUEUE_LIMIT, RENDER_TIMEOUT
+except ImportError:
+    RENDER_WORKERS = 2
+    RENDER_QUEUE_LIMIT = 8
+    RENDER_TIMEOUT = 20
+
+
+class RenderUnavailable(Exception):
+    """Изображение не построено: очередь переполнена, истек таймаут или пул недоступен"""
+
+
+class RenderService:
+    """Ограниченный пул процессов для рендеринга изображений"""
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_limit: int = RENDER_QUEUE_LIMIT,
+                 timeout: float = RENDER_TIMEOUT):
+        self.workers = max(1, workers)
+        self.queue_limit = max(1, queue_limit)
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Пул уже создавался: пересоздание идет при работающих потоках и соединениях с БД
+        self._restarted = False
+        # Задачи, отправленные в пул и еще не завершенные (включая отмененные по таймауту)
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Количество задач в работе и в очереди"""
+        return self._in_flight
+
+    def _start_method(self) -> str:
+        """
+        fork - только для первого пула и там, где он есть: при spawn каждый процесс
+        заново импортировал бы bot.py целиком. Все процессы пула создаются сразу при первой
+        задаче, поэтому start() вызывается при запуске бота, до появления потоков и соединений
+        с БД. Пул, пересоздаваемый после сбоя, и платформы без fork (Windows) используют spawn.
+        """
+        if not self._restarted and 'fork' in multiprocessing.get_all_start_methods():
+            return 'fork'
+        return 'spawn'
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Пул процессов (создается при первом обращении); ошибки создания - RenderUnavailable"""
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self._start_method())
+                )
+            except Exception as e:
+                raise RenderUnavailable(f"не удалось создать пул рендеринга: {e}") from e
+            self._restarted = True
+        return self._executor
+
+    async def start(self):
+        """Создать процессы пула заранее"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._get_executor(), int)
+            logger.info(f"Пул рендеринга запущен ({self.workers} процессов)")
+        except Exception as e:
+            logger.error(f"Ошибка при запуске пула рендеринга: {e}")
+            self.shutdown()
+
+    def _task_done(self, _future):
+        self._in_flight -= 1
+
+    async def render(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Выполнить функцию рендеринга в пуле процессов.
+        Бросает RenderUnavailable, если очередь заполнена или рендеринг не уложился в таймаут.
+        """
+        if self._in_flight >= self.queue_limit:
+            raise RenderUnavailable(f"очередь рендеринга заполнена ({self._in_flight})")
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._get_executor(), func, *args)
+        except RenderUnavailable:
+            raise
+        except Exception as e:
+            # BrokenProcessPool, ошибки запуска процессов (OSError, RuntimeError)
+            self.shutdown()
+            raise RenderUnavailable(f"пул рендеринга недоступен: {e}") from e
+
+        self._in_flight += 1
+        future.add_done_callback(self._task_done)
+        try:
+            # shield: по таймауту задача досчитается в пуле и освободит место в очереди сама
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError as e:
+            raise RenderUnavailable(f"рендеринг {func.__name__} превысил {self.timeout} с") from e
+        except BrokenProcessPool as e:
+            self.shutdown()
+            raise RenderUnavailable(f"пул рендеринга недоступен: {e}") from e
+
+    def shutdown(self):
+        """Остановить пул процессов (следующий render создаст новый)"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Глобальный сервис рендеринга
+render_service = RenderService()
@@ -9,6 +9,9 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import os
 from pathlib import Path
+from db_pool import get_connection
+from migrations import run_migrations
+from bulk_purge import stage_ids, STAGED_IDS
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,39 @@ try:
 except ImportError:
     BASE_PATH = Path(__file__).parent.absolute()
 
+
+def _schema_v1(db):
+    """Исходная схема: таблицы, колонки и индексы, которые раньше создавал init_db"""
+    # Таблица репутации пользователей
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_reputation (
+            user_id INTEGER PRIMARY KEY,
+            reputation INTEGER DEFAULT 100,
+            last_updated TEXT
+        )
+    """)
+
+    # Таблица недавних наказаний (за последние 3 дня)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS recent_punishments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            punishment_type TEXT,
+            punishment_date TEXT,
+            duration_seconds INTEGER
+        )
+    """)
+
+    # Создаем индексы для оптимизации
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reputation_user ON user_reputation (user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_punishments_user ON recent_punishments (user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recent_punishments_date ON recent_punishments (punishment_date)")
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
+
 class ReputationDatabase:
     """Класс для работы с базой данных репутации"""
     
@@ -27,44 +63,14 @@ class ReputationDatabase:
         self.db_path = db_path
     
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        def _init_sync():
-            with sqlite3.connect(self.db_path) as db:
-                # Таблица репутации пользователей
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS user_reputation (
-                        user_id INTEGER PRIMARY KEY,
-                        reputation INTEGER DEFAULT 100,
-                        last_updated TEXT
-                    )
-                """)
-                
-                # Таблица недавних наказаний (за последние 3 дня)
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS recent_punishments (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        punishment_type TEXT,
-                        punishment_date TEXT,
-                        duration_seconds INTEGER
-                    )
-                """)
-                
-                # Создаем индексы для оптимизации
-                db.execute("CREATE INDEX IF NOT EXISTS idx_reputation_user ON user_reputation (user_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_punishments_user ON recent_punishments (user_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_recent_punishments_date ON recent_punishments (punishment_date)")
-                
-                db.commit()
-                logger.info("База данных репутации инициализирована")
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        await run_migrations(self.db_path, "базы репутации", SCHEMA_MIGRATIONS)
     
     async def get_user_reputation(self, user_id: int) -> int:
         """Получить текущий рейтинг пользователя (по умолчанию 100)"""
         def _get_reputation_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT reputation FROM user_reputation WHERE user_id = ?
                     """, (user_id,))
@@ -80,7 +86,7 @@ class ReputationDatabase:
         """Изменить рейтинг пользователя (с ограничением 0-100)"""
         def _update_reputation_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Получаем текущий рейтинг
                     cursor = db.execute("""
                         SELECT reputation FROM user_reputation WHERE user_id = ?
@@ -110,7 +116,7 @@ class ReputationDatabase:
         """Добавить недавнее наказание"""
         def _add_punishment_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT INTO recent_punishments 
                         (user_id, punishment_type, punishment_date, duration_seconds)
@@ -129,7 +135,7 @@ class ReputationDatabase:
         """Получить наказания за последние N дней"""
         def _get_punishments_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
                     
                     cursor = db.execute("""
@@ -158,7 +164,7 @@ class ReputationDatabase:
         """Получить статистику наказаний за последние N дней"""
         def _get_stats_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
                     
                     cursor = db.execute("""
@@ -190,7 +196,7 @@ class ReputationDatabase:
         """Удалить наказания старше N дней"""
         def _cleanup_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
                     
                     cursor = db.execute("""
@@ -246,7 +252,7 @@ class ReputationDatabase:
         """Получить всех пользователей с репутацией (для восстановления)"""
         def _get_all_users_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cursor = db.execute("""
                         SELECT user_id, reputation FROM user_reputation
                         WHERE reputation < 100
@@ -270,7 +276,7 @@ class ReputationDatabase:
         """Удалить репутацию и наказания пользователя"""
         def _delete_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     # Удаляем из recent_punishments (все записи пользователя)
                     db.execute("DELETE FROM recent_punishments WHERE user_id = ?", (user_id,))
                     
@@ -285,6 +291,21 @@ class ReputationDatabase:
                 return False
         
         return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
+    
+    async def delete_users_bulk(self, user_ids: List[int]) -> bool:
+        """Удалить репутацию и наказания порции пользователей одной транзакцией"""
+        def _delete_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    stage_ids(db, user_ids)
+                    db.execute(f"DELETE FROM recent_punishments WHERE user_id IN {STAGED_IDS}")
+                    db.execute(f"DELETE FROM user_reputation WHERE user_id IN {STAGED_IDS}")
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка при пакетном удалении репутации: {e}")
+                return False
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
 
 
 # Глобальный экземпляр базы данных репутации
@@ -3,16 +3,30 @@
 """
 import asyncio
 import logging
-import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 
 from database import db
 from moderation_db import moderation_db
 from reputation_db import reputation_db
 from network_db import network_db
-from config import DEBUG
+from expiry_queue import punishment_expiry_queue
+from member_cache import chat_member_cache
+from top_chats_leaderboard import top_chats_leaderboard
+from config import DEBUG, STATS_FLUSH_INTERVAL_MS, TOP_CHATS_REFRESH_INTERVAL
 logger = logging.getLogger(__name__)
 
+# Как часто очередь сроков истечения наказаний сверяется с БД (секунды)
+PUNISHMENT_QUEUE_RESYNC_INTERVAL = 3600
+# Через сколько секунд повторить снятие наказания, если бот не администратор чата
+PUNISHMENT_RELEASE_RETRY_DELAY = 300
+
+
+def _is_chat_gone(error: Exception) -> bool:
+    """Ошибка API означает, что чата больше нет или бота из него удалили"""
+    error_str = str(error).lower()
+    return "chat not found" in error_str or "bot was kicked" in error_str
+
 
 # Lazy import для raid_protection_db, чтобы избежать циклических импортов
 def get_raid_protection_db():
@@ -41,15 +55,16 @@ class TaskScheduler:
             asyncio.create_task(self.cleanup_duplicates_task()),
             asyncio.create_task(self.cleanup_old_stats_task()),
             asyncio.create_task(self.update_chat_info_task()),
-            asyncio.create_task(self.mute_expiry_task()),  # Новая задача для проверки истечения мутов
-            asyncio.create_task(self.ban_expiry_task()),  # Новая задача для проверки истечения банов
+            asyncio.create_task(self.punishment_expiry_task()),  # Снятие истекших мутов и банов по очереди сроков
             asyncio.create_task(self.cleanup_old_moderation_records_task()),  # Очистка старых записей модерации
             asyncio.create_task(self.reputation_recovery_task()),  # Восстановление репутации
             asyncio.create_task(self.cleanup_old_punishments_task()),  # Очистка старых наказаний
             asyncio.create_task(self.cleanup_expired_network_codes_task()),  # Очистка истекших кодов сетки
             asyncio.create_task(self.cleanup_expired_votes_task()),  # Очистка истекших голосований
             asyncio.create_task(self.cleanup_raid_protection_task()),  # Очистка старых записей защиты от рейдов
-            asyncio.create_task(self.cleanup_inactive_task())  # Очистка неактивных пользователей и чатов
+            asyncio.create_task(self.cleanup_inactive_task()),  # Очистка неактивных пользователей и чатов
+            asyncio.create_task(self.flush_stats_counters_task()),  # Сброс буфера счетчиков сообщений
+            asyncio.create_task(self.refresh_top_chats_task())  # Пересчет снимка топа чатов
         ]
         
         # Ждем завершения всех задач
@@ -76,6 +91,26 @@ class TaskScheduler:
         
         logger.info("Планировщик задач остановлен")
     
+    async def flush_stats_counters_task(self):
+        """Задача сброса буфера счетчиков сообщений каждые STATS_FLUSH_INTERVAL_MS мс"""
+        interval = STATS_FLUSH_INTERVAL_MS / 1000
+        while self.running:
+            await asyncio.sleep(interval)
+            try:
+                await db.flush_counters()
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе буфера счетчиков сообщений: {e}")
+    
+    async def refresh_top_chats_task(self):
+        """Задача пересчета снимка топа чатов каждые TOP_CHATS_REFRESH_INTERVAL секунд"""
+        while self.running:
+            try:
+                await top_chats_leaderboard.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении топа чатов: {e}")
+            
+            await asyncio.sleep(TOP_CHATS_REFRESH_INTERVAL)
+    
     async def cleanup_duplicates_task(self):
         """Задача очистки дубликатов чатов каждые 5 минут"""
         while self.running:
@@ -94,6 +129,7 @@ class TaskScheduler:
             try:
                 await db.cleanup_old_stats(7)
                 await db.cleanup_old_user_stats(7)
+                await db.cleanup_old_rollups()
                 logger.info("Автоматическая очистка старых записей выполнена")
             except Exception as e:
                 logger.error(f"Ошибка при автоматической очистке старых записей: {e}")
@@ -135,412 +171,278 @@ class TaskScheduler:
             # Ждем 1 минуту
             await asyncio.sleep(60)
     
-    async def mute_expiry_task(self):
-        """Задача проверки истечения мутов - сканирует каждые 10 сек если есть активные муты"""
-        # Множество для отслеживания уже обработанных мутов (ID -> timestamp последней обработки)
-        # Используем словарь на уровне класса задачи для отслеживания между итерациями
-        if not hasattr(self, '_recently_processed_mutes'):
-            self._recently_processed_mutes = {}
+    async def punishment_expiry_task(self):
+        """Задача снятия истекших мутов и банов - спит до ближайшего срока из очереди"""
+        logger.info("Запущена задача снятия истекших мутов и банов")
         
         while self.running:
             try:
-                # Очищаем старые записи (старше 60 секунд)
-                current_time = time.time()
-                self._recently_processed_mutes = {
-                    mute_id: ts for mute_id, ts in self._recently_processed_mutes.items() 
-                    if current_time - ts < 60
-                }
-                
-                # Проверяем, есть ли активные муты во всех чатах
-                has_active_mutes = False
-                total_active_mutes = 0
-                
-                # Получаем все активные чаты
-                chats = await db.get_all_chats_for_update()
-                logger.debug(f"Проверяем муты в {len(chats)} чатах")
-                
-                # Функция для обработки одного чата
-                async def process_chat_mutes(chat, recently_processed_ref, current_time_ref):
-                    async with self.chat_semaphore:
-                        try:
-                            # Проверяем права администратора
-                            import bot
-                            try:
-                                bot_member = await bot.bot.get_chat_member(chat['chat_id'], bot.bot.id)
-                            except Exception as e:
-                                error_str = str(e).lower()
-                                # Обрабатываем ошибки "chat not found" - деактивируем чат и пропускаем
-                                if "chat not found" in error_str or "chat not found" in error_str or "bad request" in error_str:
-                                    logger.info(f"Чат {chat['chat_id']} не найден, деактивируем его")
-                                    try:
-                                        await db.deactivate_chat(chat['chat_id'])
-                                    except Exception:
-                                        pass  # Игнорируем ошибки деактивации
-                                    return 0
-                                raise  # Перебрасываем другие ошибки
-                            
-                            if bot_member.status not in ['administrator', 'creator']:
-                                return 0
-                            
-                            # Получаем активные муты в этом чате
-                            active_mutes = await moderation_db.get_active_punishments(chat['chat_id'], "mute")
-                            
-                            if not active_mutes:
-                                return 0
-                            
-                            must_active_count = len(active_mutes)
-                            logger.debug(f"В чате {chat['chat_id']} найдено {must_active_count} активных мутов")
-                            
-                            expired_count = 0
-                            
-                            for mute in active_mutes:
-                                try:
-                                    mute_id = mute['id']
-                                    
-                                    # Проверяем, не обрабатывали ли мы этот мут недавно (защита от спама)
-                                    if mute_id in recently_processed_ref:
-                                        time_since_processed = current_time_ref - recently_processed_ref[mute_id]
-                                        if time_since_processed < 30:  # Если обрабатывали менее 30 секунд назад - пропускаем
-                                            logger.debug(f"Мут {mute_id} был обработан {time_since_processed:.1f} сек назад, пропускаем")
-                                            continue
-                                    
-                                    # Проверяем, истек ли мут
-                                    if mute['expiry_date']:
-                                        expiry_date = datetime.fromisoformat(mute['expiry_date'])
-                                        # Используем UTC для сравнения
-                                        now = datetime.now(expiry_date.tzinfo) if expiry_date.tzinfo else datetime.now()
-                                        
-                                        # Логируем для отладки
-                                        logger.debug(f"Проверяем мут {mute_id}: expiry={expiry_date}, now={now}, diff={(now - expiry_date).total_seconds()} сек")
-                                        
-                                        # Проверяем только если мут действительно истек
-                                        time_diff = (now - expiry_date).total_seconds()
-                                        if time_diff < 0:
-                                            continue  # Мут еще не истек
-                                        
-                                        if time_diff >= 0:
-                                            # Сначала атомарно деактивируем наказание, чтобы избежать повторной обработки
-                                            deactivated = await moderation_db.deactivate_punishment(mute_id)
-                                            
-                                            # Проверяем, что деактивация прошла успешно (защита от дублирования)
-                                            if not deactivated:
-                                                logger.debug(f"Мут {mute_id} уже был обработан другим потоком, пропускаем")
-                                                recently_processed_ref[mute_id] = current_time_ref
-                                                continue
-                                            
-                                            # Помечаем как обработанный (даже если дальше будет ошибка, не будем обрабатывать снова)
-                                            recently_processed_ref[mute_id] = current_time_ref
-                                            
-                                            logger.info(f"Мут истек для пользователя {mute['user_id']} в чате {chat['chat_id']}")
-                                            
-                                            # Мут истек - снимаем ограничения
-                                            import bot
-                                            try:
-                                                await bot.bot.restrict_chat_member(
-                                                    chat_id=chat['chat_id'],
-                                                    user_id=mute['user_id'],
-                                                    permissions=bot.types.ChatPermissions(
-                                                        can_send_messages=True,
-                                                        can_send_media_messages=True,
-                                                        can_send_polls=True,
-                                                        can_send_other_messages=True,
-                                                        can_add_web_page_previews=True,
-                                                        can_change_info=False,
-                                                        can_invite_users=False,
-                                                        can_pin_messages=False
-                                                    )
-                                                )
-                                            except Exception as e:
-                                                error_str = str(e).lower()
-                                                # Обрабатываем ошибки "chat not found" - только логируем в DEBUG
-                                                if "chat not found" in error_str or "bad request" in error_str:
-                                                    if DEBUG:
-                                                        logger.debug(f"Чат {chat['chat_id']} не найден при снятии ограничений: {e}")
-                                                    try:
-                                                        await db.deactivate_chat(chat['chat_id'])
-                                                    except Exception:
-                                                        pass
-                                                else:
-                                                    logger.error(f"Ошибка при снятии ограничений для пользователя {mute['user_id']}: {e}")
-                                            
-                                            # Отправляем сообщение о размуте
-                                            username_display = mute['user_first_name'] or f"@{mute['user_username']}" if mute['user_username'] else f"ID{mute['user_id']}"
-                                            
-                                            philosophical_quotes = [
-                                                "🗣️ Голос - это дар, который нужно беречь и использовать мудро",
-                                                "🔄 Второй шанс - это возможность стать лучше",
-                                                "🌅 После тишины приходит время для слов",
-                                                "🕊️ Свобода слова рождает понимание",
-                                                "💬 Каждое слово имеет значение, каждое молчание - тоже",
-                                                "🌟 Освобождение от ограничений открывает новые горизонты",
-                                                "🦋 Как бабочка выходит из кокона, так и слова выходят из молчания",
-                                                "🌊 Река слов снова течет свободно",
-                                                "🎵 После паузы музыка становится еще прекраснее",
-                                                "🌱 Из тишины рождается мудрость",
-                                                "🔓 Ключ к пониманию - это возможность быть услышанным",
-                                                "📖 Новая глава начинается с первого слова",
-                                                "🎭 Каждый актер заслуживает своего выхода на сцену",
-                                                "🌈 После бури всегда наступает затишье",
-                                                "🕯️ Свет разума рассеивает тьму непонимания"
-                                            ]
-                                            
-                                            import random
-                                            quote = random.choice(philosophical_quotes)
-                                            
-                                            try:
-                                                await bot.bot.send_message(
-                                                    chat['chat_id'],
-                                                    f"🔊 Участник <b>{username_display}</b> <i>освобожден(а) от тайм-аута</i>\n"
-                                                    f"🔸 <b>По истечению времени я автоматически снял ограничения, не нарушайте правила чата!</b>\n\n"
-                                                    f"<blockquote>{quote}</blockquote>",
-                                                    parse_mode=bot.ParseMode.HTML
-                                                )
-                                                logger.info(f"✅ Автоматически снят мут пользователю {mute['user_id']} в чате {chat['chat_id']}")
-                                            except Exception as e:
-                                                error_str = str(e).lower()
-                                                # Обрабатываем ошибки "chat not found" - только логируем в DEBUG
-                                                if "chat not found" in error_str or "bad request" in error_str:
-                                                    if DEBUG:
-                                                        logger.debug(f"Чат {chat['chat_id']} не найден при отправке сообщения о размуте: {e}")
-                                                    try:
-                                                        await db.deactivate_chat(chat['chat_id'])
-                                                    except Exception:
-                                                        pass
-                                                else:
-                                                    logger.error(f"Ошибка при отправке сообщения о размуте: {e}")
-                                            
-                                            expired_count += 1
-                                            
-                                except Exception as e:
-                                    logger.error(f"Ошибка при обработке мута {mute['id']}: {e}")
-                                    continue
-                            
-                            return must_active_count
-                                
-                        except Exception as e:
-                            error_str = str(e).lower()
-                            # Логируем "chat not found" только в DEBUG, иначе деактивируем и пропускаем
-                            if "chat not found" in error_str or "bad request" in error_str:
-                                if DEBUG:
-                                    logger.debug(f"Чат {chat['chat_id']} не найден при проверке мутов: {e}")
-                                try:
-                                    await db.deactivate_chat(chat['chat_id'])
-                                except Exception:
-                                    pass
-                            else:
-                                logger.error(f"Ошибка при проверке мутов в чате {chat['chat_id']}: {e}")
-                            return 0
-                
-                # Обрабатываем все чаты параллельно
-                results = await asyncio.gather(*[process_chat_mutes(chat, self._recently_processed_mutes, current_time) for chat in chats], return_exceptions=True)
-                
-                # Подсчитываем результаты
-                for result in results:
-                    if isinstance(result, int):
-                        if result > 0:
-                            total_active_mutes += result
-                            has_active_mutes = True
-                
-                # Если есть активные муты - ждем 10 секунд, иначе 60 секунд
-                if has_active_mutes:
-                    logger.info(f"Найдено {total_active_mutes} активных мутов - сканируем через 10 секунд")
-                    await asyncio.sleep(10)
-                else:
-                    logger.debug("Нет активных мутов - сканируем через 60 секунд")
-                    await asyncio.sleep(60)
+                # Загружаем сроки из БД при старте и периодически сверяемся с ней
+                # (на случай наказаний, измененных в обход moderation_db)
+                loaded = await moderation_db.load_expiry_queue()
+                logger.debug(f"В очереди истечения наказаний {loaded} активных мутов и банов")
+                
+                while self.running:
+                    due = await punishment_expiry_queue.wait_due(PUNISHMENT_QUEUE_RESYNC_INTERVAL)
+                    if not due:
+                        break
+                    
+                    await asyncio.gather(*[self._expire_punishment(punishment_id) for punishment_id in due], return_exceptions=True)
                 
             except Exception as e:
-                logger.error(f"Ошибка в задаче проверки мутов: {e}")
+                logger.error(f"Ошибка в задаче снятия истекших наказаний: {e}")
                 # При ошибке ждем 30 секунд
                 await asyncio.sleep(30)
     
-    async def ban_expiry_task(self):
-        """Задача для автоматического разбана истекших банов"""
-        logger.info("Запущена задача проверки истечения банов")
+    async def _expire_punishment(self, punishment_id: int):
+        """Снять одно истекшее наказание"""
+        try:
+            punishment = await moderation_db.get_punishment(punishment_id)
+            if not punishment or not punishment['is_active']:
+                return
+            
+            # Срок могли перенести, пока наказание ждало в очереди
+            if punishment['expiry_date']:
+                expiry_date = datetime.fromisoformat(punishment['expiry_date'])
+                now = datetime.now(expiry_date.tzinfo) if expiry_date.tzinfo else datetime.now()
+                if now < expiry_date:
+                    punishment_expiry_queue.schedule(punishment_id, punishment['expiry_date'])
+                    return
+            
+            # Без прав администратора снять ограничения нельзя: наказание остается активным
+            # и проверяется повторно, пока права не вернут. Наказания в удаленных чатах
+            # повторяются только при сверке очереди с БД
+            is_admin = await self._bot_is_admin(punishment['chat_id'])
+            if not is_admin:
+                if is_admin is not None:
+                    retry_at = datetime.now() + timedelta(seconds=PUNISHMENT_RELEASE_RETRY_DELAY)
+                    punishment_expiry_queue.schedule(punishment_id, retry_at.isoformat())
+                return
+            
+            # Сначала атомарно деактивируем наказание, чтобы избежать повторной обработки
+            deactivated = await moderation_db.deactivate_punishment(punishment_id)
+            
+            # Проверяем, что деактивация прошла успешно (защита от дублирования)
+            if not deactivated:
+                logger.debug(f"Наказание {punishment_id} уже было обработано, пропускаем")
+                return
+            
+            async with self.chat_semaphore:
+                if punishment['punishment_type'] == 'mute':
+                    await self._release_mute(punishment)
+                elif punishment['punishment_type'] == 'ban':
+                    await self._release_ban(punishment)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке наказания {punishment_id}: {e}")
+    
+    async def _bot_is_admin(self, chat_id: int) -> Optional[bool]:
+        """Является ли бот администратором чата; None - чата нет или бота удалили (чат деактивируется)"""
+        import bot
+        try:
+            bot_member = await chat_member_cache.get(chat_id, bot.bot.id)
+        except Exception as e:
+            if _is_chat_gone(e):
+                logger.info(f"Чат {chat_id} не найден, деактивируем его")
+                try:
+                    await db.deactivate_chat(chat_id)
+                except Exception:
+                    pass
+                return None
+            logger.error(f"Ошибка при проверке прав бота в чате {chat_id}: {e}")
+            return False
+        return bot_member.status in ['administrator', 'creator']
+    
+    async def _release_mute(self, mute: dict):
+        """Снять ограничения с пользователя после истечения мута"""
+        chat_id = mute['chat_id']
         
-        while self.running:
+        logger.info(f"Мут истек для пользователя {mute['user_id']} в чате {chat_id}")
+        
+        # Мут истек - снимаем ограничения
+        import bot
+        try:
+            await bot.bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=mute['user_id'],
+                permissions=bot.types.ChatPermissions(
+                    can_send_messages=True,
+                    can_send_media_messages=True,
+                    can_send_polls=True,
+                    can_send_other_messages=True,
+                    can_add_web_page_previews=True,
+                    can_change_info=False,
+                    can_invite_users=False,
+                    can_pin_messages=False
+                )
+            )
+        except Exception as e:
+            # Чат деактивируем, только если его нет или бота из него удалили
+            if _is_chat_gone(e):
+                if DEBUG:
+                    logger.debug(f"Чат {chat_id} не найден при снятии ограничений: {e}")
+                try:
+                    await db.deactivate_chat(chat_id)
+                except Exception:
+                    pass
+            else:
+                logger.error(f"Ошибка при снятии ограничений для пользователя {mute['user_id']}: {e}")
+            # Ограничения не сняты - сообщение о снятии не отправляем
+            return
+        
+        # Отправляем сообщение о размуте
+        username_display = mute['user_first_name'] or f"@{mute['user_username']}" if mute['user_username'] else f"ID{mute['user_id']}"
+        
+        philosophical_quotes = [
+            "🗣️ Голос - это дар, который нужно беречь и использовать мудро",
+            "🔄 Второй шанс - это возможность стать лучше",
+            "🌅 После тишины приходит время для слов",
+            "🕊️ Свобода слова рождает понимание",
+            "💬 Каждое слово имеет значение, каждое молчание - тоже",
+            "🌟 Освобождение от ограничений открывает новые горизонты",
+            "🦋 Как бабочка выходит из кокона, так и слова выходят из молчания",
+            "🌊 Река слов снова течет свободно",
+            "🎵 После паузы музыка становится еще прекраснее",
+            "🌱 Из тишины рождается мудрость",
+            "🔓 Ключ к пониманию - это возможность быть услышанным",
+            "📖 Новая глава начинается с первого слова",
+            "🎭 Каждый актер заслуживает своего выхода на сцену",
+            "🌈 После бури всегда наступает затишье",
+            "🕯️ Свет разума рассеивает тьму непонимания"
+        ]
+        
+        import random
+        quote = random.choice(philosophical_quotes)
+        
+        try:
+            await bot.bot.send_message(
+                chat_id,
+                f"🔊 Участник <b>{username_display}</b> <i>освобожден(а) от тайм-аута</i>\n"
+                f"🔸 <b>По истечению времени я автоматически снял ограничения, не нарушайте правила чата!</b>\n\n"
+                f"<blockquote>{quote}</blockquote>",
+                parse_mode=bot.ParseMode.HTML
+            )
+            logger.info(f"✅ Автоматически снят мут пользователю {mute['user_id']} в чате {chat_id}")
+        except Exception as e:
+            # Чат деактивируем, только если его нет или бота из него удалили
+            if _is_chat_gone(e):
+                if DEBUG:
+                    logger.debug(f"Чат {chat_id} не найден при отправке сообщения о размуте: {e}")
+                try:
+                    await db.deactivate_chat(chat_id)
+                except Exception:
+                    pass
+            else:
+                logger.error(f"Ошибка при отправке сообщения о размуте: {e}")
+    
+    async def _release_ban(self, ban: dict):
+        """Разбанить пользователя после истечения бана"""
+        chat_id = ban['chat_id']
+        
+        logger.info(f"Бан истек для пользователя {ban['user_id']} в чате {chat_id}")
+        
+        # Разбаниваем пользователя
+        import bot
+        try:
+            await bot.bot.unban_chat_member(
+                chat_id=chat_id,
+                user_id=ban['user_id']
+            )
+        except Exception as e:
+            # Чат деактивируем, только если его нет или бота из него удалили
+            if _is_chat_gone(e):
+                if DEBUG:
+                    logger.debug(f"Чат {chat_id} не найден при разбане: {e}")
+                try:
+                    await db.deactivate_chat(chat_id)
+                except Exception:
+                    pass
+            else:
+                logger.error(f"Ошибка при разбане пользователя {ban['user_id']}: {e}")
+            # Ограничения не сняты - сообщение о снятии не отправляем
+            return
+        
+        # Формируем имя пользователя
+        username_display = ban['user_first_name'] or f"@{ban['user_username']}" if ban['user_username'] else f"ID{ban['user_id']}"
+        
+        # Философские цитаты для автоматического разбана
+        philosophical_quotes = [
+            "🌅 Время лечит все раны, даже самые глубокие",
+            "🌊 Река находит путь к морю, преодолевая все препятствия",
+            "🕊️ Птица свободы всегда найдет путь домой",
+            "🌱 Из пепла может вырасти новая жизнь",
+            "🌙 Даже самая темная ночь заканчивается рассветом",
+            "🍃 Новый лист может вырасти на том же дереве",
+            "🌌 Звезды не исчезают навсегда, они просто ждут своего времени",
+            "🌿 Дерево может зацвести заново после зимы",
+            "🦋 Превращение требует времени, но результат стоит ожидания",
+            "🌅 Солнце всегда возвращается, даже после самой долгой ночи"
+        ]
+        
+        import random
+        quote = random.choice(philosophical_quotes)
+        
+        # Отправляем сообщение в чат
+        try:
+            await bot.bot.send_message(
+                chat_id,
+                f"✅ <b>{username_display}</b> <i>был(а) автоматически разбанен(а)</i>\n"
+                f"🔸 <b>Срок наказания истек</b>\n\n"
+                f"<blockquote>{quote}</blockquote>",
+                parse_mode=bot.ParseMode.HTML
+            )
+        except Exception as e:
+            # Чат деактивируем, только если его нет или бота из него удалили
+            if _is_chat_gone(e):
+                if DEBUG:
+                    logger.debug(f"Чат {chat_id} не найден при отправке сообщения о разбане: {e}")
+                try:
+                    await db.deactivate_chat(chat_id)
+                except Exception:
+                    pass
+            else:
+                logger.error(f"Ошибка при отправке сообщения о разбане: {e}")
+        
+        # Отправляем уведомление в ЛС пользователю
+        try:
             try:
-                # Получаем все чаты
-                chats = await db.get_all_chats_for_update()
-                total_active_bans = 0
-                has_active_bans = False
-                
-                # Функция для обработки одного чата
-                async def process_chat_bans(chat):
-                    async with self.chat_semaphore:
-                        try:
-                            # Получаем активные баны для этого чата
-                            active_bans = await moderation_db.get_active_punishments(chat['chat_id'], "ban")
-                            
-                            if not active_bans:
-                                return 0
-                            
-                            ban_count = len(active_bans)
-                            
-                            # Проверяем каждый бан на истечение
-                            for ban in active_bans:
-                                try:
-                                    # Проверяем, истек ли бан
-                                    if ban['expiry_date']:
-                                        expiry_date = datetime.fromisoformat(ban['expiry_date'])
-                                        # Используем UTC для сравнения
-                                        now = datetime.now(expiry_date.tzinfo) if expiry_date.tzinfo else datetime.now()
-                                        if now >= expiry_date:
-                                            # Сначала атомарно деактивируем наказание, чтобы избежать повторной обработки
-                                            deactivated = await moderation_db.deactivate_punishment(ban['id'])
-                                            
-                                            # Проверяем, что деактивация прошла успешно (защита от дублирования)
-                                            if not deactivated:
-                                                logger.warning(f"Бан {ban['id']} уже был обработан другим потоком, пропускаем")
-                                                continue
-                                            
-                                            logger.info(f"Бан истек для пользователя {ban['user_id']} в чате {chat['chat_id']}")
-                                            
-                                            # Разбаниваем пользователя
-                                            import bot
-                                            try:
-                                                await bot.bot.unban_chat_member(
-                                                    chat_id=chat['chat_id'],
-                                                    user_id=ban['user_id']
-                                                )
-                                            except Exception as e:
-                                                error_str = str(e).lower()
-                                                # Обрабатываем ошибки "chat not found" - только логируем в DEBUG
-                                                if "chat not found" in error_str or "bad request" in error_str:
-                                                    if DEBUG:
-                                                        logger.debug(f"Чат {chat['chat_id']} не найден при разбане: {e}")
-                                                    try:
-                                                        await db.deactivate_chat(chat['chat_id'])
-                                                    except Exception:
-                                                        pass
-                                                else:
-                                                    logger.error(f"Ошибка при разбане пользователя {ban['user_id']}: {e}")
-                                            
-                                            # Формируем имя пользователя
-                                            username_display = ban['user_first_name'] or f"@{ban['user_username']}" if ban['user_username'] else f"ID{ban['user_id']}"
-                                            
-                                            # Философские цитаты для автоматического разбана
-                                            philosophical_quotes = [
-                                                "🌅 Время лечит все раны, даже самые глубокие",
-                                                "🌊 Река находит путь к морю, преодолевая все препятствия",
-                                                "🕊️ Птица свободы всегда найдет путь домой",
-                                                "🌱 Из пепла может вырасти новая жизнь",
-                                                "🌙 Даже самая темная ночь заканчивается рассветом",
-                                                "🍃 Новый лист может вырасти на том же дереве",
-                                                "🌌 Звезды не исчезают навсегда, они просто ждут своего времени",
-                                                "🌿 Дерево может зацвести заново после зимы",
-                                                "🦋 Превращение требует времени, но результат стоит ожидания",
-                                                "🌅 Солнце всегда возвращается, даже после самой долгой ночи"
-                                            ]
-                                            
-                                            import random
-                                            quote = random.choice(philosophical_quotes)
-                                            
-                                            # Отправляем сообщение в чат
-                                            try:
-                                                await bot.bot.send_message(
-                                                    chat['chat_id'],
-                                                    f"✅ <b>{username_display}</b> <i>был(а) автоматически разбанен(а)</i>\n"
-                                                    f"🔸 <b>Срок наказания истек</b>\n\n"
-                                                    f"<blockquote>{quote}</blockquote>",
-                                                    parse_mode=bot.ParseMode.HTML
-                                                )
-                                            except Exception as e:
-                                                error_str = str(e).lower()
-                                                # Обрабатываем ошибки "chat not found" - только логируем в DEBUG
-                                                if "chat not found" in error_str or "bad request" in error_str:
-                                                    if DEBUG:
-                                                        logger.debug(f"Чат {chat['chat_id']} не найден при отправке сообщения о разбане: {e}")
-                                                    try:
-                                                        await db.deactivate_chat(chat['chat_id'])
-                                                    except Exception:
-                                                        pass
-                                                else:
-                                                    logger.error(f"Ошибка при отправке сообщения о разбане: {e}")
-                                            
-                                            # Отправляем уведомление в ЛС пользователю
-                                            try:
-                                                try:
-                                                    chat_info = await bot.bot.get_chat(chat['chat_id'])
-                                                    chat_title = chat_info.title or "Неизвестный чат"
-                                                except Exception as e:
-                                                    error_str = str(e).lower()
-                                                    # Если чат не найден, используем дефолтное название
-                                                    if "chat not found" in error_str or "bad request" in error_str:
-                                                        if DEBUG:
-                                                            logger.debug(f"Чат {chat['chat_id']} не найден при получении информации: {e}")
-                                                        chat_title = "неизвестный чат"
-                                                    else:
-                                                        raise
-                                                
-                                                # Создаем кнопку "Открыть чат"
-                                                from aiogram.utils.keyboard import InlineKeyboardBuilder
-                                                builder = InlineKeyboardBuilder()
-                                                try:
-                                                    builder.button(text="💬 Открыть чат", url=f"https://t.me/{chat_info.username}" if chat_info.username else f"https://t.me/c/{str(chat['chat_id'])[4:]}")
-                                                except:
-                                                    pass  # Если chat_info не определен
-                                                
-                                                await bot.bot.send_message(
-                                                    ban['user_id'],
-                                                    f"✅ Вы были автоматически разбанены в чате \"{chat_title}\"\n"
-                                                    f"🔸 Срок наказания истек\n\n"
-                                                    f"<blockquote>{quote}</blockquote>",
-                                                    parse_mode=bot.ParseMode.HTML,
-                                                    reply_markup=builder.as_markup() if builder else None
-                                                )
-                                            except Exception as e:
-                                                error_str = str(e).lower()
-                                                # Обрабатываем ошибки "chat not found" - только логируем в DEBUG
-                                                if "chat not found" in error_str or "bad request" in error_str:
-                                                    if DEBUG:
-                                                        logger.debug(f"Чат {chat['chat_id']} не найден при отправке уведомления: {e}")
-                                                else:
-                                                    logger.error(f"Ошибка при отправке уведомления пользователю {ban['user_id']}: {e}")
-                                            
-                                            logger.info(f"✅ Автоматически разбанен пользователь {ban['user_id']} в чате {chat['chat_id']}")
-                                            
-                                except Exception as e:
-                                    logger.error(f"Ошибка при обработке бана {ban['id']}: {e}")
-                            
-                            return ban_count
-                                    
-                        except Exception as e:
-                            error_str = str(e).lower()
-                            # Логируем "chat not found" только в DEBUG, иначе деактивируем и пропускаем
-                            if "chat not found" in error_str or "bad request" in error_str:
-                                if DEBUG:
-                                    logger.debug(f"Чат {chat['chat_id']} не найден при проверке банов: {e}")
-                                try:
-                                    await db.deactivate_chat(chat['chat_id'])
-                                except Exception:
-                                    pass
-                            else:
-                                logger.error(f"Ошибка при проверке банов в чате {chat['chat_id']}: {e}")
-                            return 0
-                
-                # Обрабатываем все чаты параллельно
-                results = await asyncio.gather(*[process_chat_bans(chat) for chat in chats], return_exceptions=True)
-                
-                # Подсчитываем результаты
-                for result in results:
-                    if isinstance(result, int):
-                        if result > 0:
-                            total_active_bans += result
-                            has_active_bans = True
-                
-                # Если есть активные баны - ждем 10 секунд, иначе 60 секунд
-                if has_active_bans:
-                    logger.info(f"Найдено {total_active_bans} активных банов - сканируем через 10 секунд")
-                    await asyncio.sleep(10)
-                else:
-                    logger.debug("Нет активных банов - сканируем через 60 секунд")
-                    await asyncio.sleep(60)
-                
+                chat_info = await bot.bot.get_chat(chat_id)
+                chat_title = chat_info.title or "Неизвестный чат"
             except Exception as e:
-                logger.error(f"Ошибка в задаче проверки банов: {e}")
-                # При ошибке ждем 30 секунд
-                await asyncio.sleep(30)
+                error_str = str(e).lower()
+                # Если чат не найден, используем дефолтное название
+                if "chat not found" in error_str or "bad request" in error_str:
+                    if DEBUG:
+                        logger.debug(f"Чат {chat_id} не найден при получении информации: {e}")
+                    chat_title = "неизвестный чат"
+                else:
+                    raise
+            
+            # Создаем кнопку "Открыть чат"
+            from aiogram.utils.keyboard import InlineKeyboardBuilder
+            builder = InlineKeyboardBuilder()
+            try:
+                builder.button(text="💬 Открыть чат", url=f"https://t.me/{chat_info.username}" if chat_info.username else f"https://t.me/c/{str(chat_id)[4:]}")
+            except:
+                pass  # Если chat_info не определен
+            
+            await bot.bot.send_message(
+                ban['user_id'],
+                f"✅ Вы были автоматически разбанены в чате \"{chat_title}\"\n"
+                f"🔸 Срок наказания истек\n\n"
+                f"<blockquote>{quote}</blockquote>",
+                parse_mode=bot.ParseMode.HTML,
+                reply_markup=builder.as_markup() if builder else None
+            )
+        except Exception as e:
+            error_str = str(e).lower()
+            # Обрабатываем ошибки "chat not found" - только логируем в DEBUG
+            if "chat not found" in error_str or "bad request" in error_str:
+                if DEBUG:
+                    logger.debug(f"Чат {chat_id} не найден при отправке уведомления: {e}")
+            else:
+                logger.error(f"Ошибка при отправке уведомления пользователю {ban['user_id']}: {e}")
+        
+        logger.info(f"✅ Автоматически разбанен пользователь {ban['user_id']} в чате {chat_id}")
     
     async def cleanup_old_moderation_records_task(self):
         """Задача очистки старых записей модерации"""
@@ -707,6 +609,11 @@ class TaskScheduler:
                 await raid_db.cleanup_old_joins(2)
                 await raid_db.cleanup_old_deleted_messages(5)
                 
+                # Освобождаем окна активности неактивных пользователей
+                from raid_protection import raid_protection
+                raid_protection.activity.evict_idle()
+                raid_protection.near_duplicates.evict_idle()
+                
                 logger.debug("Очистка записей защиты от рейдов завершена")
                 
                 # Выполняем очистку каждые 5 минут
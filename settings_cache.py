@@ -0,0 +1,72 @@
+"""
+Кэш настроек чатов (статистика, подсказки, префикс команд, заявки, варны, защита от рейдов)
+Настройки загружаются из БД при первом обращении и сбрасываются методами set_*/update_*.
+Холодные чаты вытесняются по LRU. Используется только из цикла событий asyncio.
+"""
+import asyncio
+import copy
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import CHAT_SETTINGS_CACHE_SIZE
+except ImportError:
+    CHAT_SETTINGS_CACHE_SIZE = 10_000
+
+
+class ChatSettingsCache:
+    """LRU-кэш настроек: chat_id -> {раздел настроек: значение}"""
+
+    def __init__(self, max_chats: int = CHAT_SETTINGS_CACHE_SIZE):
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # Увеличивается при каждом сбросе: чтение, начатое до сброса, не попадает в кэш
+        self._epoch = 0
+
+    async def get_or_load(self, namespace: str, chat_id: int, loader: Callable[[], Any]) -> Any:
+        """
+        Вернуть настройки раздела из кэша или загрузить синхронной функцией loader в executor.
+        Исключения loader пробрасываются и не кэшируются.
+        """
+        settings = self._chats.get(chat_id)
+        if settings is not None and namespace in settings:
+            self._chats.move_to_end(chat_id)
+            return copy.copy(settings[namespace])
+
+        epoch = self._epoch
+        value = await asyncio.get_event_loop().run_in_executor(None, loader)
+        if epoch == self._epoch:
+            self._store(namespace, chat_id, value)
+        return copy.copy(value)
+
+    def _store(self, namespace: str, chat_id: int, value: Any):
+        settings = self._chats.get(chat_id)
+        if settings is None:
+            settings = self._chats[chat_id] = {}
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        settings[namespace] = value
+
+    def invalidate(self, chat_id: int, namespace: Optional[str] = None):
+        """Сбросить раздел настроек чата или все настройки чата"""
+        self._epoch += 1
+        if namespace is None:
+            self._chats.pop(chat_id, None)
+            return
+        settings = self._chats.get(chat_id)
+        if settings is not None:
+            settings.pop(namespace, None)
+
+    def clear(self):
+        """Сбросить весь кэш"""
+        self._epoch += 1
+        self._chats.clear()
+
+
+# Глобальный кэш настроек чатов
+settings_cache = ChatSettingsCache()
@@ -0,0 +1,120 @@
+"""
+Скользящие окна событий в памяти для защиты от рейдов
+Заменяют запись каждого события в recent_activity и последующий SELECT по диапазону:
+вставка и подсчет выполняются за амортизированное O(1), память ограничена.
+Используется только из цикла событий asyncio, поэтому блокировки не нужны.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class SlidingWindowCounter:
+    """События одного ключа (chat_id, user_id, тип) за последнее окно"""
+
+    __slots__ = ('events', 'contents', 'last_seen')
+
+    def __init__(self):
+        # (timestamp, content) в порядке поступления
+        self.events: deque = deque()
+        # content -> количество событий с таким содержимым в окне
+        self.contents: Dict[Any, int] = {}
+        self.last_seen = 0.0
+
+    def _drop_oldest(self):
+        _, content = self.events.popleft()
+        if content is not None:
+            left = self.contents[content] - 1
+            if left:
+                self.contents[content] = left
+            else:
+                del self.contents[content]
+
+    def expire(self, cutoff: float):
+        """Удалить события старше cutoff"""
+        events = self.events
+        while events and events[0][0] < cutoff:
+            self._drop_oldest()
+
+    def add(self, now: float, content: Any, max_events: int):
+        """Добавить событие, вытесняя самое старое при переполнении"""
+        if len(self.events) >= max_events:
+            self._drop_oldest()
+        self.events.append((now, content))
+        if content is not None:
+            self.contents[content] = self.contents.get(content, 0) + 1
+        self.last_seen = now
+
+
+class SlidingWindowStore:
+    """
+    Набор скользящих окон с ограничением памяти:
+    - не больше max_events_per_key событий на ключ;
+    - не больше max_keys ключей (вытесняются давно не активные);
+    - ключи без событий дольше idle_ttl секунд удаляются при периодической чистке.
+    """
+
+    def __init__(self, max_events_per_key: int = 256, max_keys: int = 100_000,
+                 idle_ttl: float = 600, sweep_every: int = 1000):
+        self.max_events_per_key = max_events_per_key
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self._windows: "OrderedDict[Hashable, SlidingWindowCounter]" = OrderedDict()
+        self._inserts = 0
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def add(self, key: Hashable, window_seconds: float, content: Any = None,
+            now: Optional[float] = None) -> Tuple[int, int]:
+        """
+        Зарегистрировать событие и вернуть (событий в окне, событий с тем же content в окне).
+        Текущее событие учитывается в обоих значениях.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        counter = self._windows.get(key)
+        if counter is None:
+            counter = SlidingWindowCounter()
+            self._windows[key] = counter
+            if len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+
+        counter.expire(now - window_seconds)
+        counter.add(now, content, self.max_events_per_key)
+
+        self._inserts += 1
+        if self._inserts % self.sweep_every == 0:
+            self.evict_idle(now)
+
+        same = counter.contents.get(content, 0) if content is not None else 0
+        return len(counter.events), same
+
+    def count(self, key: Hashable, window_seconds: float, now: Optional[float] = None) -> int:
+        """Количество событий ключа в окне (без добавления нового)"""
+        counter = self._windows.get(key)
+        if counter is None:
+            return 0
+        if now is None:
+            now = time.monotonic()
+        counter.expire(now - window_seconds)
+        return len(counter.events)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Удалить ключи, по которым не было событий дольше idle_ttl"""
+        if now is None:
+            now = time.monotonic()
+        cutoff = now - self.idle_ttl
+        removed = 0
+        # Ключи упорядочены по последнему событию: самые старые в начале
+        while self._windows:
+            key, counter = next(iter(self._windows.items()))
+            if counter.last_seen >= cutoff:
+                break
+            del self._windows[key]
+            removed += 1
+        return removed
@@ -0,0 +1,189 @@
+"""
+Буфер отложенной записи счетчиков сообщений (daily_stats / user_daily_stats,
+сводные таблицы stats_rollup, почасовые гистограммы chat_hourly_stats
+и членство пользователей в чатах user_chat_membership)
+Приращения копятся в памяти и сбрасываются в БД одной транзакцией
+раз в STATS_FLUSH_INTERVAL_MS миллисекунд или после STATS_FLUSH_MAX_EVENTS событий
+(событие - одно учтенное сообщение, сколько бы счетчиков оно ни затронуло).
+При аварийном завершении теряется не больше этих границ.
+"""
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Tuple, List
+
+from db_pool import get_connection
+import stats_rollup
+import hourly_histogram
+import chat_membership
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import STATS_FLUSH_MAX_EVENTS
+except ImportError:
+    STATS_FLUSH_MAX_EVENTS = 500
+
+
+class StatsCounterBuffer:
+    """Агрегирует приращения счетчиков по (chat, date) и (chat, user, date)"""
+
+    def __init__(self, db_path: str, max_events: int = STATS_FLUSH_MAX_EVENTS):
+        self.db_path = db_path
+        self.max_events = max_events
+        # Защищает словари приращений
+        self._lock = threading.Lock()
+        # Сериализует сброс и согласованное чтение (БД + буфер)
+        self._flush_lock = threading.Lock()
+        self._chat: Dict[Tuple[int, str], int] = {}
+        # (chat_id, user_id, date) -> count (имена пользователей хранятся только в users)
+        self._user: Dict[Tuple[int, int, str], int] = {}
+        # (chat_id, utc_date) -> 24 почасовых счетчика
+        self._hourly: Dict[Tuple[int, str], List[int]] = {}
+        # Количество учтенных сообщений с последнего сброса
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Количество событий, ожидающих записи"""
+        return self._pending
+
+    def should_flush(self) -> bool:
+        """Достигнута ли граница по количеству событий"""
+        return self._pending >= self.max_events
+
+    def add_message(self, chat_id: int, user_id: int, chat_date: str, user_date: str,
+                    utc_date: str, hour: int):
+        """Учесть одно сообщение во всех счетчиках: чата, почасовом и пользователя (одно событие)"""
+        with self._lock:
+            self._add_chat(chat_id, chat_date, 1)
+            self._add_hourly(chat_id, utc_date, hour, 1)
+            self._add_user(chat_id, user_id, user_date, 1)
+            self._pending += 1
+
+    def _add_chat(self, chat_id: int, date: str, count: int):
+        key = (chat_id, date)
+        self._chat[key] = self._chat.get(key, 0) + count
+
+    def _add_hourly(self, chat_id: int, utc_date: str, hour: int, count: int):
+        key = (chat_id, utc_date)
+        counts = self._hourly.get(key)
+        if counts is None:
+            counts = self._hourly[key] = [0] * hourly_histogram.HOURS
+        counts[hour] += count
+
+    def _add_user(self, chat_id: int, user_id: int, date: str, count: int):
+        key = (chat_id, user_id, date)
+        self._user[key] = self._user.get(key, 0) + count
+
+    def add_chat_message(self, chat_id: int, date: str, count: int = 1):
+        """Учесть сообщение в счетчике чата"""
+        with self._lock:
+            self._add_chat(chat_id, date, count)
+            self._pending += count
+
+    def add_hourly_message(self, chat_id: int, utc_date: str, hour: int, count: int = 1):
+        """Учесть сообщение в почасовой гистограмме чата (дата и час по UTC)"""
+        with self._lock:
+            self._add_hourly(chat_id, utc_date, hour, count)
+
+    def add_user_message(self, chat_id: int, user_id: int, date: str, count: int = 1):
+        """Учесть сообщение в счетчике пользователя"""
+        with self._lock:
+            self._add_user(chat_id, user_id, date, count)
+            self._pending += count
+
+    def chat_deltas(self, chat_id: int) -> Dict[str, int]:
+        """Несброшенные приращения чата по датам"""
+        with self._lock:
+            return {date: n for (cid, date), n in self._chat.items() if cid == chat_id}
+
+    def user_deltas(self, chat_id: int, date: str) -> Dict[int, int]:
+        """Несброшенные приращения пользователей чата за дату: user_id -> count"""
+        with self._lock:
+            return {uid: n for (cid, uid, d), n in self._user.items() if cid == chat_id and d == date}
+
+    def hourly_deltas(self, chat_id: int) -> Dict[str, List[int]]:
+        """Несброшенные почасовые приращения чата по UTC-датам"""
+        with self._lock:
+            return {day: list(counts) for (cid, day), counts in self._hourly.items() if cid == chat_id}
+
+    def user_delta(self, chat_id: int, user_id: int, date: str) -> int:
+        """Несброшенное приращение одного пользователя за дату"""
+        with self._lock:
+            return self._user.get((chat_id, user_id, date), 0)
+
+    @contextmanager
+    def consistent_read(self):
+        """
+        Блокировка для читателей, объединяющих данные БД и буфера:
+        пока она удерживается, сброс не выполняется и приращения не учитываются дважды.
+        Захватывать до получения соединения из пула.
+        """
+        with self._flush_lock:
+            yield
+
+    def _restore(self, chat: Dict[Tuple[int, str], int], user: Dict[Tuple[int, int, str], int],
+                 hourly: Dict[Tuple[int, str], List[int]], pending: int):
+        """Вернуть несохраненные приращения в буфер после ошибки записи"""
+        with self._lock:
+            for key, counts in hourly.items():
+                current = self._hourly.get(key)
+                if current is None:
+                    self._hourly[key] = counts
+                else:
+                    self._hourly[key] = [a + b for a, b in zip(current, counts)]
+            for key, n in chat.items():
+                self._chat[key] = self._chat.get(key, 0) + n
+            for key, n in user.items():
+                self._user[key] = self._user.get(key, 0) + n
+            self._pending += pending
+
+    def flush_sync(self) -> int:
+        """
+        Записать накопленные приращения одной транзакцией.
+        Нельзя вызывать, удерживая соединение из пула.
+        Возвращает количество записанных строк.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._chat and not self._user and not self._hourly:
+                    return 0
+                chat, self._chat = self._chat, {}
+                user, self._user = self._user, {}
+                hourly, self._hourly = self._hourly, {}
+                pending, self._pending = self._pending, 0
+
+            chat_rows: List[tuple] = [(cid, date, n) for (cid, date), n in chat.items()]
+            user_rows: List[tuple] = [(cid, uid, date, n) for (cid, uid, date), n in user.items()]
+            try:
+                with get_connection(self.db_path) as db:
+                    # Дни, впервые появившиеся у чата, увеличивают active_days в сводках
+                    new_days = {
+                        (cid, date) for cid, date, _ in chat_rows
+                        if db.execute(
+                            "SELECT 1 FROM daily_stats WHERE chat_id = ? AND date = ?", (cid, date)
+                        ).fetchone() is None
+                    }
+                    db.executemany(stats_rollup.UPSERT_CHAT_SQL, stats_rollup.chat_rollup_rows(chat_rows, new_days))
+                    db.executemany(stats_rollup.UPSERT_USER_SQL, stats_rollup.user_rollup_rows(user_rows))
+                    db.executemany(chat_membership.UPSERT_SQL, chat_membership.membership_rows(user_rows))
+                    hourly_histogram.merge_sync(db, hourly)
+                    db.executemany("""
+                        INSERT INTO daily_stats (chat_id, date, message_count)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(chat_id, date) DO UPDATE SET
+                            message_count = message_count + excluded.message_count
+                    """, chat_rows)
+                    db.executemany("""
+                        INSERT INTO user_daily_stats (chat_id, user_id, date, message_count)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(chat_id, user_id, date) DO UPDATE SET
+                            message_count = message_count + excluded.message_count
+                    """, user_rows)
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе буфера счетчиков сообщений: {e}")
+                self._restore(chat, user, hourly, pending)
+                return 0
+
+            return len(chat_rows) + len(user_rows) + len(hourly)
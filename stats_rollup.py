@@ -0,0 +1,172 @@
+"""
+Сводные таблицы счетчиков сообщений по неделям и месяцам
+Дневные счетчики (daily_stats / user_daily_stats) хранятся всего несколько дней,
+а топы за N дней считаются по сводным строкам: месяц целиком или неделя внутри месяца.
+Неделя разбивается на границе месяца, поэтому недели и месяцы не пересекаются и
+окно [начало, сегодня] покрывается строками без двойного учета.
+Сводки обновляются в той же транзакции, что и дневные счетчики (StatsCounterBuffer.flush_sync).
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+# Значения столбца granularity
+WEEK = 'week'
+MONTH = 'month'
+
+# SQL-выражение начала недельной части (понедельник, но не раньше первого числа месяца)
+# для столбца date; совпадает с week_start()
+SQL_WEEK_START = "MAX(date(date, '-6 days', 'weekday 1'), date(date, 'start of month'))"
+SQL_MONTH_START = "date(date, 'start of month')"
+
+CREATE_TABLES_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS user_stats_rollup (
+        chat_id INTEGER,
+        user_id INTEGER,
+        granularity TEXT,
+        period_start TEXT,
+        message_count INTEGER DEFAULT 0,
+        PRIMARY KEY (chat_id, granularity, period_start, user_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_stats_rollup_period
+    ON user_stats_rollup (granularity, period_start, user_id)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_stats_rollup (
+        chat_id INTEGER,
+        granularity TEXT,
+        period_start TEXT,
+        message_count INTEGER DEFAULT 0,
+        active_days INTEGER DEFAULT 0,
+        PRIMARY KEY (granularity, period_start, chat_id)
+    )
+    """,
+)
+
+UPSERT_USER_SQL = """
+    INSERT INTO user_stats_rollup (chat_id, user_id, granularity, period_start, message_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(chat_id, granularity, period_start, user_id) DO UPDATE SET
+        message_count = message_count + excluded.message_count
+"""
+
+UPSERT_CHAT_SQL = """
+    INSERT INTO chat_stats_rollup (chat_id, granularity, period_start, message_count, active_days)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(granularity, period_start, chat_id) DO UPDATE SET
+        message_count = message_count + excluded.message_count,
+        active_days = active_days + excluded.active_days
+"""
+
+
+def week_start(day: str) -> str:
+    """Начало недельной части, в которую попадает дата (YYYY-MM-DD)"""
+    d = date.fromisoformat(day)
+    return max(d - timedelta(days=d.weekday()), d.replace(day=1)).isoformat()
+
+
+def month_start(day: str) -> str:
+    """Первое число месяца, в который попадает дата (YYYY-MM-DD)"""
+    return date.fromisoformat(day).replace(day=1).isoformat()
+
+
+def window_bounds(today: str, days: int) -> Tuple[str, str]:
+    """
+    Границы окна «последние N дней» в сводных строках: (начало недель, начало месяцев).
+    Недельные строки берутся с period_start в [начало недель, начало месяцев),
+    месячные - с period_start >= начало месяцев. Окно расширяется назад до начала
+    недельной части, в которую попадает дата today - days.
+    """
+    first = (date.fromisoformat(today) - timedelta(days=days)).isoformat()
+    weeks_from = week_start(first)
+    start = date.fromisoformat(weeks_from)
+    if start.day == 1:
+        months_from = start
+    else:
+        months_from = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return weeks_from, months_from.isoformat()
+
+
+def window_condition(alias: str = '') -> str:
+    """
+    Условие WHERE для выбора сводных строк окна; параметры - результат window_bounds()
+    в порядке (начало недель, начало месяцев, начало месяцев)
+    """
+    prefix = f"{alias}." if alias else ''
+    return (
+        f"(({prefix}granularity = '{WEEK}' AND {prefix}period_start >= ? AND {prefix}period_start < ?)"
+        f" OR ({prefix}granularity = '{MONTH}' AND {prefix}period_start >= ?))"
+    )
+
+
+def user_rollup_rows(user_rows: List[tuple]) -> List[tuple]:
+    """
+    Строки для UPSERT_USER_SQL из строк user_daily_stats (chat_id, user_id, date, count)
+    """
+    rollup: Dict[tuple, int] = {}
+    for chat_id, user_id, day, count in user_rows:
+        for granularity, period in ((WEEK, week_start(day)), (MONTH, month_start(day))):
+            key = (chat_id, user_id, granularity, period)
+            rollup[key] = rollup.get(key, 0) + count
+    return [(*key, count) for key, count in rollup.items()]
+
+
+def chat_rollup_rows(chat_rows: List[tuple], new_days: set) -> List[tuple]:
+    """
+    Строки для UPSERT_CHAT_SQL из строк daily_stats (chat_id, date, count);
+    new_days - пары (chat_id, date), для которых в daily_stats еще не было записи
+    """
+    rollup: Dict[tuple, list] = {}
+    for chat_id, day, count in chat_rows:
+        is_new = 1 if (chat_id, day) in new_days else 0
+        for granularity, period in ((WEEK, week_start(day)), (MONTH, month_start(day))):
+            entry = rollup.setdefault((chat_id, granularity, period), [0, 0])
+            entry[0] += count
+            entry[1] += is_new
+    return [(*key, *entry) for key, entry in rollup.items()]
+
+
+def move_chat_sync(db, old_chat_id: int, new_chat_id: int):
+    """Перенести сводные строки чата на новый ID, складывая с уже имеющимися"""
+    # WHERE у SELECT обязателен: без него SQLite принял бы ON CONFLICT за часть SELECT (JOIN ... ON)
+    db.execute("""
+        INSERT INTO chat_stats_rollup (chat_id, granularity, period_start, message_count, active_days)
+        SELECT ?, granularity, period_start, message_count, active_days
+        FROM chat_stats_rollup WHERE chat_id = ?
+        ON CONFLICT(granularity, period_start, chat_id) DO UPDATE SET
+            message_count = message_count + excluded.message_count,
+            active_days = MAX(active_days, excluded.active_days)
+    """, (new_chat_id, old_chat_id))
+    db.execute("""
+        INSERT INTO user_stats_rollup (chat_id, user_id, granularity, period_start, message_count)
+        SELECT ?, user_id, granularity, period_start, message_count
+        FROM user_stats_rollup WHERE chat_id = ?
+        ON CONFLICT(chat_id, granularity, period_start, user_id) DO UPDATE SET
+            message_count = message_count + excluded.message_count
+    """, (new_chat_id, old_chat_id))
+    db.execute("DELETE FROM chat_stats_rollup WHERE chat_id = ?", (old_chat_id,))
+    db.execute("DELETE FROM user_stats_rollup WHERE chat_id = ?", (old_chat_id,))
+
+
+def rebuild_sync(db):
+    """Заполнить сводные таблицы из имеющихся дневных счетчиков (для существующих баз)"""
+    db.execute("DELETE FROM user_stats_rollup")
+    db.execute("DELETE FROM chat_stats_rollup")
+    for granularity, period_sql in ((WEEK, SQL_WEEK_START), (MONTH, SQL_MONTH_START)):
+        db.execute(f"""
+            INSERT INTO user_stats_rollup (chat_id, user_id, granularity, period_start, message_count)
+            SELECT chat_id, user_id, '{granularity}', {period_sql} AS period, SUM(message_count)
+            FROM user_daily_stats
+            WHERE chat_id IS NOT NULL AND user_id IS NOT NULL AND date IS NOT NULL
+            GROUP BY chat_id, user_id, period
+        """)
+        db.execute(f"""
+            INSERT INTO chat_stats_rollup (chat_id, granularity, period_start, message_count, active_days)
+            SELECT chat_id, '{granularity}', {period_sql} AS period,
+                   SUM(message_count), COUNT(DISTINCT date)
+            FROM daily_stats
+            WHERE chat_id IS NOT NULL AND date IS NOT NULL
+            GROUP BY chat_id, period
+        """)
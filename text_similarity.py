@@ -0,0 +1,201 @@
+"""
+Поиск почти одинаковых текстов для защиты от рейдов
+MinHash-сигнатуры по символьным шинглам и LSH-индекс по полосам сигнатуры:
+кандидаты находятся по совпадению полос, без попарного сравнения текстов.
+Используется только из цикла событий asyncio, поэтому блокировки не нужны.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+# Количество минимумов в сигнатуре (степень двойки) и разбиение на полосы
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+
+# Длина шингла и максимальная длина учитываемого текста
+SHINGLE_SIZE = 3
+MAX_TEXT_LENGTH = 2000
+
+_MASK64 = (1 << 64) - 1
+_BIN_BITS = NUM_PERM.bit_length() - 1
+_EMPTY = _MASK64 + 1
+_ROTATION = 1 << 56
+
+
+def _shingles(text: str) -> Set[str]:
+    """Множество символьных шинглов текста"""
+    text = text[:MAX_TEXT_LENGTH]
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """
+    MinHash-сигнатура текста (one permutation hashing):
+    каждый шингл хешируется один раз и попадает в одну из NUM_PERM корзин,
+    пустые корзины заполняются из соседних (densification).
+    """
+    mins = [_EMPTY] * NUM_PERM
+    for shingle in _shingles(text):
+        h = hash(shingle) & _MASK64
+        b = h & (NUM_PERM - 1)
+        v = h >> _BIN_BITS
+        if v < mins[b]:
+            mins[b] = v
+
+    if _EMPTY in mins:
+        original = mins[:]
+        for i in range(NUM_PERM):
+            if original[i] == _EMPTY:
+                # Ближайшая непустая корзина справа (по кругу) со смещением на расстояние
+                for step in range(1, NUM_PERM):
+                    src = original[(i + step) % NUM_PERM]
+                    if src != _EMPTY:
+                        mins[i] = src + step * _ROTATION
+                        break
+    return tuple(mins)
+
+
+def estimate_jaccard(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def jaccard_threshold(similarity_threshold: float) -> float:
+    """
+    Перевести similarity_threshold в порог Жаккара.
+    similarity_threshold задается в терминах SequenceMatcher.ratio() = 2M/T,
+    что соответствует коэффициенту Дайса: D = 2J / (1 + J), откуда J = D / (2 - D).
+    """
+    similarity_threshold = min(max(similarity_threshold, 0.0), 1.0)
+    return similarity_threshold / (2 - similarity_threshold)
+
+
+class NearDuplicateIndex:
+    """LSH-индекс недавних сообщений одного чата"""
+
+    __slots__ = ('entries', 'buckets', 'signatures', 'next_id', 'last_seen')
+
+    def __init__(self):
+        # (timestamp, entry_id, user_id) в порядке поступления
+        self.entries: deque = deque()
+        # (user_id, номер полосы, значения полосы) -> id записей
+        self.buckets: Dict[Hashable, Set[int]] = {}
+        self.signatures: Dict[int, Tuple[int, ...]] = {}
+        self.next_id = 0
+        self.last_seen = 0.0
+
+    @staticmethod
+    def _band_keys(user_id: int, signature: Tuple[int, ...]):
+        for band in range(BANDS):
+            yield (user_id, band, signature[band * ROWS:(band + 1) * ROWS])
+
+    def _drop_oldest(self):
+        _, entry_id, user_id = self.entries.popleft()
+        signature = self.signatures.pop(entry_id)
+        for key in self._band_keys(user_id, signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def expire(self, cutoff: float):
+        """Удалить записи старше cutoff"""
+        entries = self.entries
+        while entries and entries[0][0] < cutoff:
+            self._drop_oldest()
+
+    def add_and_count(self, user_id: int, signature: Tuple[int, ...], now: float,
+                      threshold: float, max_entries: int) -> int:
+        """
+        Добавить сообщение пользователя и вернуть количество его сообщений в индексе,
+        похожих на новое (включая само сообщение)
+        """
+        candidates: Set[int] = set()
+        for key in self._band_keys(user_id, signature):
+            bucket = self.buckets.get(key)
+            if bucket:
+                candidates.update(bucket)
+
+        similar = 1
+        for entry_id in candidates:
+            if estimate_jaccard(signature, self.signatures[entry_id]) >= threshold:
+                similar += 1
+
+        if len(self.entries) >= max_entries:
+            self._drop_oldest()
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries.append((now, entry_id, user_id))
+        self.signatures[entry_id] = signature
+        for key in self._band_keys(user_id, signature):
+            self.buckets.setdefault(key, set()).add(entry_id)
+        self.last_seen = now
+        return similar
+
+
+class NearDuplicateDetector:
+    """
+    Набор LSH-индексов по чатам с ограничением памяти:
+    не больше max_entries_per_chat записей на чат и max_chats чатов,
+    индексы без сообщений дольше idle_ttl секунд удаляются.
+    """
+
+    def __init__(self, max_entries_per_chat: int = 1000, max_chats: int = 10_000,
+                 idle_ttl: float = 600, sweep_every: int = 1000):
+        self.max_entries_per_chat = max_entries_per_chat
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self._indexes: "OrderedDict[int, NearDuplicateIndex]" = OrderedDict()
+        self._inserts = 0
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def check(self, chat_id: int, user_id: int, text: str, window_seconds: float,
+              similarity_threshold: float, now: Optional[float] = None) -> int:
+        """
+        Зарегистрировать нормализованный текст и вернуть количество похожих на него
+        сообщений пользователя в чате за окно (включая текущее)
+        """
+        if now is None:
+            now = time.monotonic()
+
+        index = self._indexes.get(chat_id)
+        if index is None:
+            index = NearDuplicateIndex()
+            self._indexes[chat_id] = index
+            if len(self._indexes) > self.max_chats:
+                self._indexes.popitem(last=False)
+        else:
+            self._indexes.move_to_end(chat_id)
+
+        index.expire(now - window_seconds)
+        similar = index.add_and_count(
+            user_id, minhash_signature(text), now,
+            jaccard_threshold(similarity_threshold), self.max_entries_per_chat
+        )
+
+        self._inserts += 1
+        if self._inserts % self.sweep_every == 0:
+            self.evict_idle(now)
+
+        return similar
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Удалить индексы чатов без сообщений дольше idle_ttl"""
+        if now is None:
+            now = time.monotonic()
+        cutoff = now - self.idle_ttl
+        removed = 0
+        while self._indexes:
+            chat_id, index = next(iter(self._indexes.items()))
+            if index.last_seen >= cutoff:
+                break
+            del self._indexes[chat_id]
+            removed += 1
+        return removed
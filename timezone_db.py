@@ -5,31 +5,44 @@ import sqlite3
 import asyncio
 import logging
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from db_pool import get_connection
+from migrations import run_migrations
+from bulk_purge import stage_ids, STAGED_IDS
 
 logger = logging.getLogger(__name__)
 
+try:
+    from config import TIMEZONE_DB_PATH
+except ImportError:
+    TIMEZONE_DB_PATH = "data/timezones.db"
+
+
+def _schema_v1(db):
+    """Исходная схема: таблица часовых поясов пользователей"""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_timezones (
+            user_id INTEGER PRIMARY KEY,
+            timezone_offset INTEGER NOT NULL DEFAULT 3,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
 
 class TimezoneDatabase:
     """Класс для работы с часовыми поясами пользователей"""
     
-    def __init__(self, db_path: str = "data/timezones.db"):
+    def __init__(self, db_path: str = TIMEZONE_DB_PATH):
         self.db_path = db_path
-        self._init_database()
     
-    def _init_database(self):
-        """Инициализация базы данных и создание таблиц"""
+    async def init_db(self):
+        """Инициализация базы данных: применение недостающих миграций схемы"""
         try:
-            with sqlite3.connect(self.db_path) as db:
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS user_timezones (
-                        user_id INTEGER PRIMARY KEY,
-                        timezone_offset INTEGER NOT NULL DEFAULT 3,
-                        updated_at TEXT NOT NULL
-                    )
-                """)
-                db.commit()
-                logger.info(f"База данных часовых поясов инициализирована: {self.db_path}")
+            await run_migrations(self.db_path, "базы часовых поясов", SCHEMA_MIGRATIONS)
         except Exception as e:
             logger.error(f"Ошибка при инициализации базы данных часовых поясов: {e}")
     
@@ -37,7 +50,7 @@ class TimezoneDatabase:
         """Получить часовой пояс пользователя (по умолчанию UTC+3)"""
         def _get_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     cur = db.execute(
                         "SELECT timezone_offset FROM user_timezones WHERE user_id = ?",
                         (user_id,)
@@ -61,7 +74,7 @@ class TimezoneDatabase:
         
         def _set_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("""
                         INSERT OR REPLACE INTO user_timezones (user_id, timezone_offset, updated_at)
                         VALUES (?, ?, ?)
@@ -82,7 +95,7 @@ class TimezoneDatabase:
         
         def _get_date_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     if sqlite_offset == 0:
                         cur = db.execute("SELECT date('now')")
                     else:
@@ -103,7 +116,7 @@ class TimezoneDatabase:
         
         def _get_datetime_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     if sqlite_offset == 0:
                         cur = db.execute("SELECT datetime('now')")
                     else:
@@ -140,7 +153,7 @@ class TimezoneDatabase:
         """Удалить часовой пояс пользователя"""
         def _delete_sync():
             try:
-                with sqlite3.connect(self.db_path) as db:
+                with get_connection(self.db_path) as db:
                     db.execute("DELETE FROM user_timezones WHERE user_id = ?", (user_id,))
                     db.commit()
                     logger.info(f"Часовой пояс пользователя {user_id} удален")
@@ -149,4 +162,22 @@ class TimezoneDatabase:
                 logger.error(f"Ошибка при удалении часового пояса пользователя {user_id}: {e}")
                 return False
         
-        return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
\ No newline at end of file
+        return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
+    
+    async def delete_users_bulk(self, user_ids: List[int]) -> bool:
+        """Удалить часовые пояса порции пользователей одной транзакцией"""
+        def _delete_sync():
+            try:
+                with get_connection(self.db_path) as db:
+                    stage_ids(db, user_ids)
+                    db.execute(f"DELETE FROM user_timezones WHERE user_id IN {STAGED_IDS}")
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка при пакетном удалении часовых поясов: {e}")
+                return False
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _delete_sync)
+
+
+# Глобальный экземпляр базы данных часовых поясов
+timezone_db = TimezoneDatabase()
@@ -0,0 +1,106 @@
+"""
+Снимок глобального топа чатов для кнопки «Топ чатов»
+Рейтинг пересчитывается планировщиком раз в TOP_CHATS_REFRESH_INTERVAL секунд,
+настройки показа (show_in_top, порог активности, метка «Частный») применяются
+при построении снимка. Нажатие кнопки читает готовую страницу из памяти.
+"""
+import asyncio
+import time
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import db
+from chat_options_store import chat_options_store
+
+logger = logging.getLogger(__name__)
+
+try:
+    from config import TOP_CHATS_DEFAULTS
+except ImportError:
+    TOP_CHATS_DEFAULTS = {'show_in_top': 'public_only', 'show_private_label': False, 'min_activity_threshold': 0}
+
+try:
+    from config import TOP_CHATS_DAYS, TOP_CHATS_SNAPSHOT_SIZE
+except ImportError:
+    TOP_CHATS_DAYS = 3
+    TOP_CHATS_SNAPSHOT_SIZE = 90
+
+
+class TopChatsLeaderboard:
+    """Рейтинг чатов по активности с уже примененными настройками показа"""
+
+    def __init__(self, days: int = TOP_CHATS_DAYS, size: int = TOP_CHATS_SNAPSHOT_SIZE):
+        self.days = days
+        self.size = size
+        # Рейтинг из БД без учета настроек (с запасом на отфильтрованные чаты)
+        self._ranked: List[Dict[str, Any]] = []
+        # Снимок для показа: неизменяемые записи чатов после фильтрации
+        self._snapshot: Tuple[Dict[str, Any], ...] = ()
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def refreshed_at(self) -> Optional[float]:
+        """Время последнего пересчета (time.time()) или None, если снимка еще нет"""
+        return self._refreshed_at
+
+    async def refresh(self):
+        """Пересчитать рейтинг из БД и построить новый снимок"""
+        async with self._refresh_lock:
+            # Берем в 3 раза больше, чтобы после фильтрации по настройкам осталось нужное количество
+            ranked = await db.get_top_chats_by_activity(
+                days=self.days,
+                limit=self.size * 3,
+                exclude_chat_ids=None,
+                include_private=True,  # Получаем и публичные, и частные
+                min_activity_threshold=0  # Фильтрацию по порогу делаем по настройкам чатов
+            )
+            self._ranked = ranked
+            self._snapshot = self._apply_settings(ranked)
+            self._refreshed_at = time.time()
+
+    def reapply_settings(self):
+        """Перестроить снимок после изменения настроек показа (без запроса к БД)"""
+        self._snapshot = self._apply_settings(self._ranked)
+
+    def _apply_settings(self, ranked: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], ...]:
+        visible = []
+        for chat in ranked:
+            settings = TOP_CHATS_DEFAULTS.copy()
+            settings.update(chat_options_store.get_top_chat_settings(chat['chat_id']))
+            show_in_top = settings.get('show_in_top', 'public_only')
+            is_public = chat.get('is_public', False)
+
+            # Проверяем, не исключен ли чат
+            if show_in_top == 'never':
+                continue
+            # Проверяем минимальный порог активности
+            if chat['total_messages'] < settings.get('min_activity_threshold', 0):
+                continue
+            # Проверяем видимость
+            if show_in_top == 'public_only' and not is_public:
+                continue
+
+            # Добавляем информацию о метке "Частный"
+            visible.append({
+                **chat,
+                'show_private_label': bool(settings.get('show_private_label', False)) and not is_public
+            })
+            if len(visible) >= self.size:
+                break
+        return tuple(visible)
+
+    async def get_page(self, page: int, per_page: int) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Страница рейтинга и общее количество чатов в снимке.
+        Если снимка еще нет (сразу после запуска), он строится при первом обращении.
+        """
+        if self._refreshed_at is None:
+            await self.refresh()
+        snapshot = self._snapshot
+        start = max(page, 0) * per_page
+        return [dict(chat) for chat in snapshot[start:start + per_page]], len(snapshot)
+
+
+# Глобальный снимок топа чатов
+top_chats_leaderboard = TopChatsLeaderboard()
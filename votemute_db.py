@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import os
 from pathlib import Path
+from db_pool import get_connection
+from migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,91 @@ try:
 except ImportError:
     BASE_PATH = Path(__file__).parent.absolute()
 
+
+def _schema_v1(db):
+    """Исходная схема: таблицы, колонки и индексы, которые раньше создавал init_db"""
+    # Таблица активных голосований
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS active_votes (
+            vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            target_user_id INTEGER,
+            creator_id INTEGER,
+            mute_duration INTEGER,
+            required_votes INTEGER,
+            vote_duration INTEGER,
+            created_at TEXT,
+            expires_at TEXT,
+            is_pinned BOOLEAN DEFAULT 0,
+            message_id INTEGER,
+            target_username TEXT,
+            target_first_name TEXT,
+            target_last_name TEXT,
+            creator_username TEXT,
+            creator_first_name TEXT,
+            creator_last_name TEXT
+        )
+    """)
+
+    # Таблица результатов голосования
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS vote_results (
+            vote_id INTEGER,
+            user_id INTEGER,
+            vote_type TEXT,
+            voted_at TEXT,
+            last_change_at TEXT,
+            PRIMARY KEY (vote_id, user_id),
+            FOREIGN KEY (vote_id) REFERENCES active_votes (vote_id)
+        )
+    """)
+
+    # Таблица кулдаунов на создание голосований
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS vote_cooldowns (
+            chat_id INTEGER PRIMARY KEY,
+            last_vote_created_at TEXT
+        )
+    """)
+
+    # Таблица истории завершенных голосований
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS vote_history (
+            vote_id INTEGER,
+            chat_id INTEGER,
+            target_user_id INTEGER,
+            creator_id INTEGER,
+            mute_duration INTEGER,
+            required_votes INTEGER,
+            vote_duration INTEGER,
+            created_at TEXT,
+            finished_at TEXT,
+            result TEXT,
+            reason TEXT,
+            votes_yes INTEGER,
+            votes_no INTEGER,
+            target_username TEXT,
+            target_first_name TEXT,
+            target_last_name TEXT,
+            creator_username TEXT,
+            creator_first_name TEXT,
+            creator_last_name TEXT
+        )
+    """)
+
+    # Создаем индексы для оптимизации
+    db.execute("CREATE INDEX IF NOT EXISTS idx_active_votes_chat ON active_votes (chat_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_active_votes_expires ON active_votes (expires_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_vote_results_vote ON vote_results (vote_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_vote_results_user ON vote_results (user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_vote_history_chat ON vote_history (chat_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_vote_history_target ON vote_history (target_user_id)")
+
+
+# Шаги миграции базы (номер шага = версия схемы в PRAGMA user_version)
+SCHEMA_MIGRATIONS = (_schema_v1,)
+
+
 class VoteMuteDatabase:
     """Класс для работы с базой данных голосований за мут"""
     
@@ -27,90 +114,8 @@ class VoteMuteDatabase:
         self.db_path = db_path
     
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        def _init_sync():
-            with sqlite3.connect(self.db_path) as db:
-                # Таблица активных голосований
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS active_votes (
-                        vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        target_user_id INTEGER,
-                        creator_id INTEGER,
-                        mute_duration INTEGER,
-                        required_votes INTEGER,
-                        vote_duration INTEGER,
-                        created_at TEXT,
-                        expires_at TEXT,
-                        is_pinned BOOLEAN DEFAULT 0,
-                        message_id INTEGER,
-                        target_username TEXT,
-                        target_first_name TEXT,
-                        target_last_name TEXT,
-                        creator_username TEXT,
-                        creator_first_name TEXT,
-                        creator_last_name TEXT
-                    )
-                """)
-                
-                # Таблица результатов голосования
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS vote_results (
-                        vote_id INTEGER,
-                        user_id INTEGER,
-                        vote_type TEXT,
-                        voted_at TEXT,
-                        last_change_at TEXT,
-                        PRIMARY KEY (vote_id, user_id),
-                        FOREIGN KEY (vote_id) REFERENCES active_votes (vote_id)
-                    )
-                """)
-                
-                # Таблица кулдаунов на создание голосований
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS vote_cooldowns (
-                        chat_id INTEGER PRIMARY KEY,
-                        last_vote_created_at TEXT
-                    )
-                """)
-                
-                # Таблица истории завершенных голосований
-                db.execute("""
-                    CREATE TABLE IF NOT EXISTS vote_history (
-                        vote_id INTEGER,
-                        chat_id INTEGER,
-                        target_user_id INTEGER,
-                        creator_id INTEGER,
-                        mute_duration INTEGER,
-                        required_votes INTEGER,
-                        vote_duration INTEGER,
-                        created_at TEXT,
-                        finished_at TEXT,
-                        result TEXT,
-                        reason TEXT,
-                        votes_yes INTEGER,
-                        votes_no INTEGER,
-                        target_username TEXT,
-                        target_first_name TEXT,
-                        target_last_name TEXT,
-                        creator_username TEXT,
-                        creator_first_name TEXT,
-                        creator_last_name TEXT
-                    )
-                """)
-                
-                # Создаем индексы для оптимизации
-                db.execute("CREATE INDEX IF NOT EXISTS idx_active_votes_chat ON active_votes (chat_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_active_votes_expires ON active_votes (expires_at)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_vote_results_vote ON vote_results (vote_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_vote_results_user ON vote_results (user_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_vote_history_chat ON vote_history (chat_id)")
-                db.execute("CREATE INDEX IF NOT EXISTS idx_vote_history_target ON vote_history (target_user_id)")
-                
-                db.commit()
-                logger.info("База данных голосований за мут инициализирована")
-        
-        await asyncio.get_event_loop().run_in_executor(None, _init_sync)
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        await run_migrations(self.db_path, "базы голосований за мут", SCHEMA_MIGRATIONS)
     
     async def create_vote(self, chat_id: int, target_user_id: int, creator_id: int,
                          mute_duration: int, required_votes: int, vote_duration: int,
@@ -119,7 +124,7 @@ class VoteMuteDatabase:
                          creator_username: str = None, creator_first_name: str = None, creator_last_name: str = None) -> int:
         """Создать новое голосование"""
         def _create_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 now = datetime.now()
                 expires_at = now + timedelta(minutes=vote_duration)
                 
@@ -143,7 +148,7 @@ class VoteMuteDatabase:
     async def get_active_vote(self, chat_id: int) -> Optional[Dict[str, Any]]:
         """Получить активное голосование в чате"""
         def _get_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 db.row_factory = sqlite3.Row
                 cursor = db.execute("""
                     SELECT * FROM active_votes 
@@ -160,7 +165,7 @@ class VoteMuteDatabase:
     async def get_vote_by_id(self, vote_id: int) -> Optional[Dict[str, Any]]:
         """Получить голосование по ID"""
         def _get_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 db.row_factory = sqlite3.Row
                 cursor = db.execute("SELECT * FROM active_votes WHERE vote_id = ?", (vote_id,))
                 row = cursor.fetchone()
@@ -171,7 +176,7 @@ class VoteMuteDatabase:
     async def add_vote(self, vote_id: int, user_id: int, vote_type: str) -> bool:
         """Добавить или изменить голос пользователя"""
         def _add_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 now = datetime.now()
                 
                 # Проверяем, есть ли уже голос от этого пользователя
@@ -209,7 +214,7 @@ class VoteMuteDatabase:
     async def get_vote_results(self, vote_id: int) -> Dict[str, int]:
         """Получить результаты голосования"""
         def _get_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.execute("""
                     SELECT vote_type, COUNT(*) as count 
                     FROM vote_results 
@@ -228,7 +233,7 @@ class VoteMuteDatabase:
     async def finish_vote(self, vote_id: int, result: str, reason: str) -> Optional[Dict[str, Any]]:
         """Завершить голосование и перенести в историю"""
         def _finish_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 # Получаем данные голосования
                 vote_cursor = db.execute("SELECT * FROM active_votes WHERE vote_id = ?", (vote_id,))
                 vote_data = vote_cursor.fetchone()
@@ -274,7 +279,7 @@ class VoteMuteDatabase:
     async def check_cooldown(self, chat_id: int) -> bool:
         """Проверить кулдаун создания голосований (3 минуты)"""
         def _check_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 cursor = db.execute("""
                     SELECT last_vote_created_at FROM vote_cooldowns 
                     WHERE chat_id = ?
@@ -292,7 +297,7 @@ class VoteMuteDatabase:
     async def set_cooldown(self, chat_id: int):
         """Установить кулдаун создания голосований"""
         def _set_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 db.execute("""
                     INSERT OR REPLACE INTO vote_cooldowns (chat_id, last_vote_created_at)
                     VALUES (?, ?)
@@ -304,7 +309,7 @@ class VoteMuteDatabase:
     async def cleanup_expired_votes(self):
         """Очистка истекших голосований"""
         def _cleanup_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 now = datetime.now().isoformat()
                 
                 # Получаем истекшие голосования
@@ -357,7 +362,7 @@ class VoteMuteDatabase:
     async def update_vote_message_id(self, vote_id: int, message_id: int):
         """Обновить message_id голосования"""
         def _update_sync():
-            with sqlite3.connect(self.db_path) as db:
+            with get_connection(self.db_path) as db:
                 db.execute("""
                     UPDATE active_votes 
                     SET message_id = ? 